@@ -1,4 +1,5 @@
 from .bt_baktest import run_bt_backtest
-from .pd_backtest import run_pd_backtest
+from .pd_backtest import run_pd_backtest, run_np_backtest, run_pd_backtest_matrix
+from .event_backtest import run_event_backtest
 from .return_rate_calculations import cal_avg_cum_ret, cum_ret_to_daily_ret, avg_cum_ret_from_cursor
 
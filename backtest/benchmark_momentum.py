@@ -0,0 +1,37 @@
+"""
+比较momentum的向量化实现与逐窗口调用lambda的rolling apply的计算时间。
+用法：python benchmark_momentum.py 5000 240
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from backtest.indicators import momentum
+
+
+def momentum_by_rolling_apply(close, timeperiod):
+    """原来逐窗口调用lambda的实现，作为对照。"""
+    return close.rolling(timeperiod + 1).apply(lambda x: x.iloc[-1] / x.iloc[0] - 1).shift(1)
+
+
+def benchmark(bars, timeperiod):
+    rng = np.random.default_rng(0)
+    close = pd.Series(3000 + rng.standard_normal(bars).cumsum())
+
+    start = time.perf_counter()
+    expected = momentum_by_rolling_apply(close, timeperiod)
+    rolling_apply_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    res = momentum(close, timeperiod)
+    vectorized_time = time.perf_counter() - start
+
+    assert np.array_equal(expected.values, res.values, equal_nan=True)
+    print(f'momentum on {bars} bars: rolling apply {rolling_apply_time:.3f}s, vectorized {vectorized_time:.4f}s, '
+          f'speedup: {rolling_apply_time / max(vectorized_time, 1e-9):.1f}x')
+
+
+if __name__ == '__main__':
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 5000, int(sys.argv[2]) if len(sys.argv) > 2 else 240)
@@ -101,7 +101,9 @@ class Strategy(bt.Strategy):
             order = self.buy(size=size - self.position.size, coc=False)
             self.position_direction = 1
 
-            self.log(f'创建开仓订单 {order.ref} 将仓位买至 {size}, 买入 {size - self.position.size}')
+            # 已持有目标仓位时不产生订单，buy返回None
+            if order is not None:
+                self.log(f'创建开仓订单 {order.ref} 将仓位买至 {size}, 买入 {size - self.position.size}')
 
         # 平多开空
         elif self.datas[0].shortgo and self.position_direction >= 0:
@@ -113,7 +115,9 @@ class Strategy(bt.Strategy):
             order = self.sell(size=size + self.position.size, coc=False)
             self.position_direction = -1
 
-            self.log(f'创建开仓订单 {order.ref} 将仓位卖至 {-size}, 卖出 {size + self.position.size}')
+            # 已持有目标仓位时不产生订单，sell返回None
+            if order is not None:
+                self.log(f'创建开仓订单 {order.ref} 将仓位卖至 {-size}, 卖出 {size + self.position.size}')
 
         # 2.平仓=================
         # 平多
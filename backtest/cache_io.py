@@ -0,0 +1,211 @@
+"""
+行情缓存的读写。
+
+每段行情数据可以保存为CSV文件<idx>.csv，也可以保存为列式二进制格式：目录<idx>/中每个字段
+保存为一个.npy文件，字段顺序记录在columns.json中。二进制格式保留字段类型，读取时无需解析文本，
+数值字段还可以内存映射的方式打开。
+"""
+import json
+import os
+from collections import OrderedDict
+from collections.abc import Mapping, Sequence
+
+import numpy as np
+import pandas as pd
+
+from utils import mkdirs
+
+CSV = 'csv'
+NPY = 'npy'
+DEFAULT_FORMAT = NPY
+COLUMNS_FILE = 'columns.json'
+INDEX_FILE = 'index.json'
+
+
+def get_slice_path(category_path, idx, fmt=DEFAULT_FORMAT):
+    """数据段在品种缓存目录中的路径。"""
+    if fmt == CSV:
+        return os.path.join(category_path, f'{idx}.csv')
+    elif fmt == NPY:
+        return os.path.join(category_path, str(idx))
+    raise ValueError(f'Unknown cache format {fmt}!')
+
+
+def write_slice(df, category_path, idx, fmt=DEFAULT_FORMAT):
+    """
+    将一段行情数据写入品种缓存目录。
+    params:
+        - df: 一段连续的行情数据。
+        - category_path: 品种缓存目录，如cache/daily/A。
+        - idx: 数据段序号。
+        - fmt: 缓存格式，CSV或NPY。
+    """
+    mkdirs(category_path)
+    if fmt == CSV:
+        df.to_csv(get_slice_path(category_path, idx, fmt), encoding='utf-8', index=False)
+    elif fmt == NPY:
+        path = get_slice_path(category_path, idx, fmt)
+        mkdirs(path)
+        for column in df.columns:
+            values = df[column].to_numpy()
+            np.save(os.path.join(path, f'{column}.npy'), values, allow_pickle=values.dtype == object)
+        with open(os.path.join(path, COLUMNS_FILE), 'w') as f:
+            json.dump(list(df.columns), f)
+    else:
+        raise ValueError(f'Unknown cache format {fmt}!')
+
+
+def _load_column(path, mmap_mode):
+    try:
+        return np.load(path, mmap_mode=mmap_mode)
+    except ValueError:
+        # 字符串等Python对象字段无法内存映射
+        return np.load(path, allow_pickle=True)
+
+
+def read_slice(slice_path, mmap_mode=None):
+    """
+    读取一段行情数据。
+    params:
+        - slice_path: CSV文件<idx>.csv或二进制缓存目录<idx>。
+        - mmap_mode: 二进制缓存中数值字段的内存映射模式，见numpy.load。
+    """
+    if not os.path.isdir(slice_path):
+        return pd.read_csv(slice_path, parse_dates=['datetime'])
+
+    with open(os.path.join(slice_path, COLUMNS_FILE)) as f:
+        columns = json.load(f)
+    data = {column: _load_column(os.path.join(slice_path, f'{column}.npy'), mmap_mode) for column in columns}
+    # 不复制数据，各字段保持为内存映射的数组
+    return pd.DataFrame(data, columns=columns, copy=False)
+
+
+def list_slices(category_path):
+    """
+    列出品种缓存目录中的全部数据段。同一序号同时存在两种格式时使用二进制缓存。
+    数据段按文件名排序，与Windows上os.listdir列出CSV缓存的顺序相同，因而数据段的序号保持不变。
+    """
+    slices = {}
+    for name in sorted(os.listdir(category_path)):
+        path = os.path.join(category_path, name)
+        if os.path.isdir(path):
+            slices[name] = path
+        elif name.endswith('.csv'):
+            slices.setdefault(name[:-len('.csv')], path)
+    return [slices[name] for name in sorted(slices)]
+
+
+def list_cache(level_root_path):
+    """列出一个级别下每个品种的全部数据段。"""
+    return {category: list_slices(os.path.join(level_root_path, category))
+            for category in os.listdir(level_root_path)
+            if os.path.isdir(os.path.join(level_root_path, category))}
+
+
+def slice_name(slice_path):
+    """数据段的名称，即不含扩展名的序号。"""
+    name = os.path.basename(slice_path)
+    return name[:-len('.csv')] if name.endswith('.csv') else name
+
+
+def write_index(level_root_path):
+    """
+    将一个级别下每个品种的数据段名称写入索引文件。生成或更新缓存后应重新写入索引。
+    """
+    index = {category: [slice_name(path) for path in slice_paths]
+             for category, slice_paths in list_cache(level_root_path).items()}
+    with open(os.path.join(level_root_path, INDEX_FILE), 'w') as f:
+        json.dump(index, f)
+
+
+def read_index(level_root_path):
+    """读取索引文件。没有索引文件时列出目录得到同样的结果。"""
+    index_path = os.path.join(level_root_path, INDEX_FILE)
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            return json.load(f)
+    return {category: [slice_name(path) for path in slice_paths]
+            for category, slice_paths in list_cache(level_root_path).items()}
+
+
+class LazySlices(Sequence):
+    """一个品种的全部数据段，访问时由所属的LazyCache读取。"""
+
+    def __init__(self, cache, category):
+        self.cache = cache
+        self.category = category
+
+    def __len__(self):
+        return len(self.cache.index.get(self.category, []))
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(len(self))[idx]]
+        if not -len(self) <= idx < len(self):
+            raise IndexError(f'{self.category} has no slice {idx}!')
+        return self.cache.load(self.category, idx % len(self))
+
+
+class LazyCache(Mapping):
+    """
+    一个级别的全部缓存，形如{品种: [数据段, ...]}。
+    品种与数据段数量来自索引文件，数据段在首次访问时才读取，最近访问的maxsize段保存在LRU中。
+    二进制缓存以内存映射方式打开，多个进程读取同一段数据时共享操作系统的页缓存。
+    没有缓存的品种对应空的数据段序列。
+    """
+
+    def __init__(self, level_root_path, maxsize=32):
+        self.level_root_path = level_root_path
+        self.index = read_index(level_root_path)
+        self.maxsize = maxsize
+        self._loaded = OrderedDict()
+
+    def __getitem__(self, category):
+        return LazySlices(self, category)
+
+    def __contains__(self, category):
+        return category in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def _slice_path(self, category, idx):
+        slice_path = os.path.join(self.level_root_path, category, self.index[category][idx])
+        return slice_path if os.path.isdir(slice_path) else slice_path + '.csv'
+
+    def slice_length(self, category, idx):
+        """数据段的行数。二进制缓存只读取第一个字段的文件头，不读取数据。"""
+        slice_path = self._slice_path(category, idx)
+        if not os.path.isdir(slice_path):
+            return len(self.load(category, idx))
+        with open(os.path.join(slice_path, COLUMNS_FILE)) as f:
+            column = json.load(f)[0]
+        return len(_load_column(os.path.join(slice_path, f'{column}.npy'), 'r'))
+
+    def load(self, category, idx):
+        key = (category, idx)
+        if key in self._loaded:
+            self._loaded.move_to_end(key)
+            return self._loaded[key]
+
+        df = read_slice(self._slice_path(category, idx), mmap_mode='r')
+
+        self._loaded[key] = df
+        if len(self._loaded) > self.maxsize:
+            self._loaded.popitem(last=False)
+        return df
+
+
+def convert_cache(level_root_path, fmt=NPY):
+    """将一个级别下所有CSV缓存转存为fmt格式，原CSV文件保留。"""
+    for category in os.listdir(level_root_path):
+        category_path = os.path.join(level_root_path, category)
+        if not os.path.isdir(category_path):
+            continue
+        for name in os.listdir(category_path):
+            if name.endswith('.csv'):
+                df = read_slice(os.path.join(category_path, name))
+                write_slice(df, category_path, name[:-len('.csv')], fmt)
@@ -0,0 +1,138 @@
+"""
+行情缓存的增量更新。
+
+生成缓存时为每个品种记录高水位标记：已处理数据的最后时间end、每个数据段的起止时间segments与名称names、
+最后一段数据的复权锚点anchor，分钟级缓存还记录最后一根bar的第一分钟在分钟数据文件中的起始字节offset。
+一个级别下的全部标记保存在该级别目录的_watermarks.json中。
+
+有新数据时，重新划分数据段并与标记比较：
+    - 之前的数据段不变，最后一段的起点不变：以时间不早于end的行替换最后一段中的同时间的行并追加其后的行，
+      复权价格从锚点接续计算；新增的数据段单独写入。上次生成缓存时尚未结束的最后一根bar因此被重新合成的bar替换。
+    - 任何一个已有数据段的边界移动了：增量更新不再适用，由调用者重建该品种的缓存。
+"""
+import json
+import os
+
+import pandas as pd
+
+from backtest.cache_io import write_slice, read_slice, get_slice_path, DEFAULT_FORMAT
+from backtest.signals import add_cache_signals, extend_cache_signals
+
+WATERMARK_FILE = '_watermarks.json'
+
+
+def read_watermarks(level_root_path):
+    """读取一个级别下每个品种的高水位标记。没有标记文件时返回空字典。"""
+    path = os.path.join(level_root_path, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_watermarks(level_root_path, watermarks):
+    with open(os.path.join(level_root_path, WATERMARK_FILE), 'w') as f:
+        json.dump(watermarks, f, indent=1)
+
+
+def segment_bounds(segments):
+    """各段数据的起止时间。"""
+    return [(df['datetime'].iloc[0], df['datetime'].iloc[-1]) for df in segments]
+
+
+def build_slices(category_path, segments, bounds, end, fmt=DEFAULT_FORMAT, intraday=False, report=print,
+                 names=None):
+    """
+    为每段数据添加换合约标记与前复权价格并写入缓存，返回高水位标记。
+    preclose或close中有0的数据段不写入缓存，只报告受影响的行数。
+    params:
+        - category_path: 品种缓存目录。
+        - segments: 各段行情数据。没有数据的段不写入缓存，其序号空缺。
+        - bounds: 各段数据的起止时间[(start, end), ...]，与segments一一对应。
+        - end: 已处理数据的最后时间。
+        - intraday: 是否为日内数据。
+        - report: 报告错误的函数。
+        - names: 各段数据在缓存中的名称，与segments一一对应。默认为数据段的序号。
+    """
+    names = range(len(segments)) if names is None else names
+    anchor = _write_new_slices(category_path, segments, names, 0, fmt, intraday, report)
+    return _watermark(end, bounds, anchor, names)
+
+
+def _watermark(end, bounds, anchor, names):
+    return {'end': str(end), 'segments': [[str(start), str(stop)] for start, stop in bounds],
+            'anchor': None if anchor is None else list(anchor), 'names': [str(name) for name in names]}
+
+
+def _write_new_slices(category_path, segments, names, first, fmt, intraday, report):
+    """写入第first段及之后的数据，没有数据的段跳过。返回最后一段的复权锚点。"""
+    anchor = None
+    for i in range(first, len(segments)):
+        df = segments[i].copy()
+        if len(df) == 0:
+            anchor = None
+            continue
+        zero_rows, anchor = add_cache_signals(df, intraday)
+        if zero_rows:
+            report(f'Error with {category_path} {names[i]}: {zero_rows} rows with zero preclose or close')
+        else:
+            write_slice(df, category_path, names[i], fmt)
+    return anchor
+
+
+def update_slices(category_path, segments, bounds, end, watermark, fmt=DEFAULT_FORMAT, intraday=False,
+                  complete=True, report=print, names=None):
+    """
+    增量更新一个品种的缓存。只处理时间不早于watermark['end']的行，缓存中时间不早于watermark['end']的行被替换。
+    params:
+        - segments: 重新划分后的各段行情数据。只需包括时间不早于watermark['end']的行。
+        - bounds: 重新划分后各段数据的起止时间。
+        - end: 已处理数据的最后时间。
+        - watermark: 上次生成缓存时的高水位标记。
+        - complete: segments是否包括每段数据的全部行。不包括时，起点早于watermark['end']的新数据段无法生成。
+        - 其余参数同build_slices。
+    return:
+        - 新的高水位标记。无法增量更新时返回None，需重建该品种的缓存。
+    """
+    old_bounds = [tuple(b) for b in watermark['segments']]
+    bounds = [(str(start), str(stop)) for start, stop in bounds]
+    last_end = pd.Timestamp(watermark['end'])
+    n = len(old_bounds)
+    names = range(len(segments)) if names is None else names
+
+    # 之前的数据段不变，最后一段只能向后延伸
+    if len(bounds) < n or bounds[:n - 1] != old_bounds[:n - 1]:
+        return None
+    # 数据段的名称不变。没有记录名称的标记由之前的版本生成，其中的名称为序号
+    if [str(name) for name in names[:n]] != watermark.get('names', [str(i) for i in range(n)]):
+        return None
+    if n > 0 and (bounds[n - 1][0] != old_bounds[-1][0] or
+                  pd.Timestamp(bounds[n - 1][1]) < pd.Timestamp(old_bounds[-1][1])):
+        return None
+    if not complete and any(pd.Timestamp(start) < last_end for start, _ in bounds[n:]):
+        return None
+
+    anchor = watermark['anchor']
+    if n > 0:
+        new_rows = segments[n - 1][segments[n - 1]['datetime'] >= last_end]
+        if len(new_rows) > 0:
+            if anchor is None:
+                # 最后一段数据没有写入缓存
+                return None
+            cached = read_slice(get_slice_path(category_path, names[n - 1], fmt))
+            stale = int((cached['datetime'] >= last_end).sum())
+            if stale:
+                # 时间为watermark['end']的最后一行可能是当时尚未结束的bar，去掉后从倒数第二行的复权因子接续计算
+                if stale > 1 or len(cached) == 1 or len(anchor) < 3 or anchor[2] is None:
+                    return None
+                cached = cached.iloc[:-1]
+                anchor = (anchor[2], anchor[1], None)
+            zero_rows, extended, anchor = extend_cache_signals(cached, new_rows, anchor, intraday)
+            if zero_rows:
+                report(f'Error with {category_path} {names[n - 1]}: {zero_rows} new rows with zero preclose or close')
+                return None
+            write_slice(extended, category_path, names[n - 1], fmt)
+
+    if len(bounds) > n:
+        anchor = _write_new_slices(category_path, segments, names, n, fmt, intraday, report)
+    return _watermark(end, bounds, anchor, names)
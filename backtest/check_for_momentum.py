@@ -2,7 +2,7 @@ import numpy as np
 import pandas as pd
 from scipy.stats import spearmanr
 
-from utils import query
+from backtest.result_store import MongoStore
 from backtest.return_rate_calculations import cum_ret_from_doc
 
 
@@ -49,10 +49,14 @@ def sig_neg_related(df):
     return len(df[(df['corr'] < 0) & (df.p_value < 0.1)]) / len(df)
 
 
-def get_cum_ret_dict(db_name, col, **kwargs):
-    """获取每次回测的累计收益率。各品种在不同的回测时期上算作不同的品种。"""
+def get_cum_ret_dict(db_name, col, store=None, **kwargs):
+    """
+    获取每次回测的累计收益率。各品种在不同的回测时期上算作不同的品种。
+    store为回测结果的存储，默认为MongoDB中的db_name.col。
+    """
     cum_ret_dict = {}
-    cursor = query(db_name=db_name, col=col, **kwargs)
+    store = store or MongoStore(db_name, col)
+    cursor = store.find(**kwargs)
     for doc in cursor:
         c = doc['params']['category']
         i = doc['params']['idx']
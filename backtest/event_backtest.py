@@ -0,0 +1,288 @@
+"""
+不依赖backtrader的事件驱动回测引擎。
+
+实现与backtest.bt_baktest.Strategy相同的交易逻辑：在开盘时开仓、平仓，在换合约前一根bar收盘时平掉旧合约，
+在换合约的bar开盘时开回价值相近的新合约；按手数取整，按成交金额收取手续费，以现金与持仓计算账户价值。
+
+与run_bt_backtest一样，每根bar被拆分为两个时刻：
+    - 开盘时刻：开盘价为open，收盘价为(open + high + low) / 3；
+    - 收盘时刻：开盘价与收盘价均为close。
+每个时刻依次：执行策略的开盘逻辑并以该时刻的开盘价成交 -> 检查资金、成交订单 -> 以该时刻的收盘价计算账户价值
+-> 执行策略的收盘逻辑（换合约前平仓的订单在之后第一个时刻以收盘价成交）。订单的资金检查、持仓均价、
+现金变动的计算顺序均与backtrader的BackBroker一致，因此结果与run_bt_backtest相同。
+
+run_bt_backtest的DaySplitter_Close会丢弃同一天的第二根及之后的bar，只适用于日级数据；
+本引擎逐根处理bar，同样适用于15min、30min等分钟级数据。
+"""
+import numpy as np
+import pandas as pd
+
+from backtest.kernels import jit, as_bool_array, as_float_array
+
+# 订单类型
+MARKET = 0  # 以当前时刻开盘价成交
+CLOSE = 1  # 以之后第一个时刻的收盘价成交
+# 订单标记
+NO_FLAG = 0
+CHG_OPEN = 1  # 换合约时平掉旧合约，成交后记录持仓价值
+CHG_CLOSE = 2  # 换合约时开回新合约，成交后清除持仓价值
+
+
+@jit
+def _position_update(pos, pprice, size, price):
+    """与backtrader的Position.update相同。返回新的持仓、持仓均价，以及size中用于开仓、平仓的数量。"""
+    new_pos = pos + size
+    if new_pos == 0:
+        return new_pos, 0.0, 0, size
+    if pos == 0:
+        return new_pos, price, size, 0
+    if pos > 0:
+        if size > 0:
+            return new_pos, (pprice * pos + size * price) / new_pos, size, 0
+        if new_pos > 0:
+            return new_pos, pprice, 0, size
+        return new_pos, price, new_pos, -pos
+    if size < 0:
+        return new_pos, (pprice * pos + size * price) / new_pos, size, 0
+    if new_pos < 0:
+        return new_pos, pprice, 0, size
+    return new_pos, price, new_pos, -pos
+
+
+@jit
+def _pseudo_execute(cash, pos, pprice, size, price, commission):
+    """提交订单时的资金检查。返回成交后的现金与持仓，现金为负时订单被拒绝。"""
+    pos, pprice, opened, closed = _position_update(pos, pprice, size, price)
+    if closed != 0:
+        cash += -closed * price
+        cash -= abs(closed) * commission * price
+    if opened != 0:
+        cash -= opened * price
+        cash -= abs(opened) * commission * price
+    return cash, pos, pprice
+
+
+@jit
+def _execute(cash, pos, pprice, size, price, commission):
+    """
+    成交订单。现金不足以开仓时只执行平仓部分。
+    return:
+        - cash, pos, pprice: 成交后的现金、持仓、持仓均价。
+        - executed: 实际成交的数量。
+    """
+    _, _, opened, closed = _position_update(pos, pprice, size, price)
+    if closed != 0:
+        pnl = -closed * (price - pprice) * 1.0
+        cash += -closed * pprice + pnl
+        cash -= abs(closed) * commission * price
+    if opened != 0:
+        new_cash = cash - opened * price
+        new_cash -= abs(opened) * commission * price
+        if new_cash < 0.0:
+            opened = 0
+        else:
+            cash = new_cash
+    executed = closed + opened
+    if executed != 0:
+        pos, pprice, _, _ = _position_update(pos, pprice, executed, price)
+    return cash, pos, pprice, executed
+
+
+@jit
+def _account_value(cash, pos, pprice, price):
+    """账户价值，计算顺序与BackBroker._get_value一致。"""
+    value = pos * price
+    if value > 0:
+        unrealized = pos * (price - pprice) * 1.0
+        return cash + ((value - unrealized) / 1.0 + unrealized)
+    return cash + (0.0 + value)
+
+
+@jit
+def _size_of_value(value, price, hand, nearest):
+    """value资金能交易的单位数。开仓向下取整，换仓四舍五入（银行家舍入，与round相同）。"""
+    lots = value / (price * hand)
+    lots = np.rint(lots) if nearest else np.trunc(lots)
+    return max(int(lots), 1) * hand
+
+
+@jit
+def event_backtest_kernel(open_, high, low, close, longgo, shortgo, long_exit, short_exit, c_chg, next_c_chg,
+                          cash, commission, hand):
+    """
+    逐bar回测。
+    params:
+        - open_, high, low, close: 价格数组。
+        - longgo, shortgo, long_exit, short_exit, c_chg, next_c_chg: 信号布尔数组。
+        - cash: 初始资金。
+        - commission: 手续费率。
+        - hand: 每手的单位数。
+    return:
+        - cum_ret: 每根bar收盘时的累计收益率。
+        - value: 每根bar收盘时的账户价值。
+        - position: 每根bar收盘时的持仓单位数，多头为正，空头为负。
+    """
+    n = len(close)
+    cum_ret = np.ones(n)
+    values = np.zeros(n)
+    positions = np.zeros(n, dtype=np.int64)
+
+    pos = 0
+    pprice = 0.0
+    value = cash
+    prev_value = cash
+    prev_cum_ret = 1.0
+    position_direction = 0
+    chg_value = 0.0
+
+    # 本时刻提交的订单，最多为开仓、平仓、换仓各一个，加上之前提交的换合约平仓订单
+    order_size = np.zeros(4, dtype=np.int64)
+    order_type = np.zeros(4, dtype=np.int64)
+    order_flag = np.zeros(4, dtype=np.int64)
+    order_price = np.zeros(4)  # 资金检查使用的价格
+    accepted = np.zeros(4, dtype=np.bool_)
+    # 上一时刻收盘时提交的换合约平仓订单
+    close_size = 0
+    close_created_price = 0.0
+    exec_flag = np.zeros(4, dtype=np.int64)
+    exec_value = np.zeros(4)
+
+    for i in range(n):
+        for tick in range(2):
+            if tick == 0:
+                tick_open, tick_close = open_[i], (open_[i] + high[i] + low[i]) / 3.0
+            else:
+                tick_open, tick_close = close[i], close[i]
+            # 与backtrader一致，第一个时刻不执行开盘逻辑
+            on_open = i > 0 or tick == 1
+            count = 0
+
+            # 上一时刻提交的订单先于本时刻的订单处理
+            if close_size != 0:
+                order_size[count] = close_size
+                order_type[count] = CLOSE
+                order_flag[count] = CHG_OPEN
+                order_price[count] = close_created_price
+                count += 1
+                close_size = 0
+
+            # 1.开仓
+            if on_open and longgo[i] and position_direction <= 0:
+                chg_value = 0.0
+                size = _size_of_value(value * 0.98, tick_open, hand, False)
+                if size - pos != 0:
+                    order_size[count] = abs(size - pos)
+                    order_type[count] = MARKET
+                    order_flag[count] = NO_FLAG
+                    order_price[count] = tick_open
+                    count += 1
+                position_direction = 1
+            elif on_open and shortgo[i] and position_direction >= 0:
+                chg_value = 0.0
+                size = _size_of_value(value * 0.98, tick_open, hand, False)
+                if size + pos != 0:
+                    order_size[count] = -abs(size + pos)
+                    order_type[count] = MARKET
+                    order_flag[count] = NO_FLAG
+                    order_price[count] = tick_open
+                    count += 1
+                position_direction = -1
+
+            # 2.平仓。换合约后尚未开回新合约时，只需放弃开回新合约
+            if on_open and long_exit[i] and position_direction > 0:
+                if chg_value != 0:
+                    chg_value = 0.0
+                elif pos != 0:
+                    order_size[count] = -abs(pos)
+                    order_type[count] = MARKET
+                    order_flag[count] = NO_FLAG
+                    order_price[count] = tick_open
+                    count += 1
+                position_direction = 0
+            elif on_open and short_exit[i] and position_direction < 0:
+                if chg_value != 0:
+                    chg_value = 0.0
+                elif pos != 0:
+                    order_size[count] = abs(pos)
+                    order_type[count] = MARKET
+                    order_flag[count] = NO_FLAG
+                    order_price[count] = tick_open
+                    count += 1
+                position_direction = 0
+
+            # 3.换仓：开盘时另一合约开仓
+            if on_open and c_chg[i] and pos == 0 and chg_value != 0:
+                if chg_value < 0:
+                    order_size[count] = _size_of_value(-chg_value, tick_open, hand, True)
+                else:
+                    order_size[count] = -_size_of_value(chg_value, tick_open, hand, True)
+                order_type[count] = MARKET
+                order_flag[count] = CHG_CLOSE
+                order_price[count] = tick_open
+                count += 1
+
+            # 资金检查，拒绝使现金为负的订单
+            check_cash, check_pos, check_pprice = cash, pos, pprice
+            for k in range(count):
+                check_cash, check_pos, check_pprice = _pseudo_execute(check_cash, check_pos, check_pprice,
+                                                                      order_size[k], order_price[k], commission)
+                accepted[k] = check_cash >= 0.0
+
+            # 成交
+            executed_count = 0
+            for k in range(count):
+                if not accepted[k]:
+                    continue
+                if order_type[k] == CLOSE:
+                    # 开盘时刻提交的订单以当天收盘价成交，收盘时刻提交的订单以下一根bar开盘时刻的收盘价成交
+                    exec_price = tick_close
+                else:
+                    exec_price = tick_open
+                cash, pos, pprice, executed = _execute(cash, pos, pprice, order_size[k], exec_price, commission)
+                if executed == order_size[k]:
+                    exec_flag[executed_count] = order_flag[k]
+                    exec_value[executed_count] = (0.0 + executed * exec_price) / executed * executed
+                    executed_count += 1
+            value = _account_value(cash, pos, pprice, tick_close)
+
+            # 成交回报
+            for k in range(executed_count):
+                if exec_flag[k] == CHG_OPEN:
+                    chg_value = exec_value[k]
+                elif exec_flag[k] == CHG_CLOSE:
+                    chg_value = 0.0
+
+            # 收盘时此合约平仓
+            if next_c_chg[i] and pos != 0 and chg_value == 0:
+                close_size = -pos
+                close_created_price = tick_close
+
+        # 收盘时刻结束时记录累计收益率
+        prev_cum_ret = prev_cum_ret * (value / prev_value)
+        prev_value = value
+        cum_ret[i] = prev_cum_ret
+        values[i] = value
+        positions[i] = pos
+
+    return cum_ret, values, positions
+
+
+def run_event_backtest(df, cash=2000000, commission=0.0001, hand=1):
+    """
+    事件驱动回测，与run_bt_backtest结果相同，且适用于分钟级数据。
+    params:
+        - df: 一段连续的行情数据。需要行情中包括datetime, open, high, low, close,
+              以及longgo, shortgo, long_exit, short_exit, c_chg, next_c_chg。
+        - cash: 初始资金。
+        - commission: 手续费率。
+        - hand: 每手的单位数。
+    return:
+        - 以datetime为索引的累计收益率cum_ret。
+    """
+    cum_ret, _, _ = event_backtest_kernel(as_float_array(df.open), as_float_array(df.high),
+                                          as_float_array(df.low), as_float_array(df.close),
+                                          as_bool_array(df.longgo), as_bool_array(df.shortgo),
+                                          as_bool_array(df.long_exit), as_bool_array(df.short_exit),
+                                          as_bool_array(df.c_chg), as_bool_array(df.next_c_chg),
+                                          float(cash), commission, hand)
+    return pd.DataFrame(index=pd.DatetimeIndex(df.datetime.values), data={'cum_ret': cum_ret})
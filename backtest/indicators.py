@@ -1,7 +1,14 @@
 from functools import wraps
 import talib
+import numpy as np
 import pandas as pd
 
+from backtest.kernels import numba, as_float_array
+from backtest.memo import memoize
+from backtest.rolling import rolling_mean_kernel, rolling_max_kernel, rolling_min_kernel
+
+ROLLING_KERNELS = {'mean': rolling_mean_kernel, 'max': rolling_max_kernel, 'min': rolling_min_kernel}
+
 
 class AllNaError(Exception):
     pass
@@ -17,6 +24,16 @@ def not_full_of_na(f):
     return decorated
 
 
+def rolling(s: pd.Series, window, how):
+    """
+    与getattr(s.rolling(window), how)()结果相同，how为'mean'、'max'或'min'。
+    安装了numba时使用编译后的滑动窗口内核，否则使用pandas。
+    """
+    if numba is None:
+        return getattr(s.rolling(window), how)()
+    return pd.Series(ROLLING_KERNELS[how](as_float_array(s), window), index=s.index, name=s.name)
+
+
 @not_full_of_na
 def EMA(s: pd.Series, timeperiod):
     alpha = 2 / (timeperiod + 1)
@@ -31,7 +48,7 @@ def SMA(s, timeperiod, weight):
 
 @not_full_of_na
 def MA(s, timeperiod):
-    return s.rolling(timeperiod).mean()
+    return rolling(s, timeperiod, 'mean')
 
 
 @not_full_of_na
@@ -42,7 +59,7 @@ def HHV(high: pd.Series, length: int):
         - high: 最高价序列。
         - length: 最近周期长度。
     """
-    return high.rolling(length).max()
+    return rolling(high, length, 'max')
 
 
 @not_full_of_na
@@ -53,9 +70,10 @@ def LLV(low: pd.Series, length: int):
         - high: 最低价序列。
         - length: 最近周期长度。
     """
-    return low.rolling(length).min()
+    return rolling(low, length, 'min')
 
 
+@memoize
 @not_full_of_na
 def CCI(high, low, close, timeperiod):
     return talib.CCI(high, low, close, timeperiod)
@@ -63,16 +81,17 @@ def CCI(high, low, close, timeperiod):
 
 @not_full_of_na
 def BARSLAST(cond: pd.Series):
-    # 将k线分组，满足条件的k线为组内第一根， 不满足条件的k线与上一根满足条件的一组
-    cond_group = cond.cumsum()
-    # 在每一组内生成自然数序列，即为到组内第一根k线的距离
-    distance = cond_group.groupby(cond_group).cumcount()
-    # 序号为0的那组中没有满足条件的k线，结果为-1
-    distance.loc[cond_group == 0] = -1
-
-    return distance
+    index = cond.index
+    cond = np.asarray(cond.fillna(False), dtype=bool)
+    bar_idx = np.arange(len(cond))
+    # 每根k线之前（包括自身）最近一根满足条件的k线的序号，尚无满足条件的k线时为-1
+    last_idx = np.maximum.accumulate(np.where(cond, bar_idx, -1))
+    # 到最近一根满足条件的k线的距离，尚无满足条件的k线时结果为-1
+    distance = np.where(last_idx >= 0, bar_idx - last_idx, -1)
+    return pd.Series(distance, index=index, dtype=np.int64)
 
 
+@memoize
 @not_full_of_na
 def TR(high, low, close):
     return pd.concat((high - low,
@@ -80,6 +99,7 @@ def TR(high, low, close):
                       abs(low - close.shift(1))), axis=1).max(axis=1)
 
 
+@memoize
 @not_full_of_na
 def ATR(high, low, close, timeperiod):
     tr = TR(high, low, close)
@@ -88,4 +108,12 @@ def ATR(high, low, close, timeperiod):
 
 @not_full_of_na
 def momentum(close, timeperiod):
-    return close.rolling(timeperiod + 1).apply(lambda x: x.iloc[-1] / x.iloc[0] - 1).shift(1)
+    """
+    计算上一期的动量，即上一期收盘价相对timeperiod期之前收盘价的涨跌幅。
+    与close.rolling(timeperiod + 1).apply(lambda x: x.iloc[-1] / x.iloc[0] - 1).shift(1)结果相同。
+    """
+    mom = close / close.shift(timeperiod) - 1
+    if close.isna().any():
+        # 与rolling一致，窗口内有缺失值时结果为NaN
+        mom[close.rolling(timeperiod + 1).count() < timeperiod + 1] = np.nan
+    return mom.shift(1)
@@ -0,0 +1,210 @@
+"""
+逐bar状态机的数组内核。
+
+内核只接受、只返回numpy数组，在一次遍历中完成计算。若安装了numba，内核会被即时编译；
+未安装时以纯Python执行，结果完全相同。编译前的实现可通过kernel.py_func取得。
+"""
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def jit(f):
+    """若安装了numba则编译f，否则原样返回f。"""
+    compiled = f if numba is None else numba.njit(cache=True)(f)
+    if not hasattr(compiled, 'py_func'):
+        # 未安装numba或设置了NUMBA_DISABLE_JIT时，compiled即为f本身
+        compiled.py_func = f
+    return compiled
+
+
+def as_bool_array(s):
+    """
+    将信号序列转化为布尔数组。
+    与逐行判断`if s.iloc[i]`的结果一致：shift后留下的NaN视为True。
+    """
+    return np.asarray(s, dtype=bool)
+
+
+def as_float_array(s):
+    return np.asarray(s, dtype=np.float64)
+
+
+@jit
+def position_direction_kernel(longgo, shortgo, long_exit, short_exit):
+    """
+    根据开仓、平仓信号计算每一期的开仓方向。第一期的开仓方向总为0。
+    params:
+        - longgo, shortgo, long_exit, short_exit: 等长的布尔数组。
+    return:
+        - position_direction: 开仓方向。1为多头，-1为空头，0为无头寸。
+    """
+    n = len(longgo)
+    position_direction = np.zeros(n, dtype=np.int64)
+    prev = 0
+    for i in range(1, n):
+        # 开多头
+        if longgo[i] and prev <= 0:
+            prev = 1
+        # 开空头
+        elif shortgo[i] and prev >= 0:
+            prev = -1
+        # 平多头
+        elif long_exit[i] and prev > 0:
+            prev = 0
+        # 平空头
+        elif short_exit[i] and prev < 0:
+            prev = 0
+        position_direction[i] = prev
+    return position_direction
+
+
+@jit
+def chandelier_exit_kernel(open_, high, low, close, longgo, shortgo, long_exit, short_exit,
+                           trs, lqk_width, lqk_floor):
+    """
+    计算吊灯线止损信号。计算方法见backtest.signals.add_chandelier_exit_signal。
+    开仓以来的较高价、较低价与止损幅度乘数liqka保存在局部变量中，每期只写入一次输出数组。
+    params:
+        - open_, high, low, close: 前复权价格数组。
+        - longgo, shortgo: 开仓信号布尔数组。
+        - long_exit, short_exit: 已有的平仓信号布尔数组，不会被修改。
+    return:
+        - higher_after_entry, lower_after_entry, dliqpoint, kliqpoint, liqka, long_exit, short_exit
+    """
+    n = len(close)
+    higher_after_entry = np.zeros(n)
+    lower_after_entry = np.zeros(n)
+    dliqpoint = np.zeros(n)
+    kliqpoint = np.zeros(n)
+    liqka = np.ones(n)
+    long_exit = long_exit.copy()
+    short_exit = short_exit.copy()
+
+    position_direction = 0
+    higher = 0.0
+    lower = 0.0
+    lk = 1.0
+    for i in range(n - 1):
+
+        # 开多头。i为0时与原实现一致，取最后一期收盘价作为前收盘价
+        if longgo[i] and position_direction <= 0:
+            position_direction = 1
+            lower = low[i] if low[i] > close[i - 1] else close[i - 1]
+            lower_after_entry[i] = lower
+            lk = 1.0
+            continue
+
+        # 开空头
+        if shortgo[i] and position_direction >= 0:
+            position_direction = -1
+            higher = high[i] if high[i] < close[i - 1] else close[i - 1]
+            higher_after_entry[i] = higher
+            lk = 1.0
+            continue
+
+        # 平多头
+        if long_exit[i] and position_direction > 0:
+            position_direction = 0
+            lk = 1.0
+            continue
+
+        # 平空头
+        if short_exit[i] and position_direction < 0:
+            position_direction = 0
+            lk = 1.0
+            continue
+
+        # 有持仓时计算吊灯线
+        if position_direction != 0:
+            lk = lqk_floor if lqk_floor > lk - lqk_width else lk - lqk_width
+            liqka[i] = lk
+            delta = open_[i] * trs * lk
+
+            if position_direction > 0:
+                lower = lower if lower > low[i] else low[i]
+                lower_after_entry[i] = lower
+                dliqpoint[i] = lower - delta
+
+                # 平仓日期是计算出平仓信号的后一天
+                if close[i] < dliqpoint[i]:
+                    long_exit[i + 1] = True
+            else:
+                higher = higher if higher < high[i] else high[i]
+                higher_after_entry[i] = higher
+                kliqpoint[i] = higher + delta
+
+                # 平仓日期是计算出平仓信号的后一天
+                if close[i] > kliqpoint[i]:
+                    short_exit[i + 1] = True
+        else:
+            lk = 1.0
+
+    return higher_after_entry, lower_after_entry, dliqpoint, kliqpoint, liqka, long_exit, short_exit
+
+
+@jit
+def atr_exit_kernel(high, low, close, atr, longgo, shortgo, long_exit, short_exit, trs):
+    """
+    计算ATR止损信号。计算方法见backtest.signals.add_atr_exit_signal。
+    params:
+        - high, low, close: 价格数组。
+        - atr: 与价格等长的ATR数组。
+        - longgo, shortgo: 开仓信号布尔数组。
+        - long_exit, short_exit: 已有的平仓信号布尔数组，不会被修改。
+    return:
+        - highest_after_entry, lowest_after_entry, long_exit, short_exit
+    """
+    n = len(close)
+    highest_after_entry = np.zeros(n)
+    lowest_after_entry = np.zeros(n)
+    long_exit = long_exit.copy()
+    short_exit = short_exit.copy()
+
+    position_direction = 0
+    highest = 0.0
+    lowest = 0.0
+    for i in range(n - 1):
+
+        # 开多头。与原实现一致，开仓时记录的是lowest_after_entry，highest从0开始
+        if longgo[i] and position_direction <= 0:
+            position_direction = 1
+            lowest_after_entry[i] = low[i]
+            highest = 0.0
+            continue
+
+        # 开空头。开仓时记录的是highest_after_entry，lowest从0开始
+        if shortgo[i] and position_direction >= 0:
+            position_direction = -1
+            highest_after_entry[i] = high[i]
+            lowest = 0.0
+            continue
+
+        # 平多头
+        if long_exit[i] and position_direction > 0:
+            position_direction = 0
+            continue
+
+        # 平空头
+        if short_exit[i] and position_direction < 0:
+            position_direction = 0
+            continue
+
+        # 有持仓时计算出场条件
+        if position_direction > 0:
+            highest = highest if highest > high[i] else high[i]
+            highest_after_entry[i] = highest
+            # 平仓日期是计算出平仓信号的后一天
+            if close[i] < highest - trs * atr[i]:
+                long_exit[i + 1] = True
+        elif position_direction < 0:
+            lowest = lowest if lowest < low[i] else low[i]
+            lowest_after_entry[i] = lowest
+            # 平仓日期是计算出平仓信号的后一天
+            if close[i] > lowest + trs * atr[i]:
+                short_exit[i + 1] = True
+
+    return highest_after_entry, lowest_after_entry, long_exit, short_exit
@@ -0,0 +1,173 @@
+"""
+指标计算结果的缓存。
+
+参数扫描时，同一段数据上的不同参数组合会反复用相同的参数计算相同的指标，如ATR(high, low, close, atr_length)
+只与atr_length有关，不随trs变化。被memoize装饰的函数按(输入数据, 函数, 其他参数)缓存结果，
+同一进程中同一段数据上的相同计算只进行一次。
+
+输入数据按其所在的内存识别，而不是按内容：Series与数组的键为底层数组的标识与其中的位置、形状，
+计算键的开销与数据长度无关。各Tester的字段引用同一段数据而不复制（见Tester.__init__），因而共享指标；
+复制得到的数据视为不同的数据。被缓存的函数的输入在调用后不应被原地修改。
+只有计算开销明显大于复制结果的指标才使用缓存，EMA、MA等O(n)的指标直接计算。
+
+缓存按结果占用的内存限制大小，超出时淘汰最久未使用的结果。命中次数与未命中次数见memo.stats()。
+"""
+import hashlib
+import itertools
+import weakref
+from collections import OrderedDict
+from functools import wraps
+
+import numpy as np
+import pandas as pd
+
+
+def _update(h, a):
+    a = np.ascontiguousarray(a)
+    if a.dtype == object:
+        a = pd.util.hash_array(a)
+    h.update(a.dtype.str.encode('utf-8'))
+    h.update(a.view(np.uint8).data)
+
+
+def digest(*data):
+    """计算数组、Series的内容摘要。Series的索引也计入摘要，用于识别同一段行情数据。"""
+    h = hashlib.blake2b(digest_size=16)
+    for d in data:
+        if isinstance(d, pd.Series):
+            _update(h, d.index.values)
+        _update(h, np.asarray(d))
+    return h.digest()
+
+
+# 底层数组id -> (弱引用, 编号)。数组被释放后其id可能被复用，编号使新数组得到不同的键
+_owners = {}
+_owner_ids = itertools.count()
+
+
+def _owner_token(owner):
+    entry = _owners.get(id(owner))
+    if entry is not None and entry[0]() is owner:
+        return entry[1]
+    token = next(_owner_ids)
+    owner_id = id(owner)
+    _owners[owner_id] = (weakref.ref(owner, lambda _: _owners.pop(owner_id, None)), token)
+    return token
+
+
+def array_key(a):
+    """数组的键：持有数据的底层数组的编号，以及a在其中的起始位置、形状、步长与类型。"""
+    a = np.asarray(a)
+    if a.dtype == object:
+        # 对象数组的元素可能被替换，按内容识别
+        return digest(a)
+    owner = a
+    while isinstance(owner.base, np.ndarray):
+        owner = owner.base
+    offset = a.__array_interface__['data'][0] - owner.__array_interface__['data'][0]
+    return _owner_token(owner), offset, a.shape, a.strides, a.dtype.str
+
+
+def data_key(d):
+    """Series与数组的键。Series的索引也计入键，用于识别同一段行情数据。"""
+    if not isinstance(d, pd.Series):
+        return array_key(d)
+    index = d.index
+    if isinstance(index, pd.RangeIndex):
+        index_key = (index.start, index.stop, index.step)
+    else:
+        index_key = array_key(index.values)
+    return index_key, array_key(d.values)
+
+
+def _arg_key(arg):
+    if isinstance(arg, (pd.Series, np.ndarray)):
+        return data_key(arg)
+    return arg
+
+
+def _first_series_name(args):
+    for arg in args:
+        if isinstance(arg, pd.Series):
+            return arg.name
+    return None
+
+
+def _nbytes(res):
+    if isinstance(res, pd.DataFrame):
+        return int(res.memory_usage(index=True).sum())
+    if isinstance(res, pd.Series):
+        return int(res.memory_usage(index=True))
+    return int(np.asarray(res).nbytes)
+
+
+class Memo:
+    """
+    按占用内存限制大小的LRU缓存。
+    params:
+        - maxbytes: 缓存结果占用内存的上限（字节）。
+    """
+
+    def __init__(self, maxbytes=128 * 2 ** 20):
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._results = OrderedDict()
+
+    def get(self, key):
+        if key in self._results:
+            self.hits += 1
+            self._results.move_to_end(key)
+            return self._results[key][0]
+        self.misses += 1
+        return None
+
+    def put(self, key, res, nbytes=None):
+        """缓存res。nbytes为res占用的内存，默认按res计算。"""
+        nbytes = _nbytes(res) if nbytes is None else nbytes
+        if nbytes > self.maxbytes:
+            return
+        self._results[key] = (res, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.maxbytes:
+            _, (_, evicted) = self._results.popitem(last=False)
+            self.nbytes -= evicted
+
+    def clear(self):
+        self._results.clear()
+        self.hits = self.misses = self.nbytes = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._results), 'nbytes': self.nbytes}
+
+
+memo = Memo()
+
+
+def memoize(f):
+    """
+    缓存f的结果。f的参数中的Series与数组按所在的内存计入缓存的键（见data_key），其余参数按值计入。
+    每次返回结果的副本，调用者修改返回值不影响缓存。结果为Series且其名称来自第一个Series参数时，
+    返回的副本使用本次调用中该参数的名称。
+    """
+    name = f'{f.__module__}.{f.__qualname__}'
+
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        series_name = _first_series_name(args)
+        # 第一个Series参数没有名称时无法判断结果的名称是否来自参数，与有名称的调用分开缓存
+        key = (name, tuple(_arg_key(arg) for arg in args),
+               tuple(sorted((k, _arg_key(v)) for k, v in kwargs.items())), series_name is None)
+        cached = memo.get(key)
+        if cached is None:
+            res = f(*args, **kwargs)
+            keeps_name = isinstance(res, pd.Series) and series_name is not None and res.name == series_name
+            memo.put(key, (res, keeps_name), _nbytes(res))
+        else:
+            res, keeps_name = cached
+        res = res.copy()
+        if keeps_name:
+            res.name = series_name
+        return res
+    return decorated
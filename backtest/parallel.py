@@ -1,18 +1,47 @@
+import queue
+import threading
 import time
 import warnings
 
 from concurrent import futures
-from itertools import product
+from itertools import product, islice
 
 import tqdm
-from utils import save_results
+from backtest.result_store import MongoStore, params_key
 
 
 warnings.filterwarnings('ignore')
 
 
-def test_caller(tester):
-    return tester.test()
+def test_caller(tester, lean=False):
+    return tester.test(lean=lean)
+
+
+# worker进程中使用的回测类，由attach_worker设置
+_tester_cls = None
+
+
+def attach_worker(tester_cls, level):
+    """worker进程的初始化函数：挂载level级别的缓存，记录回测类。"""
+    global _tester_cls
+    _tester_cls = tester_cls
+    tester_cls.attach_cache(level)
+
+
+def test_params(params, lean=False):
+    """在worker进程中按参数取出数据并回测。"""
+    return _tester_cls(params, lean=lean).test(lean=lean)
+
+
+def test_params_chunk(params_chunk, lean=False):
+    """
+    在worker进程中回测同一段数据上的一组参数。该段数据在组内只读取一次，各组参数的Tester引用同一段数据，
+    被缓存的指标（见backtest.memo）对相同的指标参数只计算一次，其余信号仍按每组参数计算。
+    策略支持批量回测时，整组参数一次算出。
+    """
+    if _tester_cls.supports_batch:
+        return _tester_cls.test_batch(params_chunk, lean=lean)
+    return [_tester_cls(params, lean=lean).test(lean=lean) for params in params_chunk]
 
 
 def test_many_wrapper(f):
@@ -21,29 +50,190 @@ def test_many_wrapper(f):
     return wrapped
 
 
-def test_many(testers, max_workers=20, pg_bar=True):
+def collect_results(to_do, pg_bar=True):
     results = []
+    done_iter = futures.as_completed(to_do)
+
+    if pg_bar:
+        done_iter = tqdm.tqdm(done_iter, total=len(to_do))
+
+    for future in done_iter:
+        r = future.result()
+        results.append(r)
+    return results
+
+
+def test_many(testers, max_workers=20, pg_bar=True, lean=False):
     with futures.ProcessPoolExecutor(max_workers) as executor:
         to_do = []
         for tester in testers:
-            future = executor.submit(test_caller, tester)
+            future = executor.submit(test_caller, tester, lean)
             to_do.append(future)
-        done_iter = futures.as_completed(to_do)
+        return collect_results(to_do, pg_bar)
 
-        if pg_bar:
-            done_iter = tqdm.tqdm(done_iter, total=len(to_do))
 
-        for future in done_iter:
-            r = future.result()
-            results.append(r)
-    return results
+def test_many_params(tester_cls, level, params_list, max_workers=20, pg_bar=True, lean=False):
+    """
+    多进程回测。每个worker启动时挂载一次缓存，任务只传递参数字典，不再传递整段数据。
+    """
+    with futures.ProcessPoolExecutor(max_workers, initializer=attach_worker,
+                                     initargs=(tester_cls, level)) as executor:
+        to_do = []
+        for params in params_list:
+            future = executor.submit(test_params, params, lean)
+            to_do.append(future)
+        return collect_results(to_do, pg_bar)
+
+
+def _slice_length(backtest_data, category, idx):
+    if hasattr(backtest_data, 'slice_length'):
+        return backtest_data.slice_length(category, idx)
+    return len(backtest_data[category][idx])
+
+
+def slice_major_chunks(tester_cls, params_list, chunk_size=50):
+    """
+    将参数按数据段(category, idx)分组，每组再切分为不超过chunk_size个参数的任务。
+    任务按数据段长度与参数个数之积从大到小排列：先提交耗时最长的任务，worker之间的负载更均衡。
+    """
+    groups = {}
+    for params in params_list:
+        groups.setdefault((params['category'], params['idx']), []).append(params)
+
+    chunks = []
+    for (category, idx), group in groups.items():
+        length = _slice_length(tester_cls.backtest_data, category, idx)
+        for i in range(0, len(group), chunk_size):
+            chunk = group[i: i + chunk_size]
+            chunks.append((length * len(chunk), chunk))
+    chunks.sort(key=lambda x: x[0], reverse=True)
+    return [chunk for _, chunk in chunks]
+
+
+def iter_test_params(tester_cls, level, params_list, max_workers=20, lean=False, max_pending=None,
+                     slice_major=False, chunk_size=50):
+    """
+    多进程回测，按完成顺序逐个产出结果。整个回测只使用一个进程池，
+    已提交而未完成的任务不超过max_pending个（默认为max_workers的4倍），其余参数留在队列中。
+    slice_major为True时，同一段数据上的参数组合合并为任务（见slice_major_chunks），
+    由同一个worker依次回测，结果仍逐个产出。
+    """
+    max_pending = max_pending or max_workers * 4
+    if slice_major:
+        fn, tasks = test_params_chunk, iter(slice_major_chunks(tester_cls, params_list, chunk_size))
+    else:
+        fn, tasks = test_params, iter(params_list)
+
+    with futures.ProcessPoolExecutor(max_workers, initializer=attach_worker,
+                                     initargs=(tester_cls, level)) as executor:
+        pending = {executor.submit(fn, task, lean) for task in islice(tasks, max_pending)}
+        while pending:
+            done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            # 先补充任务再交出结果，使worker不必等待结果写入
+            for task in islice(tasks, len(done)):
+                pending.add(executor.submit(fn, task, lean))
+            for future in done:
+                if slice_major:
+                    yield from future.result()
+                else:
+                    yield future.result()
+
+
+class ResultWriter:
+    """
+    在后台线程中写入回测结果。攒够flush_size条或距上次写入超过flush_interval秒时调用一次save，
+    写入期间进程池继续回测。写入出错时，之后的put与close会抛出该错误。
+    等待写入的结果不超过max_queued条（默认为flush_size的4倍），写入跟不上回测时put阻塞，
+    结果不在主进程中堆积。
+    """
+
+    _STOP = object()
+
+    def __init__(self, save, flush_size=1000, flush_interval=10.0, max_queued=None):
+        self.save = save
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.saved = 0
+        self.error = None
+        self._queue = queue.Queue(maxsize=max_queued or flush_size * 4)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def put(self, result):
+        if self.error is not None:
+            raise self.error
+        # 第一次写入时才启动线程，此时进程池的worker已经启动
+        if self._thread.ident is None:
+            self._thread.start()
+        self._enqueue(result)
+
+    def close(self):
+        """写入剩余结果并结束后台线程。"""
+        if self._thread.ident is not None:
+            self._enqueue(self._STOP)
+            self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _enqueue(self, item):
+        # 队列已满时等待后台线程取出结果；后台线程因写入出错退出后不再等待
+        while True:
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                if not self._thread.is_alive():
+                    if self.error is not None:
+                        raise self.error
+                    return
+
+    def _run(self):
+        buffer = []
+        last_flush = time.monotonic()
+        while True:
+            timeout = max(self.flush_interval - (time.monotonic() - last_flush), 0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            stop = item is self._STOP
+            if item is not None and not stop:
+                buffer.append(item)
+
+            timed_out = time.monotonic() - last_flush >= self.flush_interval
+            if buffer and (stop or timed_out or len(buffer) >= self.flush_size):
+                try:
+                    self.save(buffer)
+                except Exception as e:
+                    self.error = e
+                    return
+                self.saved += len(buffer)
+                buffer = []
+                last_flush = time.monotonic()
+            elif timed_out:
+                last_flush = time.monotonic()
+
+            if stop:
+                return
+
+
+def max_peak_rss(results):
+    """精简模式下各worker报告的峰值内存的最大值（MB）。"""
+    rss = [r['memory']['peak_rss'] for r in results if r.get('memory', {}).get('peak_rss') is not None]
+    return max(rss) / 2 ** 20 if rss else None
 
 
 def gen_params_list(tester, category_rng=None, **kwarg_rngs):
     category_rng = category_rng or tester.backtest_data.keys()
     data_label_list = ({'category': category, 'idx': idx}
                        for category in category_rng
-                       for idx, _ in enumerate(tester.backtest_data[category]))
+                       for idx in range(len(tester.backtest_data[category])))
     # 所有可能的参数值组合
     arg_value_combinations = list(product(*kwarg_rngs.values()))
 
@@ -56,21 +246,44 @@ def gen_params_list(tester, category_rng=None, **kwarg_rngs):
     return params
 
 
-def test_by_params_range(tester_cls, level, batch=1000, max_workers=20, **kwarg_rngs):
-    tester_cls.read_cache(level)
+def remaining_params(params_list, completed_keys):
+    """去掉已经完成回测的参数。"""
+    return [params for params in params_list if params_key(params) not in completed_keys]
+
+
+def test_by_params_range(tester_cls, level, batch=1000, max_workers=20, lean=False, flush_interval=10.0,
+                         pg_bar=True, store=None, resume=True, slice_major=True, chunk_size=50, **kwarg_rngs):
+    """
+    按参数范围回测，结果写入store，默认为MongoDB中以策略命名的数据库，集合名为level。
+    回测结果由后台线程每batch条或每flush_interval秒写入一次，进程池不必等待写入。
+    resume为True时跳过store中已有结果的参数，中断后重新运行即可从断点继续。
+    slice_major与chunk_size见iter_test_params。
+    """
+    tester_cls.attach_cache(level)
     params_list = gen_params_list(tester_cls, **kwarg_rngs)
+    store = store or MongoStore(tester_cls.__name__.replace('Tester', ''), level)
 
-    iters = int(len(params_list) / batch) + 1
+    if resume:
+        total = len(params_list)
+        params_list = remaining_params(params_list, store.completed_keys())
+        print(f'{total - len(params_list)} of {total} params already tested, skipped.')
 
     start = time.time()
-    for i in range(iters):
-        params_sample = params_list[batch*i: batch*(i+1)]
-        testers_list = (tester_cls(params) for params in params_sample)
-        results = test_many(testers_list, max_workers=max_workers)
-        save_results(results, db_name=tester_cls.__name__.replace('Tester', ''), col_name=level)
-        print(f'batch {i+1} in {iters} completed!')
-    end = time.time()
-    print(f'Used time: {end - start}')
-
+    results = iter_test_params(tester_cls, level, params_list, max_workers=max_workers, lean=lean,
+                               slice_major=slice_major, chunk_size=chunk_size)
+    if pg_bar:
+        results = tqdm.tqdm(results, total=len(params_list))
 
+    max_rss = None
+    with ResultWriter(store.save, flush_size=batch, flush_interval=flush_interval) as writer:
+        for result in results:
+            rss = max_peak_rss([result]) if lean else None
+            if rss is not None and (max_rss is None or rss > max_rss):
+                max_rss = rss
+            writer.put(result)
+    end = time.time()
 
+    print(f'{writer.saved} results saved!')
+    if lean:
+        print(f'max worker peak rss: {max_rss}')
+    print(f'Used time: {end - start}')
@@ -1,39 +1,172 @@
+import numpy as np
 import pandas as pd
 
 
-def get_datetime_list(df):
-    return df.datetime.values.tolist()
+def nan_cumprod(values):
+    """沿第0维累乘，与Series.cumprod一致：跳过NaN，NaN的位置结果仍为NaN。"""
+    mask = np.isnan(values)
+    res = np.cumprod(np.where(mask, 1.0, values), axis=0)
+    res[mask] = np.nan
+    return res
 
 
-def run_pd_backtest(df, commission=0.0001, debug=False):
-    """基于pandas进行回测。"""
+def price_change(df):
+    """每期收盘价相对前收盘价的涨跌幅。"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.asarray(df.close, dtype=np.float64) / np.asarray(df.preclose, dtype=np.float64) - 1
+
+
+def trade_operations(position_direction, c_chg, next_c_chg):
+    """
+    根据开仓方向标记开仓、平仓操作。
+    params:
+        - position_direction: 开仓方向数组，长度为bars，或bars×N的矩阵。
+        - c_chg, next_c_chg: 长度为bars的换合约标记。
+    return:
+        - long_open, short_open, long_close, short_close, open_op, close_op: 与position_direction形状相同的布尔数组。
+    """
+    position_direction = np.asarray(position_direction)
+    c_chg = np.asarray(c_chg, dtype=bool)
+    next_c_chg = np.asarray(next_c_chg, dtype=bool)
+    if position_direction.ndim == 2:
+        c_chg, next_c_chg = c_chg[:, None], next_c_chg[:, None]
+
+    # 与shift(1).fillna(0)一致，第一期之前视为无头寸
+    prev_direction = np.zeros(position_direction.shape)
+    prev_direction[1:] = position_direction[:-1]
+    # 与shift(-1).ffill()一致，最后一期取自身的开仓方向
+    next_direction = position_direction.astype(np.float64)
+    next_direction[:-1] = position_direction[1:]
+    holding = position_direction != 0
 
     # 开仓操作
-    long_open = (df.position_direction == 1) & (df.position_direction.shift(1).fillna(0) <= 0)
-    short_open = (df.position_direction == -1) & (df.position_direction.shift(1).fillna(0) >= 0)
-    open_op = long_open | short_open | (df.c_chg & df.position_direction)
+    long_open = (position_direction == 1) & (prev_direction <= 0)
+    short_open = (position_direction == -1) & (prev_direction >= 0)
+    open_op = long_open | short_open | (c_chg & holding)
 
     # 平仓操作
-    long_close = (df.position_direction == 1) & (df.position_direction.shift(-1).ffill() <= 0)
-    short_close = (df.position_direction == -1) & (df.position_direction.shift(-1).ffill() >= 0)
-    close_op = long_close | short_close | (df.next_c_chg & df.position_direction)
+    long_close = (position_direction == 1) & (next_direction <= 0)
+    short_close = (position_direction == -1) & (next_direction >= 0)
+    close_op = long_close | short_close | (next_c_chg & holding)
+    return long_open, short_open, long_close, short_close, open_op, close_op
+
+
+def run_np_backtest(df, commission=0.0001, trades=False, ledger=False):
+    """
+    基于numpy进行回测，结果以数组返回。
+    params:
+        - df: 一段连续的行情数据，需包括close, preclose, c_chg, next_c_chg, position_direction。
+        - commission: 手续费率。
+        - trades: 是否返回各类交易发生的时间。
+        - ledger: 是否返回逐笔交易记录，见trade_ledger。
+    return:
+        - 字典。cum_ret, ret, trade_num为与df等长的累计收益率、收益率、交易次数数组；
+          trades为True时另有long_open, long_close, short_open, short_close，为对应交易发生的时间数组；
+          ledger为True时另有ledger。
+    """
+    position_direction = np.asarray(df.position_direction)
+    long_open, short_open, long_close, short_close, open_op, close_op = \
+        trade_operations(position_direction, df.c_chg, df.next_c_chg)
 
     trade_num = open_op.astype('int') + close_op.astype('int')
-    trade_cost = trade_num * commission
+    price_chg_pct = price_change(df)
+    ret = price_chg_pct * position_direction - trade_num * commission
+
+    results = {'cum_ret': nan_cumprod(1 + ret), 'ret': ret, 'trade_num': trade_num}
+    if ledger:
+        results['ledger'] = trade_ledger(open_op, close_op, position_direction, price_chg_pct, ret)
+    if trades:
+        datetime = df.datetime.values
+        results.update(long_open=datetime[long_open], long_close=datetime[long_close],
+                       short_open=datetime[short_open], short_close=datetime[short_close])
+    return results
+
+
+def _segment_prod(values, starts, ends):
+    """values在每个区间[starts[k], ends[k]]内的连乘积，按顺序累乘，与cumprod一致。"""
+    values = np.append(values, 1.0)
+    bounds = np.empty(2 * len(starts), dtype=np.int64)
+    bounds[0::2] = starts
+    bounds[1::2] = ends + 1
+    return np.multiply.reduceat(values, bounds)[0::2] if len(starts) else np.array([], dtype=np.float64)
+
 
-    price_chg_pct = df.close / df.preclose - 1
-    ret = price_chg_pct * df.position_direction - trade_cost
-    cum_ret = (1 + ret).cumprod()
+def trade_ledger(open_op, close_op, position_direction, price_chg_pct, ret):
+    """
+    由开仓、平仓操作生成逐笔交易记录。一笔交易从一次开仓操作开始，到其后的第一次平仓操作结束；
+    换合约时旧合约平仓、新合约开仓，记为两笔交易。数据结束时仍未平仓的交易按最后一期计算收益。
+    params:
+        - open_op, close_op: 开仓、平仓操作的布尔数组，见trade_operations。
+        - position_direction: 开仓方向数组。
+        - price_chg_pct: 每期涨跌幅。
+        - ret: 每期扣除手续费后的收益率。
+    return:
+        - 字典，每个字段为长度等于交易笔数的数组：
+          entry_idx, exit_idx: 开仓、平仓所在的行号；direction: 1为多头，-1为空头；
+          gross_ret, net_ret: 扣除手续费前、后的收益率；bars_held: 持仓的bar数；closed: 是否已平仓。
+    """
+    entry_idx = np.flatnonzero(open_op)
+    # 未平仓的交易以最后一期为止
+    exits = np.append(np.flatnonzero(close_op), len(open_op) - 1)
+    k = np.searchsorted(exits, entry_idx)
+    closed = k < len(exits) - 1
+    exit_idx = exits[k]
 
-    # todo: 重构回测结果表示方法
-    long_open_dates = get_datetime_list(df[long_open])
-    long_close_dates = get_datetime_list(df[long_close])
-    short_open_dates = get_datetime_list(df[short_open])
-    short_close_dates = get_datetime_list(df[short_close])
+    direction = np.asarray(position_direction)[entry_idx]
+    gross_ret = _segment_prod(1 + price_chg_pct * position_direction, entry_idx, exit_idx) - 1
+    net_ret = _segment_prod(1 + ret, entry_idx, exit_idx) - 1
+    return {'entry_idx': entry_idx, 'exit_idx': exit_idx, 'direction': direction,
+            'gross_ret': gross_ret, 'net_ret': net_ret, 'bars_held': exit_idx - entry_idx + 1, 'closed': closed}
 
-    results = {'datetime': df.datetime.values, 'cum_ret': cum_ret.values}
+
+def trade_stats(ledger, bars):
+    """
+    由逐笔交易记录计算交易统计。
+    params:
+        - ledger: trade_ledger的结果。
+        - bars: 回测数据的bar数。
+    return:
+        - 字典。trades: 交易笔数；long_trades, short_trades: 多头、空头交易笔数；
+          win_rate: 扣除手续费后盈利的交易占比；avg_net_ret: 平均每笔收益率；
+          avg_bars_held: 平均持仓bar数；turnover: 平均每根bar的开平仓次数。
+    """
+    trades = len(ledger['entry_idx'])
+    net_ret = ledger['net_ret']
+    return {'trades': trades,
+            'long_trades': int(np.count_nonzero(ledger['direction'] > 0)),
+            'short_trades': int(np.count_nonzero(ledger['direction'] < 0)),
+            'win_rate': float(np.count_nonzero(net_ret > 0) / trades) if trades else np.nan,
+            'avg_net_ret': float(net_ret.mean()) if trades else np.nan,
+            'avg_bars_held': float(ledger['bars_held'].mean()) if trades else np.nan,
+            'turnover': (trades + int(np.count_nonzero(ledger['closed']))) / bars if bars else np.nan}
+
+
+def run_pd_backtest(df, commission=0.0001, debug=False):
+    """基于pandas进行回测。返回以datetime为索引的累计收益率，计算见run_np_backtest。"""
+    res = run_np_backtest(df, commission=commission)
+
+    results = {'datetime': df.datetime.values, 'cum_ret': res['cum_ret']}
     if debug:
-        results['trade_num'] = trade_num.values
-        results['ret'] = ret.values
+        results['trade_num'] = res['trade_num']
+        results['ret'] = res['ret']
 
     return pd.DataFrame(data=results).set_index('datetime')
+
+
+def run_pd_backtest_matrix(df, position_direction, commission=0.0001):
+    """
+    run_pd_backtest的批量版本：一次回测同一段数据上的N组开仓方向。
+    params:
+        - df: 一段连续的行情数据，需包括close, preclose, c_chg, next_c_chg。
+        - position_direction: bars×N的开仓方向矩阵。
+    return:
+        - cum_ret: bars×N的累计收益率矩阵，第j列与用position_direction[:, j]调用run_pd_backtest的结果相同。
+    """
+    position_direction = np.asarray(position_direction)
+    _, _, _, _, open_op, close_op = trade_operations(position_direction, df.c_chg, df.next_c_chg)
+
+    trade_num = open_op.astype('int') + close_op.astype('int')
+    trade_cost = trade_num * commission
+
+    ret = price_change(df)[:, None] * position_direction - trade_cost
+    return nan_cumprod(1 + ret)
@@ -0,0 +1,150 @@
+"""
+回测结果的存储。
+
+ResultStore.save写入一批Tester.test返回的结果，ResultStore.find按参数查询，返回与MongoDB文档格式相同的字典，
+可直接交给avg_cum_ret_from_cursor、cum_ret_from_doc等函数。
+
+- MongoStore: 保存在MongoDB中，每个结果为一个文档。
+- LocalStore: 保存在本地目录中，不需要数据库。每次save写入一个分块：
+    part-<n>.json  参数表，每个结果除累计收益率以外的字段。
+    part-<n>.npz   压缩保存的累计收益率。分块内所有曲线共用一个时间索引，
+                   每条曲线只保存其在时间索引中的位置与累计收益率。
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from utils import get_client, mkdirs
+
+
+def _to_builtin(value):
+    # numpy标量转为对应的Python类型，使1与np.int64(1)得到相同的键
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError(f'{type(value)} is not JSON serializable')
+
+
+def params_key(params):
+    """参数字典的键。与参数的顺序无关，在不同进程、不同次运行中保持不变。"""
+    text = json.dumps(params, sort_keys=True, default=_to_builtin)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class ResultStore:
+    """回测结果存储的接口。"""
+
+    def save(self, results):
+        """写入一批回测结果。"""
+        raise NotImplementedError
+
+    def find(self, **params):
+        """查询参数等于params的全部结果，形如{'params': ..., 'cum_ret': {'datetime': ..., 'cum_ret': ...}}。"""
+        raise NotImplementedError
+
+    def completed_keys(self):
+        """已保存的全部结果的键，见params_key。"""
+        raise NotImplementedError
+
+
+class MongoStore(ResultStore):
+
+    def __init__(self, db_name, col_name, client_name="mongodb://localhost:27017/"):
+        self.db_name = db_name
+        self.col_name = col_name
+        self.client_name = client_name
+
+    @property
+    def col(self):
+        return get_client(self.client_name)[self.db_name][self.col_name]
+
+    def save(self, results):
+        self.col.insert_many(results)
+
+    def find(self, **params):
+        return self.col.find({f'params.{k}': v for k, v in params.items()})
+
+    def completed_keys(self):
+        # 断点续跑时按key查询，建立索引以免扫描整个集合。索引已存在时不做任何事。
+        # 只在这里建立索引，只读取结果的分析不会写入数据库
+        self.col.create_index('key')
+        # 条件与返回的字段都只涉及key，查询只读取索引，不读取文档
+        return {doc['key'] for doc in self.col.find({'key': {'$type': 'string'}}, {'key': 1, '_id': 0})}
+
+
+class LocalStore(ResultStore):
+
+    def __init__(self, root_dir, db_name, col_name):
+        self.path = os.path.join(root_dir, db_name, col_name)
+
+    def _part_names(self):
+        if not os.path.exists(self.path):
+            return []
+        return sorted(name[:-len('.json')] for name in os.listdir(self.path) if name.endswith('.json'))
+
+    def save(self, results):
+        if not results:
+            return
+        mkdirs(self.path)
+        parts = self._part_names()
+        part = f'part-{int(parts[-1][len("part-"):]) + 1 if parts else 0:05d}'
+
+        records = []
+        curves = []
+        for result in results:
+            records.append({k: v for k, v in result.items() if k not in ('cum_ret', '_id')})
+            if 'cum_ret' in result:
+                curves.append((pd.to_datetime(result['cum_ret']['datetime']).values.astype('datetime64[ns]'),
+                               np.asarray(result['cum_ret']['cum_ret'], dtype=np.float64)))
+            else:
+                curves.append(None)
+
+        # 分块内共用的时间索引
+        datetimes = [curve[0] for curve in curves if curve is not None]
+        time_index = np.unique(np.concatenate(datetimes)) if datetimes else np.array([], dtype='datetime64[ns]')
+
+        lengths = [len(curve[1]) if curve is not None else 0 for curve in curves]
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        positions = [np.searchsorted(time_index, curve[0]) for curve in curves if curve is not None]
+        values = [curve[1] for curve in curves if curve is not None]
+
+        np.savez_compressed(
+            os.path.join(self.path, f'{part}.npz'),
+            time_index=time_index.astype(np.int64),
+            has_curve=np.array([curve is not None for curve in curves]),
+            offsets=offsets,
+            positions=np.concatenate(positions).astype(np.int32) if positions else np.array([], dtype=np.int32),
+            cum_ret=np.concatenate(values) if values else np.array([], dtype=np.float64),
+        )
+        # 参数表最后写入，读取时只读取参数表已写入的分块
+        with open(os.path.join(self.path, f'{part}.json'), 'w') as f:
+            json.dump(records, f)
+
+    def _records(self, part):
+        with open(os.path.join(self.path, f'{part}.json')) as f:
+            return json.load(f)
+
+    def completed_keys(self):
+        return {record['key'] for part in self._part_names() for record in self._records(part) if 'key' in record}
+
+    def find(self, **params):
+        for part in self._part_names():
+            records = self._records(part)
+            rows = [i for i, record in enumerate(records)
+                    if all(record['params'].get(k) == v for k, v in params.items())]
+            if not rows:
+                continue
+
+            with np.load(os.path.join(self.path, f'{part}.npz')) as data:
+                time_index = data['time_index'].astype('datetime64[ns]')
+                has_curve, offsets = data['has_curve'], data['offsets']
+                positions, cum_ret = data['positions'], data['cum_ret']
+
+            for i in rows:
+                doc = dict(records[i])
+                if has_curve[i]:
+                    start, end = offsets[i], offsets[i + 1]
+                    doc['cum_ret'] = {'datetime': time_index[positions[start:end]], 'cum_ret': cum_ret[start:end]}
+                yield doc
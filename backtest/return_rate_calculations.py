@@ -69,6 +69,9 @@ def cum_ret_from_doc(document):
 
 
 def avg_cum_ret_from_cursor(cursor):
+    """
+    计算一组回测结果的平均累计收益率。cursor可以是MongoDB的查询结果，也可以是ResultStore.find的返回值。
+    """
     cum_rets = [cum_ret_from_doc(doc) for doc in cursor]
     cum_rets = [cum_ret for cum_ret in cum_rets if len(cum_ret) > 0]
     avg_cum_ret = cal_avg_cum_ret(cum_rets)
@@ -0,0 +1,247 @@
+"""
+滑动窗口的均值、最大值、最小值。
+
+每种统计量有两种用法：
+- 批量：rolling_mean_kernel等内核一次计算整个数组，与kernels.py中的内核一样可由numba编译。
+- 逐bar：RollingMean等类每次update一根bar的数据，返回当前窗口的结果，每次更新的开销为O(1)。
+  适用于实盘中逐bar生成信号。
+
+两种用法的结果与pandas的s.rolling(window).mean()/max()/min()完全相同：窗口未满或窗口内有NaN时结果为NaN。
+均值以补偿求和（Kahan summation）累加窗口内的值，加入与移除各自维护补偿项，与pandas的实现一致；
+最大值、最小值用单调队列维护，队首即为窗口内的最大值（最小值）。
+
+RollingMomentum是backtest.indicators.momentum的逐bar版本。
+"""
+from collections import deque
+
+import numpy as np
+
+from backtest.kernels import jit
+
+# 滑动均值的状态数组中各项的位置：观测数、负数个数、窗口内的和、加入时的补偿项、移除时的补偿项、
+# 最近连续相同值的个数、最近加入的值
+NOBS, NEG_CT, SUM_X, COMP_ADD, COMP_REMOVE, SAME_CT, PREV = range(7)
+
+
+@jit
+def _mean_reset(state, first):
+    state[:] = 0.0
+    state[PREV] = first
+
+
+@jit
+def _mean_add(state, val):
+    if val == val:
+        state[NOBS] += 1
+        y = val - state[COMP_ADD]
+        t = state[SUM_X] + y
+        state[COMP_ADD] = t - state[SUM_X] - y
+        state[SUM_X] = t
+        if np.signbit(val):
+            state[NEG_CT] += 1
+        # 窗口内的值全部相同时直接返回该值，避免浮点误差
+        if val == state[PREV]:
+            state[SAME_CT] += 1
+        else:
+            state[SAME_CT] = 1
+        state[PREV] = val
+
+
+@jit
+def _mean_remove(state, val):
+    if val == val:
+        state[NOBS] -= 1
+        y = -val - state[COMP_REMOVE]
+        t = state[SUM_X] + y
+        state[COMP_REMOVE] = t - state[SUM_X] - y
+        state[SUM_X] = t
+        if np.signbit(val):
+            state[NEG_CT] -= 1
+
+
+@jit
+def _mean_value(state, window):
+    nobs = state[NOBS]
+    if nobs < window or nobs == 0:
+        return np.nan
+    if state[SAME_CT] >= nobs:
+        return state[PREV]
+    res = state[SUM_X] / nobs
+    # 窗口内的值同号时，结果不应因浮点误差变号
+    if state[NEG_CT] == 0 and res < 0:
+        return 0.0
+    if state[NEG_CT] == nobs and res > 0:
+        return 0.0
+    return res
+
+
+@jit
+def rolling_mean_kernel(values, window):
+    """
+    计算滑动均值，与pd.Series(values).rolling(window).mean()相同。
+    params:
+        - values: 浮点数组。
+        - window: 窗宽。
+    """
+    n = len(values)
+    res = np.full(n, np.nan)
+    if window < 1:
+        return res
+    state = np.zeros(7)
+    for i in range(n):
+        if i == 0 or window == 1:
+            _mean_reset(state, values[i])
+        elif i >= window:
+            _mean_remove(state, values[i - window])
+        _mean_add(state, values[i])
+        res[i] = _mean_value(state, window)
+    return res
+
+
+@jit
+def _rolling_extreme_kernel(values, window, is_max):
+    n = len(values)
+    res = np.full(n, np.nan)
+    if window < 1:
+        return res
+    # 单调队列，queue[head:tail]为窗口内的非NaN值的位置，对应的值单调不增（求最小值时单调不减）
+    queue = np.empty(n, dtype=np.int64)
+    head = tail = 0
+    nobs = 0
+    for i in range(n):
+        val = values[i]
+        if val == val:
+            nobs += 1
+            while tail > head and ((values[queue[tail - 1]] <= val) if is_max else (values[queue[tail - 1]] >= val)):
+                tail -= 1
+            queue[tail] = i
+            tail += 1
+        if i >= window:
+            if values[i - window] == values[i - window]:
+                nobs -= 1
+            if tail > head and queue[head] <= i - window:
+                head += 1
+        if nobs >= window:
+            res[i] = values[queue[head]]
+    return res
+
+
+@jit
+def rolling_max_kernel(values, window):
+    """计算滑动最大值，与pd.Series(values).rolling(window).max()相同。"""
+    return _rolling_extreme_kernel(values, window, True)
+
+
+@jit
+def rolling_min_kernel(values, window):
+    """计算滑动最小值，与pd.Series(values).rolling(window).min()相同。"""
+    return _rolling_extreme_kernel(values, window, False)
+
+
+class RollingMean:
+    """
+    逐bar计算滑动均值。每次update的结果与rolling_mean_kernel在同一位置的结果相同。
+    params:
+        - window: 窗宽。
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.value = np.nan
+        self._state = np.zeros(7)
+        self._recent = deque(maxlen=max(window, 1))
+        self._count = 0
+
+    def update(self, val):
+        val = float(val)
+        if self.window < 1:
+            return self.value
+        if self._count == 0 or self.window == 1:
+            _mean_reset.py_func(self._state, val)
+        elif self._count >= self.window:
+            _mean_remove.py_func(self._state, self._recent[0])
+        _mean_add.py_func(self._state, val)
+        self._recent.append(val)
+        self._count += 1
+        self.value = _mean_value.py_func(self._state, self.window)
+        return self.value
+
+
+class _RollingExtreme:
+
+    def __init__(self, window):
+        self.window = window
+        self.value = np.nan
+        self._recent = deque(maxlen=max(window, 1))
+        self._queue = deque()  # (位置, 值)，值单调
+        self._nobs = 0
+        self._count = 0
+
+    def _dominates(self, new, old):
+        raise NotImplementedError
+
+    def update(self, val):
+        val = float(val)
+        if self.window < 1:
+            return self.value
+        i = self._count
+        if val == val:
+            self._nobs += 1
+            while self._queue and self._dominates(val, self._queue[-1][1]):
+                self._queue.pop()
+            self._queue.append((i, val))
+        if i >= self.window:
+            if self._recent[0] == self._recent[0]:
+                self._nobs -= 1
+            if self._queue and self._queue[0][0] <= i - self.window:
+                self._queue.popleft()
+        self._recent.append(val)
+        self._count += 1
+        self.value = self._queue[0][1] if self._nobs >= self.window else np.nan
+        return self.value
+
+
+class RollingMax(_RollingExtreme):
+    """逐bar计算滑动最大值。每次update的结果与rolling_max_kernel在同一位置的结果相同。"""
+
+    def _dominates(self, new, old):
+        return old <= new
+
+
+class RollingMin(_RollingExtreme):
+    """逐bar计算滑动最小值。每次update的结果与rolling_min_kernel在同一位置的结果相同。"""
+
+    def _dominates(self, new, old):
+        return old >= new
+
+
+class RollingMomentum:
+    """
+    逐bar计算动量close / close[timeperiod期前] - 1，与close / close.shift(timeperiod) - 1相同。
+    最近timeperiod + 1期内有NaN时结果为NaN。backtest.indicators.momentum的结果为其再向后移动一期。
+    """
+
+    def __init__(self, timeperiod):
+        self.timeperiod = timeperiod
+        self.value = np.nan
+        self._recent = deque(maxlen=timeperiod + 1)
+        self._nans = 0
+
+    def update(self, val):
+        val = float(val)
+        if len(self._recent) == self._recent.maxlen and self._recent[0] != self._recent[0]:
+            self._nans -= 1
+        if val != val:
+            self._nans += 1
+        self._recent.append(val)
+        if len(self._recent) == self._recent.maxlen and self._nans == 0:
+            base = self._recent[0]
+            if base == 0:
+                # 与pandas一致，除以0得到inf或NaN
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    self.value = np.float64(val) / base - 1
+            else:
+                self.value = val / base - 1
+        else:
+            self.value = np.nan
+        return self.value
@@ -1,6 +1,11 @@
+import numpy as np
 import pandas as pd
 
-from backtest.indicators import ATR
+from backtest.indicators import ATR, AllNaError
+from backtest.memo import memoize
+from backtest.rolling import RollingMean
+from backtest.kernels import position_direction_kernel, chandelier_exit_kernel, atr_exit_kernel, \
+    as_bool_array, as_float_array
 from utils import has_column
 
 
@@ -8,42 +13,71 @@ class AddSignalError(Exception):
     pass
 
 
-def add_avg_daily_last_adjusted_close(df, date_length):
+@memoize
+def avg_daily_last_adjusted_close(tradingday, adjusted_close, date_length):
     """
-    计算之前date_length天（以交易日计算，包括当天）每天最后一根bar前复权收盘价的均值avg_adjusted_close。
-    avg_adjusted_close每过date_length天计算一次。比如，若date_length为10，则第10天至
-    第19天的avg_adjusted_close相同， 第20天至第29天的avg_adjusted_close相同。
-    
+    计算add_avg_daily_last_adjusted_close添加的各字段，返回与输入同索引的DataFrame。
+    参数扫描中只与date_length有关，结果由指标缓存复用。
     """
-    if has_column(df, 'avg_adjusted_close'):
-        return
+    td = tradingday.values
+    bars = len(td)
 
-    tradingday = df.tradingday
-    
     # 标记交易日与下一根不同的bar， 作为每个交易日最后一根bar
-    tradingday_last_bar = (tradingday != tradingday.shift(-1).fillna(tradingday.iloc[-1]))
-    df['tradingday_last_bar'] = tradingday_last_bar
+    tradingday_last_bar = np.zeros(bars, dtype=bool)
+    tradingday_last_bar[:-1] = td[:-1] != td[1:]
+
+    # 标记交易日与上一根不同的bar，按交易日为每根bar标记日期序号date_idx，从0开始。
+    tradingday_first_bar = np.zeros(bars, dtype=bool)
+    tradingday_first_bar[1:] = td[1:] != td[:-1]
+    date_idx = np.cumsum(tradingday_first_bar)
 
-    # 按交易日为每根bar标记日期序号date_idx，从0开始。
-    tradingday_first_bar = (tradingday != tradingday.shift(1).fillna(tradingday.iloc[0]))
-    date_idx = tradingday_first_bar.cumsum()
-    
     # 每组日期序号模date_length为0的bar的第一根为一次平均窗口的开始
     window_first_bar = ((date_idx % date_length) == 0) & tradingday_first_bar
-    df['window_idx'] = window_first_bar.cumsum()
+    window_idx = np.cumsum(window_first_bar, dtype=np.int64)
+
+    # 在每个平均窗口内计算每个交易日最后一根bar的复权收盘价均值。window_idx单调不减，
+    # 各窗口的最后一根bar在数组中连续。
+    last_close = as_float_array(adjusted_close)[tradingday_last_bar]
+    bounds = np.searchsorted(window_idx[tradingday_last_bar], np.arange(window_idx[-1] + 2))
+    starts, lengths = bounds[:-1], np.diff(bounds)
+    is_valid = ~np.isnan(last_close)
+    valid_count = np.concatenate(([0], np.cumsum(is_valid)))
+    counts = valid_count[bounds[1:]] - valid_count[bounds[:-1]]
+    # 求和的舍入与元素个数有关（numpy按块两两求和），np.add.reduceat、cumsum之差与Series.mean的结果
+    # 可能相差一个ulp。将长度相同的窗口排成一个矩阵按行求和，每行的求和过程与Series.mean相同。
+    sums = np.zeros(len(lengths))
+    values = np.where(is_valid, last_close, 0.0)
+    for length in np.unique(lengths[lengths > 0]):
+        windows = np.flatnonzero(lengths == length)
+        sums[windows] = values[starts[windows, None] + np.arange(length)].sum(axis=1)
+    avg_adjusted_close = np.full(len(lengths), np.nan)
+    avg_adjusted_close[counts > 0] = sums[counts > 0] / counts[counts > 0]
+
+    # 对每个窗口内的bar添加前一个窗口的收盘价均值，第一个窗口没有前一个窗口
+    prev_window_idx = window_idx - 1
+    avg_for_bar = np.where(prev_window_idx >= 0, avg_adjusted_close[np.maximum(prev_window_idx, 0)], np.nan)
 
-    # 在每个平均窗口内计算每个交易日最后一根bar的复权收盘价均值
-    avg_adjusted_close = df.groupby('window_idx').apply(lambda x: x[x.tradingday_last_bar].adjusted_close.mean())
-    avg_adjusted_close = pd.DataFrame({'avg_adjusted_close': avg_adjusted_close})
+    # 复权收盘价均值向前移动一期，在前一个窗口结束时更新收盘价均值
+    avg_for_bar = np.append(avg_for_bar[1:], np.nan)
+    return pd.DataFrame({'tradingday_last_bar': tradingday_last_bar,
+                         'window_idx': window_idx,
+                         'prev_window_idx': prev_window_idx,
+                         'avg_adjusted_close': avg_for_bar}, index=tradingday.index)
 
-    # 对每个窗口内的bar添加前一个窗口的收盘价均值
-    df['prev_window_idx'] = df.window_idx - 1
-    df['avg_adjusted_close'] = df.set_index('prev_window_idx')\
-                                 .join(avg_adjusted_close)\
-                                 .reset_index()['avg_adjusted_close']
 
-    # 复权收盘价均值向前移动一期，在前一个窗口结束时更新收盘价均值
-    df['avg_adjusted_close'] = df['avg_adjusted_close'].shift(-1)
+def add_avg_daily_last_adjusted_close(df, date_length):
+    """
+    计算之前date_length天（以交易日计算，包括当天）每天最后一根bar前复权收盘价的均值avg_adjusted_close。
+    avg_adjusted_close每过date_length天计算一次。比如，若date_length为10，则第10天至
+    第19天的avg_adjusted_close相同， 第20天至第29天的avg_adjusted_close相同。
+    
+    """
+    if has_column(df, 'avg_adjusted_close'):
+        return
+
+    res = avg_daily_last_adjusted_close(df.tradingday, df.adjusted_close, date_length)
+    for column in res.columns:
+        df[column] = res[column]
 
 
 def add_chg_signal(df):
@@ -59,31 +93,116 @@ def add_chg_signal(df):
     # df['c_chg'] = df['c_chg'].astype('int')
 
 
-def add_adjusted_price(df):
+def correct_preclose(df):
+    """
+    考虑更换合约的情况，获得正确的preclose。非纯函数。
+    若是新更换的合约，则preclose为表中字段的值。否则preclose为上一行的close。
+    params:
+        - df: 已添加c_chg字段。
+    """
+    above_line_close = df.close.shift(1).fillna(df.preclose.iloc[0])
+    df['preclose'] = above_line_close.where(~df.c_chg.astype(bool), df.preclose)
+
+
+def count_zero_price_rows(df):
+    """preclose或close为0的行数。这些行使复权因子为0或无穷大，无法计算前复权价格。"""
+    return int(((df['preclose'].values == 0) | (df['close'].values == 0)).sum())
+
+
+def add_adjusted_price(df, validate=True, anchor=None):
     """
     在df中添加前复权价格。非纯函数。
     params:
         - df: 一段连续的行情数据。需要行情中包括open, close, high, low, preclose。
+        - validate: 是否检查preclose与close中的0。调用前已检查过时可跳过。
+        - anchor: 同一段数据中此前各行的复权锚点。给出时df为追加在其后的行，复权价格接续此前的行计算，
+                  结果与对整段数据计算相同。
+    return:
+        - anchor: 复权锚点(最后一行的复权因子, 复权因子到前复权收盘价的比例, 倒数第二行的复权因子)，
+                  用于之后追加数据，或替换最后一行后追加数据。只有一行时倒数第二行的复权因子为None。
     """
+    if validate:
+        zero_rows = count_zero_price_rows(df)
+        if zero_rows:
+            raise AddSignalError(f"preclose或close字段中有{zero_rows}行为0！")
+
     # 计算复权因子
-    if 0 in df['preclose'].values:
-        raise AddSignalError("preclose字段中存在0！")
-    adjust_factor = (df['close'] / df['preclose']).cumprod()
+    if anchor is None:
+        adjust_factor = (df['close'] / df['preclose']).cumprod()
+        scale = df['close'].iloc[0] / adjust_factor.iloc[0]
+    else:
+        last_factor, scale = anchor[:2]
+        ratio = (df['close'] / df['preclose']).values
+        factors = np.cumprod(np.append(last_factor, ratio))
+        adjust_factor = pd.Series(factors[1:], index=df.index)
 
     # 计算前复权收盘价
-    if 0 in adjust_factor.values:
-        raise AddSignalError("复权因子中存在0！")
-    df['adjusted_close'] = adjust_factor * (df['close'].iloc[0] / adjust_factor.iloc[0])
+    df['adjusted_close'] = adjust_factor * scale
 
     # 对 open, high, low 以同比例放缩
-    if 0 in df['close'].values:
-        raise AddSignalError("close字段中存在0！")
     r = df['adjusted_close'] / df['close']
     for price in ['open', 'high', 'low']:
         df['adjusted_' + price] = df[price] * r
+    if anchor is not None:
+        prev_factor = float(factors[-2])
+    else:
+        prev_factor = float(adjust_factor.iloc[-2]) if len(df) > 1 else None
+    return float(adjust_factor.iloc[-1]), float(scale), prev_factor
 
 
-def add_chandelier_exit_signal(df, trs=0.12, lqk_width=0.1, lqk_floor=0.5):
+def add_cache_signals(df, intraday=False):
+    """
+    生成缓存时为一段数据添加换合约标记与前复权价格。非纯函数。
+    价格中的0只检查一次：存在preclose或close为0的行时不添加前复权价格，返回这些行的行数，由调用者报告并跳过该段数据。
+    params:
+        - df: 一段连续的行情数据。需要行情中包括deliv_mon, open, close, high, low, preclose。
+        - intraday: 是否为日内数据。日内数据的preclose需先修正为上一根bar的收盘价。
+    return:
+        - zero_rows: preclose或close为0的行数。为0时已添加全部字段。
+        - anchor: 复权锚点，见add_adjusted_price。zero_rows不为0时为None。
+    """
+    add_chg_signal(df)
+    if intraday:
+        correct_preclose(df)
+    zero_rows = count_zero_price_rows(df)
+    if zero_rows:
+        return zero_rows, None
+    return zero_rows, add_adjusted_price(df, validate=False)
+
+
+def extend_cache_signals(cached, new_rows, anchor, intraday=False):
+    """
+    将新增的行追加到已缓存的一段数据之后，只为新增的行计算换合约标记与前复权价格。
+    结果与对追加后的整段数据调用add_cache_signals相同。
+    params:
+        - cached: 已缓存的一段数据，已添加换合约标记与前复权价格。
+        - new_rows: 时间在cached之后的行情数据。
+        - anchor: cached的复权锚点。
+        - intraday: 是否为日内数据。
+    return:
+        - zero_rows: 新增的行中preclose或close为0的行数。不为0时不追加。
+        - extended: 追加后的数据。zero_rows不为0时为None。
+        - anchor: 追加后的复权锚点。zero_rows不为0时为None。
+    """
+    # 以已缓存的最后一行作为前一行，计算新增第一行的换合约标记与preclose
+    new_rows = pd.concat([cached.iloc[-1:][new_rows.columns], new_rows], ignore_index=True)
+    add_chg_signal(new_rows)
+    if intraday:
+        correct_preclose(new_rows)
+    last_next_c_chg = new_rows['next_c_chg'].iloc[0]
+    new_rows = new_rows.iloc[1:].copy()
+
+    zero_rows = count_zero_price_rows(new_rows)
+    if zero_rows:
+        return zero_rows, None, None
+    anchor = add_adjusted_price(new_rows, validate=False, anchor=anchor)
+
+    extended = pd.concat([cached, new_rows[cached.columns]], ignore_index=True)
+    extended.loc[len(cached) - 1, 'next_c_chg'] = last_next_c_chg
+    return zero_rows, extended, anchor
+
+
+def add_chandelier_exit_signal(df, trs=0.12, lqk_width=0.1, lqk_floor=0.5, details=True):
     """
     添加吊灯线止损信号。
     在df中标记平仓日期。非纯函数。平仓信号使用复权价格计算。
@@ -101,150 +220,309 @@ def add_chandelier_exit_signal(df, trs=0.12, lqk_width=0.1, lqk_floor=0.5):
         - trs: 用于调整吊灯线与价格之间的距离。trs越大则吊灯线越不敏感。
         - lqk_width: liqka每期减小的步长。
         - lqk_floor: liqka能达到的最小值。
+        - details: 是否在df中保存吊灯线等中间结果。为False时只写入long_exit和short_exit。
     """
 
-    position_direction = 0  # 当前头寸方向。1为多头，-1为空头，0为无头寸。
-
-    df['higher_after_entry'] = 0  # 开仓以来较高价
-    df['lower_after_entry'] = 0  # 开仓以来较低价
-    df['dliqpoint'] = 0  # 多头吊灯线
-    df['kliqpoint'] = 0  # 空头吊灯线
-    df['liqka'] = 1  # 止盈止损幅度乘数
-
     if not has_column(df, 'long_exit'):
         df['long_exit'] = False  # 多头平仓日期
 
     if not has_column(df, 'short_exit'):
         df['short_exit'] = False  # 空头平仓日期
 
-    for i in range(len(df)-1):
-
-        # 开多头
-        if df.longgo.iloc[i] and position_direction <= 0:
-            position_direction = 1
-            df.lower_after_entry.iloc[i] = max(df.adjusted_close.iloc[i-1], df.adjusted_low.iloc[i])
-            continue
-
-        # 开空头
-        if df.shortgo.iloc[i] and position_direction >= 0:
-            position_direction = -1
-            df.higher_after_entry.iloc[i] = min(df.adjusted_close.iloc[i-1], df.adjusted_high.iloc[i])
-            continue
-
-        # 平多头
-        if df.long_exit.iloc[i] and position_direction > 0:
-            position_direction = 0
-            continue
-
-        # 平空头
-        if df.short_exit.iloc[i] and position_direction < 0:
-            position_direction = 0
-            continue
-
-        # 有持仓时计算吊灯线
-        if position_direction != 0:
-            df.liqka.iloc[i] = max(df.liqka.iloc[i - 1] - lqk_width, lqk_floor)
-            delta = df.adjusted_open.iloc[i] * trs * df.liqka.iloc[i]
-
-            if position_direction > 0:
-                df.lower_after_entry.iloc[i] = max(df.adjusted_low.iloc[i],
-                                                   df.lower_after_entry.iloc[i - 1])
-                df.dliqpoint.iloc[i] = df.lower_after_entry.iloc[i] - delta
-
-                # 平仓日期是计算出平仓信号的后一天
-                if df.adjusted_close.iloc[i] < df.dliqpoint.iloc[i]:
-                    df.long_exit.iloc[i + 1] = True
-            else:
-                df.higher_after_entry.iloc[i] = min(df.adjusted_high.iloc[i],
-                                                    df.higher_after_entry.iloc[i - 1])
-                df.kliqpoint.iloc[i] = df.higher_after_entry.iloc[i] + delta
-
-                # 平仓日期是计算出平仓信号的后一天
-                if df.adjusted_close.iloc[i] > df.kliqpoint.iloc[i]:
-                    df.short_exit.iloc[i + 1] = True
+    (higher_after_entry,  # 开仓以来较高价
+     lower_after_entry,  # 开仓以来较低价
+     dliqpoint,  # 多头吊灯线
+     kliqpoint,  # 空头吊灯线
+     liqka,  # 止盈止损幅度乘数
+     df['long_exit'],
+     df['short_exit']) = chandelier_exit_kernel(as_float_array(df.adjusted_open),
+                                                as_float_array(df.adjusted_high),
+                                                as_float_array(df.adjusted_low),
+                                                as_float_array(df.adjusted_close),
+                                                as_bool_array(df.longgo),
+                                                as_bool_array(df.shortgo),
+                                                as_bool_array(df.long_exit),
+                                                as_bool_array(df.short_exit),
+                                                trs, lqk_width, lqk_floor)
+
+    if details:
+        df['higher_after_entry'] = higher_after_entry
+        df['lower_after_entry'] = lower_after_entry
+        df['dliqpoint'] = dliqpoint
+        df['kliqpoint'] = kliqpoint
+        df['liqka'] = liqka
 
 
 def add_position_direction(df):
     """
     在df中标记开仓方向。
     """
-    df['position_direction'] = 0
-    for i in range(1, len(df)):
+    df['position_direction'] = position_direction_kernel(as_bool_array(df.longgo),
+                                                         as_bool_array(df.shortgo),
+                                                         as_bool_array(df.long_exit),
+                                                         as_bool_array(df.short_exit))
 
-        # 开多头
-        if df.longgo.iloc[i] and df.position_direction.iloc[i - 1] <= 0:
-            df.position_direction.iloc[i] = 1
-            continue
 
-        # 开空头
-        if df.shortgo.iloc[i] and df.position_direction.iloc[i - 1] >= 0:
-            df.position_direction.iloc[i] = -1
-            continue
+def add_atr_exit_signal(df, atr_length, trs, details=True):
+    """
+    添加ATR止损信号。非纯函数。
+    平仓信号计算方法：持有多头仓位时记录开仓以来的最高价highest_after_entry，若收盘价低于
+                   highest_after_entry - trs * atr则平多头。持有空头仓位时同理。
+    params:
+        - df: 一段连续的行情数据。需要行情中包括前复权最高价adjusted_high, 前复权最低价
+              adjusted_low, 前复权收盘价adjusted_close，并标注开仓时刻longgo和shortgo。
+        - atr_length: 计算atr的窗宽。
+        - trs: atr的乘数。trs越大则止损越不敏感。
+        - details: 是否在df中保存atr等中间结果。为False时只写入long_exit和short_exit。
+    """
+    close, high, low = df.adjusted_close, df.adjusted_high, df.adjusted_low
 
-        # 平多头
-        if df.long_exit.iloc[i] and df.position_direction.iloc[i - 1] > 0:
-            df.position_direction.iloc[i] = 0
-            continue
+    # 同一段数据、同一atr_length的ATR由指标缓存复用，不同的trs不再重复计算
+    atr = as_float_array(ATR(high=high, low=low, close=close, timeperiod=atr_length))
 
-        # 平空头
-        if df.short_exit.iloc[i] and df.position_direction.iloc[i - 1] < 0:
-            df.position_direction.iloc[i] = 0
-            continue
+    if not has_column(df, 'long_exit'):
+        df['long_exit'] = False  # 多头平仓日期
 
-        df.position_direction.iloc[i] = df.position_direction.iloc[i - 1]
+    if not has_column(df, 'short_exit'):
+        df['short_exit'] = False  # 空头平仓日期
 
+    (highest_after_entry,  # 开仓以来最高价
+     lowest_after_entry,  # 开仓以来最低价
+     df['long_exit'],
+     df['short_exit']) = atr_exit_kernel(as_float_array(high),
+                                         as_float_array(low),
+                                         as_float_array(close),
+                                         atr,
+                                         as_bool_array(df.longgo),
+                                         as_bool_array(df.shortgo),
+                                         as_bool_array(df.long_exit),
+                                         as_bool_array(df.short_exit),
+                                         trs)
 
-def add_atr_exit_signal(df, atr_length, trs):
-    close, high, low = df.adjusted_close, df.adjusted_high, df.adjusted_low
+    if details:
+        df['atr'] = atr
+        df['highest_after_entry'] = highest_after_entry
+        df['lowest_after_entry'] = lowest_after_entry
 
-    df['atr'] = ATR(high=high, low=low, close=close, timeperiod=atr_length)
 
-    position_direction = 0
-    df['highest_after_entry'] = 0  # 开仓以来最高价
-    df['lowest_after_entry'] = 0  # 开仓以来最低价
+# 以下为批量回测使用的函数：N组参数的信号保存为bars×N的矩阵，第j列对应第j组参数。
 
-    if not has_column(df, 'long_exit'):
-        df['long_exit'] = False  # 多头平仓日期
+def indicator_matrix(compute, keys, bars):
+    """
+    计算每组参数的指标，拼成bars×N的矩阵。相同的key只计算一次。
+    params:
+        - compute: compute(key)返回一个长度为bars的指标序列。
+        - keys: 每组参数对应的key。
+        - bars: 数据的行数。
+    return:
+        - matrix: 指标矩阵。计算失败的列为NaN。
+        - errors: {列号: 错误信息}，计算时抛出AllNaError的列。
+    """
+    values, failed = {}, {}
+    for key in dict.fromkeys(keys):
+        try:
+            values[key] = as_float_array(compute(key))
+        except AllNaError as e:
+            failed[key] = str(e)
+
+    matrix = np.full((bars, len(keys)), np.nan, order='F')
+    errors = {}
+    for j, key in enumerate(keys):
+        if key in values:
+            matrix[:, j] = values[key]
+        else:
+            errors[j] = failed[key]
+    return matrix, errors
+
+
+def shift_signals(signals):
+    """
+    将bars×N的信号矩阵向后移动一期。与Series.shift(1)一致，首行为NaN，视为True。
+    """
+    signals = np.asarray(signals, dtype=bool)
+    shifted = np.ones(signals.shape, dtype=bool, order='F')
+    shifted[1:] = signals[:-1]
+    return shifted
 
-    if not has_column(df, 'short_exit'):
-        df['short_exit'] = False  # 空头平仓日期
 
-    for i in range(len(df)-1):
-
-        # 开多头
-        if df.longgo.iloc[i] and position_direction <= 0:
-            position_direction = 1
-            df.lowest_after_entry.iloc[i] = low.iloc[i]
-            continue
-
-        # 开空头
-        if df.shortgo.iloc[i] and position_direction >= 0:
-            position_direction = -1
-            df.highest_after_entry.iloc[i] = high.iloc[i]
-            continue
-
-        # 平多头
-        if df.long_exit.iloc[i] and position_direction > 0:
-            position_direction = 0
-            continue
-
-        # 平空头
-        if df.short_exit.iloc[i] and position_direction < 0:
-            position_direction = 0
-            continue
-
-        # 有持仓时计算出场条件
-        if position_direction != 0:
-
-            if position_direction > 0:
-                df.highest_after_entry.iloc[i] = max(high.iloc[i],
-                                                     df.highest_after_entry.iloc[i - 1])
-                # 平仓日期是计算出平仓信号的后一天
-                if close.iloc[i] < df.highest_after_entry.iloc[i] - trs * df.atr.iloc[i]:
-                    df.long_exit.iloc[i + 1] = True
+def position_direction_matrix(longgo, shortgo, long_exit, short_exit):
+    """add_position_direction的批量版本。各参数为bars×N的布尔矩阵，返回bars×N的开仓方向矩阵。"""
+    position_direction = np.zeros(longgo.shape, dtype=np.int64, order='F')
+    for j in range(longgo.shape[1]):
+        position_direction[:, j] = position_direction_kernel(longgo[:, j], shortgo[:, j],
+                                                             long_exit[:, j], short_exit[:, j])
+    return position_direction
+
+
+def atr_exit_matrix(high, low, close, atr, longgo, shortgo, long_exit, short_exit, trs):
+    """
+    add_atr_exit_signal的批量版本。
+    params:
+        - high, low, close: 价格序列，各列共用。
+        - atr: bars×N的ATR矩阵。
+        - longgo, shortgo, long_exit, short_exit: bars×N的布尔矩阵，不会被修改。
+        - trs: 每列的atr乘数。
+    return:
+        - long_exit, short_exit: 添加止损信号后的平仓信号矩阵。
+    """
+    high, low, close = as_float_array(high), as_float_array(low), as_float_array(close)
+    long_exit = np.array(long_exit, dtype=bool, order='F')
+    short_exit = np.array(short_exit, dtype=bool, order='F')
+    for j in range(atr.shape[1]):
+        _, _, long_exit[:, j], short_exit[:, j] = atr_exit_kernel(high, low, close, atr[:, j],
+                                                                  longgo[:, j], shortgo[:, j],
+                                                                  long_exit[:, j], short_exit[:, j],
+                                                                  trs[j])
+    return long_exit, short_exit
+
+
+# 以下为逐bar模式使用的类：每次update读入一根bar，更新状态并返回这根bar的信号，结果与批量计算的同一行相同。
+
+class PositionDirectionState:
+    """add_position_direction的逐bar版本。"""
+
+    def __init__(self):
+        self.position_direction = 0
+        self._count = 0
+
+    def update(self, longgo, shortgo, long_exit, short_exit):
+        # 第一期的开仓方向总为0
+        if self._count > 0:
+            prev = self.position_direction
+            if longgo and prev <= 0:
+                self.position_direction = 1
+            elif shortgo and prev >= 0:
+                self.position_direction = -1
+            elif long_exit and prev > 0:
+                self.position_direction = 0
+            elif short_exit and prev < 0:
+                self.position_direction = 0
+        self._count += 1
+        return self.position_direction
+
+
+def true_range(high, low, prev_close):
+    """单根bar的真实波幅，与backtest.indicators.TR相同：忽略NaN取最大值，第一根bar的prev_close为NaN。"""
+    ranges = [r for r in (high - low, abs(high - prev_close), abs(low - prev_close)) if r == r]
+    return max(ranges) if ranges else np.nan
+
+
+class AtrExitState:
+    """
+    add_atr_exit_signal的逐bar版本。ATR由前复权价格（或传入的其他价格）逐bar计算。
+    params:
+        - atr_length: 计算atr的窗宽。
+        - trs: atr的乘数。
+    """
+
+    def __init__(self, atr_length, trs):
+        self.trs = trs
+        self.atr = RollingMean(atr_length)
+        self.position_direction = 0
+        self.highest = 0.0
+        self.lowest = 0.0
+        self._prev_close = np.nan
+        # 当期计算出的平仓信号在下一期生效
+        self._pending_long_exit = False
+        self._pending_short_exit = False
+
+    def update(self, high, low, close, longgo, shortgo, long_exit=False, short_exit=False):
+        """
+        params:
+            - high, low, close: 当期价格。
+            - longgo, shortgo: 当期开仓信号。
+            - long_exit, short_exit: 当期已有的平仓信号。
+        return:
+            - long_exit, short_exit: 加入ATR止损后当期的平仓信号。
+        """
+        atr = self.atr.update(true_range(high, low, self._prev_close))
+        self._prev_close = close
+
+        long_exit = bool(long_exit) or self._pending_long_exit
+        short_exit = bool(short_exit) or self._pending_short_exit
+        self._pending_long_exit = self._pending_short_exit = False
+
+        if longgo and self.position_direction <= 0:
+            self.position_direction = 1
+            self.highest = 0.0
+        elif shortgo and self.position_direction >= 0:
+            self.position_direction = -1
+            self.lowest = 0.0
+        elif long_exit and self.position_direction > 0:
+            self.position_direction = 0
+        elif short_exit and self.position_direction < 0:
+            self.position_direction = 0
+        elif self.position_direction > 0:
+            self.highest = self.highest if self.highest > high else high
+            self._pending_long_exit = close < self.highest - self.trs * atr
+        elif self.position_direction < 0:
+            self.lowest = self.lowest if self.lowest < low else low
+            self._pending_short_exit = close > self.lowest + self.trs * atr
+        return long_exit, short_exit
+
+
+class ChandelierExitState:
+    """
+    add_chandelier_exit_signal的逐bar版本。
+    第一根bar没有前收盘价，在第一根bar开仓时开仓以来的较高价、较低价为NaN；add_chandelier_exit_signal
+    此时取整段数据最后一根bar的收盘价。策略的开仓信号由shift(1).fillna(False)得到时，第一根bar不会开仓，两者相同。
+    params:
+        - trs, lqk_width, lqk_floor: 见add_chandelier_exit_signal。
+    """
+
+    def __init__(self, trs=0.12, lqk_width=0.1, lqk_floor=0.5):
+        self.trs = trs
+        self.lqk_width = lqk_width
+        self.lqk_floor = lqk_floor
+        self.position_direction = 0
+        self.higher = 0.0
+        self.lower = 0.0
+        self.liqka = 1.0
+        self._prev_close = np.nan
+        # 当期计算出的平仓信号在下一期生效
+        self._pending_long_exit = False
+        self._pending_short_exit = False
+
+    def update(self, open_, high, low, close, longgo, shortgo, long_exit=False, short_exit=False):
+        """
+        params:
+            - open_, high, low, close: 当期前复权价格。
+            - longgo, shortgo: 当期开仓信号。
+            - long_exit, short_exit: 当期已有的平仓信号。
+        return:
+            - long_exit, short_exit: 加入吊灯线止损后当期的平仓信号。
+        """
+        prev_close = self._prev_close
+        self._prev_close = close
+
+        long_exit = bool(long_exit) or self._pending_long_exit
+        short_exit = bool(short_exit) or self._pending_short_exit
+        self._pending_long_exit = self._pending_short_exit = False
+
+        if longgo and self.position_direction <= 0:
+            self.position_direction = 1
+            self.lower = low if low > prev_close else prev_close
+            self.liqka = 1.0
+        elif shortgo and self.position_direction >= 0:
+            self.position_direction = -1
+            self.higher = high if high < prev_close else prev_close
+            self.liqka = 1.0
+        elif long_exit and self.position_direction > 0:
+            self.position_direction = 0
+            self.liqka = 1.0
+        elif short_exit and self.position_direction < 0:
+            self.position_direction = 0
+            self.liqka = 1.0
+        elif self.position_direction != 0:
+            lk = self.liqka - self.lqk_width
+            self.liqka = self.lqk_floor if self.lqk_floor > lk else lk
+            delta = open_ * self.trs * self.liqka
+            if self.position_direction > 0:
+                self.lower = self.lower if self.lower > low else low
+                self._pending_long_exit = close < self.lower - delta
             else:
-                df.lowest_after_entry.iloc[i] = min(low.iloc[i],
-                                                    df.lowest_after_entry.iloc[i - 1])
-                # 平仓日期是计算出平仓信号的后一天
-                if close.iloc[i] > df.lowest_after_entry.iloc[i] + trs * df.atr.iloc[i]:
-                    df.short_exit.iloc[i + 1] = True
+                self.higher = self.higher if self.higher < high else high
+                self._pending_short_exit = close > self.higher + delta
+        else:
+            self.liqka = 1.0
+        return long_exit, short_exit
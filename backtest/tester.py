@@ -1,56 +1,184 @@
-import os
 from collections import defaultdict
 
 import pandas as pd
 from empyrical import sharpe_ratio
 
-from backtest import run_pd_backtest, cum_ret_to_daily_ret
+from backtest import run_np_backtest, run_pd_backtest_matrix, cum_ret_to_daily_ret
 from backtest.indicators import AllNaError
+from backtest.cache_io import LazyCache
+from backtest.result_store import params_key
 from consts import CACHE_ROOT_DIR
+from utils import peak_rss
+
+# run_np_backtest 读取的字段
+BACKTEST_COLUMNS = ['datetime', 'close', 'preclose', 'c_chg', 'next_c_chg', 'position_direction']
+# 行情价格与前复权价格
+PRICE_COLUMNS = ['open', 'high', 'low', 'close']
+ADJUSTED_PRICE_COLUMNS = ['adjusted_open', 'adjusted_high', 'adjusted_low', 'adjusted_close']
+# 精简模式下除input_columns外保留的输入字段：回测所需的行情字段，以及数据中已有的平仓信号
+LEAN_BASE_COLUMNS = ['datetime', 'close', 'preclose', 'c_chg', 'next_c_chg', 'long_exit', 'short_exit']
+# 逐bar模式输出的信号
+SIGNAL_COLUMNS = ['longgo', 'shortgo', 'long_exit', 'short_exit', 'position_direction']
 
 
 class Tester:
 
     backtest_data = defaultdict(list)
+    # 是否实现了position_direction_batch，可用test_batch批量回测
+    supports_batch = False
+    # 是否实现了init_state与update_bar，可逐bar生成信号
+    supports_incremental = False
+    # 计算信号读取的字段，精简模式下self.df只保留这些字段与LEAN_BASE_COLUMNS。None表示保留全部字段
+    input_columns = None
 
     @classmethod
-    def read_cache(cls, level):
-        cls.backtest_data = defaultdict(list)
-
+    def read_cache(cls, level, maxsize=32):
+        """
+        挂载level级别的缓存。品种与数据段数量来自缓存索引，某段数据在首次访问时才读取，
+        最近访问的maxsize段数据保存在内存中。优先读取列式二进制缓存，没有时读取CSV缓存。
+        """
         level_root_path = CACHE_ROOT_DIR + f'{level}\\'
-        categories = os.listdir(level_root_path)
+        cls.backtest_data = LazyCache(level_root_path, maxsize=maxsize)
 
-        for category in categories:
-            category_path = level_root_path + f'{category}\\'
-            csv_files = os.listdir(category_path)
-            for file in csv_files:
-                df = pd.read_csv(category_path + file, parse_dates=['datetime'])
-                cls.backtest_data[category].append(df)
+    @classmethod
+    def attach_cache(cls, level, maxsize=4):
+        """
+        多进程回测时每个worker启动时挂载一次缓存，之后的任务只需传递参数，不再传递数据。
+        同一段数据的参数组合相邻提交，worker只需保留最近访问的几段数据。
+        """
+        cls.read_cache(level, maxsize=maxsize)
 
-    def __init__(self, params, df=None):
+    def __init__(self, params, df=None, lean=False):
+        """
+        params:
+            - params: 参数，不给出df时需包括数据段category与idx。
+            - df: 回测数据，默认为params对应的缓存数据段。
+            - lean: 精简模式，见test。self.df只引用需要的字段。
+        self.df中的字段引用df中的数据而不复制，计算信号时新增的字段不写入df。不同参数的Tester因而引用同一段数据，
+        共享被缓存的指标（见backtest.memo）。
+        """
         # 数据标记
         self.params = params
+        # 精简模式下信号的中间结果不写入self.df
+        self.lean = lean
 
         if df is None:
             category = self.params['category']
             idx = self.params['idx']
-            self.df = self.backtest_data[category][idx].copy()
-        else:
-            self.df = df.copy()
+            df = self.backtest_data[category][idx]
+        self.df = self.lean_frame(df) if lean else self.reference_frame(df)
+
+    @staticmethod
+    def reference_frame(df, columns=None):
+        """由df中的columns字段组成新的DataFrame，各字段引用df中的数据，不复制。默认为全部字段。"""
+        columns = df.columns if columns is None else columns
+        return pd.DataFrame({col: df[col] for col in columns}, copy=False)
+
+    @classmethod
+    def lean_frame(cls, df):
+        """由df中计算信号与回测所需的字段组成新的DataFrame，各字段引用df中的数据，不复制。"""
+        columns = df.columns if cls.input_columns is None else \
+            [col for col in df.columns if col in cls.input_columns or col in LEAN_BASE_COLUMNS]
+        return cls.reference_frame(df, columns)
 
     def add_signals(self):
         raise NotImplementedError
 
-    def test(self, commission=0.0001):
+    def init_state(self):
+        """逐bar模式：重置指标与仓位状态。"""
+        raise NotImplementedError
+
+    def update_bar(self, bar):
+        """
+        逐bar模式：读入一根bar，更新状态，开销为O(1)。
+        params:
+            - bar: 一根bar的数据，字段与回测数据相同（如字典或Series）。
+        return:
+            - 这根bar的信号，{字段: 值}，字段见SIGNAL_COLUMNS。
+        """
+        raise NotImplementedError
+
+    def start_incremental(self):
+        """
+        进入逐bar模式：重置状态并在self.df上逐bar回放，返回各bar的信号。
+        之后每有新的bar，调用append_bars或update_bar即可得到新bar的信号，不必重新计算整段数据。
+        回放的信号与add_signals在self.df上的结果相同（首行由shift产生的NaN记为True）。
+        """
+        self.init_state()
+        return self.append_bars(self.df)
+
+    def append_bars(self, bars):
+        """
+        逐bar模式：依次读入bars中的每根bar，返回这些bar的信号，索引与bars相同。
+        追加的bar不写入self.df。
+        """
+        signals = [self.update_bar(bar) for bar in bars.to_dict('records')]
+        return pd.DataFrame(signals, index=bars.index, columns=SIGNAL_COLUMNS)
+
+    @classmethod
+    def position_direction_batch(cls, df, params_list):
+        """
+        在同一段数据df上一次计算params_list中N组参数的开仓方向。
+        return:
+            - position_direction: bars×N的开仓方向矩阵。
+            - errors: {列号: 错误信息}，计算信号时出错的参数组。
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def test_batch(cls, params_list, df=None, commission=0.0001, lean=False):
+        """
+        在同一段数据上批量回测多组参数，信号与回测均按bars×N的矩阵一次算出。
+        返回与params_list一一对应的结果，格式与test相同。策略需实现position_direction_batch。
+        params:
+            - params_list: 多组参数，category与idx须相同。
+            - df: 回测数据，默认为params_list对应的缓存数据段。
+        """
+        if df is None:
+            df = cls.backtest_data[params_list[0]['category']][params_list[0]['idx']]
+
+        position_direction, errors = cls.position_direction_batch(df, params_list)
+        cum_ret = run_pd_backtest_matrix(df, position_direction, commission=commission)
+        datetime = df.datetime.tolist()
+
+        results = []
+        for j, params in enumerate(params_list):
+            res = {'params': params, 'key': params_key(params)}
+            if j in errors:
+                res['error'] = errors[j]
+            else:
+                res['cum_ret'] = {'datetime': list(datetime), 'cum_ret': cum_ret[:, j].tolist()}
+            if lean:
+                res['memory'] = {'peak_rss': peak_rss()}
+            results.append(res)
+        return results
+
+    def test(self, commission=0.0001, lean=False):
+        """
+        计算信号并回测。
+        params:
+            - commission: 手续费率。
+            - lean: 精简模式。信号的中间指标保留为局部变量，回测前self.df只保留回测所需的字段，
+                    并在结果的memory中报告self.df占用的字节数df_bytes与进程峰值内存peak_rss。
+                    构造时以lean=True读取数据，计算信号前self.df就只包括input_columns中的字段。
+        """
+        self.lean = lean
         res = dict()
         res['params'] = self.params
+        res['key'] = params_key(self.params)
 
         try:
             self.add_signals()
         except AllNaError as e:
             res['error'] = str(e)
         else:
+            if lean:
+                self.df = self.df[BACKTEST_COLUMNS]
+
             # 累计收益率
-            cum_ret = run_pd_backtest(self.df, commission=commission)
-            res['cum_ret'] = cum_ret.reset_index().to_dict('list')
+            cum_ret = run_np_backtest(self.df, commission=commission)['cum_ret']
+            res['cum_ret'] = {'datetime': self.df.datetime.tolist(), 'cum_ret': cum_ret.tolist()}
+
+        if lean:
+            res['memory'] = {'df_bytes': int(self.df.memory_usage(deep=True).sum()), 'peak_rss': peak_rss()}
         return res
@@ -0,0 +1,46 @@
+"""
+比较CSV缓存与列式二进制缓存的读取时间。
+用法：python benchmark_read_cache.py 15min
+若某段数据只有CSV缓存，先将其转存为二进制缓存。
+"""
+import os
+import sys
+import time
+
+from backtest.cache_io import read_slice, write_slice, NPY
+from consts import CACHE_ROOT_DIR
+
+
+def benchmark(level):
+    level_root_path = os.path.join(CACHE_ROOT_DIR, level)
+    csv_time = npy_time = 0
+    slice_num = 0
+
+    for category in os.listdir(level_root_path):
+        if not os.path.isdir(os.path.join(level_root_path, category)):
+            continue
+        category_path = os.path.join(level_root_path, category)
+        for name in os.listdir(category_path):
+            if not name.endswith('.csv'):
+                continue
+            idx = name[:-len('.csv')]
+            npy_path = os.path.join(category_path, idx)
+
+            start = time.perf_counter()
+            df = read_slice(os.path.join(category_path, name))
+            csv_time += time.perf_counter() - start
+
+            if not os.path.isdir(npy_path):
+                write_slice(df, category_path, idx, NPY)
+
+            start = time.perf_counter()
+            read_slice(npy_path)
+            npy_time += time.perf_counter() - start
+            slice_num += 1
+
+    print(f'{level}: {slice_num} slices')
+    print(f'csv: {csv_time:.2f}s, npy: {npy_time:.2f}s, speedup: {csv_time / max(npy_time, 1e-9):.1f}x')
+
+
+if __name__ == '__main__':
+    benchmark(sys.argv[1] if len(sys.argv) > 1 else 'daily')
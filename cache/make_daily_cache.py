@@ -1,12 +1,14 @@
 import re
+import shutil
+import sys
 from functools import partial
 from concurrent import futures
 
-import talib
+import numpy as np
 import pandas as pd
 from dateutil.parser import parse
-from utils import mkdirs
-from backtest.signals import add_chg_signal, add_adjusted_price, AddSignalError
+from backtest.cache_io import write_index, DEFAULT_FORMAT
+from backtest.cache_update import build_slices, update_slices, segment_bounds, read_watermarks, write_watermarks
 
 
 def get_commodity_category(code: str):
@@ -24,72 +26,116 @@ def get_commodity_category(code: str):
     return category
 
 
+def qualified_ranges(qualified: np.ndarray) -> list:
+    """
+    qualified中连续为True的每一段的位置范围[(start, stop), ...]，不包括stop。
+    """
+    edges = np.diff(np.concatenate(([0], qualified.astype(np.int8), [0])))
+    return list(zip(np.flatnonzero(edges == 1).tolist(), np.flatnonzero(edges == -1).tolist()))
+
+
 def select_high_liquidity_data(df: pd.DataFrame, threshold=50000, period=1 / 20) -> list:
     """
-    从一个品种的数据中提取出几段入选的数据。非纯函数。
+    从一个品种的数据中选出几段入选的数据，返回每段数据在df中的位置范围。不修改df。
 
-    入选规则：对每一天的行情添加qualified变量，成交量大于等于threshold记为1，小于threshold记为-1。
-              对qualified求移动平均值，选入移动平均值大于0的每段行情。
+    入选规则：对每一天的行情，成交量大于等于threshold记为1，小于threshold记为-1。
+              对其求移动平均值，选入移动平均值大于等于0的每段行情。不足一个窗宽的行不入选。
 
     params:
         - df: 同一品种的一段连续的行情数据。
         - threshold: 成交量阈值。
-        - period: 移动平均窗宽。默认为df长度的1/20。
+        - period: 移动平均窗宽。默认为df长度的1/20，不足1时取1。
     return:
-        - qualified_data: 从df中选取的几段行情数据。
+        - 入选的各段数据的位置范围[(start, stop), ...]，df.iloc[start:stop]即为一段数据。
     """
+    window = max(int(len(df) * period), 1)
+    above = np.where(df.volume.values >= threshold, 1, -1)
+    # 窗口内1与-1的和，与移动平均值同号
+    window_sum = np.cumsum(above)
+    window_sum[window:] -= window_sum[:-window].copy()
+    qualified = window_sum >= 0
+    qualified[:window - 1] = False
+    return qualified_ranges(qualified)
+
 
-    df['volume_gt_threshold'] = df.volume.apply(lambda x: 1 if x >= threshold else -1)
-    df['volume_gt_threshold_ma'] = talib.SMA(df.volume_gt_threshold, len(df) * period)
-    df['qualified'] = df.volume_gt_threshold_ma >= 0
+def select_all_data(df: pd.DataFrame):
+    return [(0, len(df))]
 
-    # 根据qualified将df分段，每一段数据中qualified都为True，或False
-    df['qualified_chg'] = (df.qualified != df.qualified.shift(1).fillna(df.qualified.iloc[0]))
-    df['group_num'] = df['qualified_chg'].astype('int').cumsum()
 
-    qualified_data = [sub_df for group_num, sub_df
-                      in df[df.qualified != 0].groupby('group_num')]
-    return qualified_data
+def range_views(df: pd.DataFrame, ranges):
+    """按位置范围切分df，各段数据为df的视图，不复制数据。"""
+    return [df.iloc[start:stop] for start, stop in ranges]
 
 
-def select_all_data(df: pd.DataFrame):
-    qualified_data = [df]
-    return qualified_data
+def make_cache(category, filter_function, col, fmt=DEFAULT_FORMAT):
+    """重建一个品种的缓存。返回品种与高水位标记。"""
+    global data
+    category_path = f'./{col}/{category}'
+    shutil.rmtree(category_path, ignore_errors=True)
+    cat_data = data[data.category == category]
+    qualified_data = range_views(cat_data, filter_function(cat_data))
+    watermark = build_slices(category_path, qualified_data, segment_bounds(qualified_data),
+                             cat_data.datetime.iloc[-1], fmt, report=lambda msg: print(f'{category}: {msg}'))
+    return category, watermark
 
 
-def make_cache(category, filter_function, col):
+def update_cache(category, watermark, filter_function, col, fmt=DEFAULT_FORMAT):
+    """
+    增量更新一个品种的缓存：只把高水位标记之后的行追加到最后一段数据，或写入新的数据段。
+    没有标记或已有数据段的边界移动时重建该品种的缓存。返回品种与新的高水位标记。
+    """
     global data
+    if watermark is None:
+        return make_cache(category, filter_function, col, fmt)
     cat_data = data[data.category == category]
-    qualified_data = filter_function(cat_data)
-    for i, original_df in enumerate(qualified_data):
-        df = original_df.copy()
-        try:
-            add_chg_signal(df)
-            add_adjusted_price(df)
-        except AddSignalError as e:
-            print(f'Error with {category}: {str(e)}')
-        else:
-            directory_path = f'./{col}/{category}'
-            mkdirs(directory_path)
-            df.to_csv(f'{directory_path}/{i}.csv', encoding='utf-8', index=False)
-    return category
+    qualified_data = range_views(cat_data, filter_function(cat_data))
+    new_watermark = update_slices(f'./{col}/{category}', qualified_data, segment_bounds(qualified_data),
+                                  cat_data.datetime.iloc[-1], watermark, fmt,
+                                  report=lambda msg: print(f'{category}: {msg}'))
+    if new_watermark is None:
+        return make_cache(category, filter_function, col, fmt)
+    return category, new_watermark
+
+
+def load_data(path='../data/daily/commodity.csv'):
+    """读取日行情，供make_cache、update_cache与refresh_cache使用。"""
+    global data, categories
+    data = pd.read_csv(path, parse_dates=['datetime'])
+    data = data[data.datetime > parse('2010-01-01')]
+    data['category'] = data['code'].apply(get_commodity_category)
+    categories = data.category.unique().tolist()
+
+
+def refresh_cache(filter_function, col, fmt=DEFAULT_FORMAT, incremental=True, path='../data/daily/commodity.csv'):
+    """
+    生成或更新col下全部品种的缓存，并写入索引与高水位标记。
+    params:
+        - incremental: 是否增量更新。否则重建全部缓存。
+        - path: 日行情文件。每个子进程启动时各自读取，Windows上子进程不继承父进程中的数据。
+    """
+    load_data(path)
+    watermarks = read_watermarks(f'./{col}') if incremental else {}
+    task = partial(update_cache, filter_function=filter_function, col=col, fmt=fmt)
+    with futures.ProcessPoolExecutor(20, initializer=load_data, initargs=(path,)) as executor:
+        res = dict(executor.map(task, categories, [watermarks.get(category) for category in categories]))
+    print(f'{sorted(res)} completed!')
+    watermarks.update(res)
+    write_watermarks(f'./{col}', watermarks)
+    write_index(f'./{col}')
 
 
 make_daily_cache = partial(make_cache, filter_function=select_high_liquidity_data, col='daily')
 make_daily_no_filter_cache = partial(make_cache, filter_function=select_all_data, col='daily_no_filter')
 
-data = pd.read_csv('../data/daily/commodity.csv', parse_dates=['datetime'])
-data = data[data.datetime > parse('2010-01-01')]
-data['category'] = data['code'].apply(get_commodity_category)
-categories = data.category.unique().tolist()
-
 
 if __name__ == '__main__':
-    print(data[(data.category == 'JR') & (data.preclose == 0)])
+    # 默认增量更新，加--full参数时重建全部缓存
+    refresh_cache(select_high_liquidity_data, 'daily', incremental='--full' not in sys.argv)
 
     # with futures.ProcessPoolExecutor(20) as executor:
     #     res = executor.map(make_daily_no_filter_cache, categories)
     # print(f'{sorted(list(res))} completed!')
+    # write_index('./daily_no_filter')
 
 
     #
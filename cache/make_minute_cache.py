@@ -1,14 +1,19 @@
+import io
 import os
+import shutil
+import sys
 import numpy as np
 import pandas as pd
 from concurrent import futures
 from functools import partial
 
 from dateutil.parser import parse
+from pandas.tseries.frequencies import to_offset
+from pandas.tseries.offsets import Tick
 
 from backtest.tester import Tester
-from backtest.signals import add_chg_signal, add_adjusted_price
-from utils import mkdirs
+from backtest.cache_io import write_index, DEFAULT_FORMAT
+from backtest.cache_update import build_slices, update_slices, segment_bounds, read_watermarks, write_watermarks
 from consts import DATA_MINUTE_DIR
 
 Tester.read_cache('daily')
@@ -24,24 +29,78 @@ def extract_category_from_file_name(file_name: str) -> str:
     return category
 
 
-def get_datetime_str(minute_data):
-    """获得字符串形式的datetime"""
-    return minute_data['actionday'].strftime('%Y-%m-%d') + ' ' + minute_data['minute']
+# 分钟级数据中价格、成交量字段与合成后字段的对应关系
+KLINE_FIELDS = {'mopen': 'open', 'mhigh': 'high', 'mlow': 'low', 'mclose': 'close', 'mvolume': 'volume'}
 
 
-def kline_resampler(df):
-    if df.name == 'mhigh':
-        return df.max()
-    elif df.name == 'mlow':
-        return df.min()
-    elif df.name == 'mopen':
-        return df.iloc[0] if len(df) > 0 else np.nan
-    elif df.name == 'mclose':
-        return df.iloc[-1] if len(df) > 0 else np.nan
-    elif df.name == 'mvolume':
-        return df.sum() if len(df) > 0 else np.nan
-    else:
-        return df.iloc[-1] if len(df) > 0 else np.nan
+def get_minute_datetime(minute_data):
+    """
+    由交易日期actionday与时间minute得到datetime。
+    minute的取值不超过一天的分钟数，只需对其中不重复的值各解析一次。
+    """
+    codes, minutes = pd.factorize(minute_data['minute'])
+    offsets = pd.to_datetime('2000-01-01 ' + pd.Series(minutes, dtype=str)) - pd.Timestamp('2000-01-01')
+    return minute_data['actionday'].dt.normalize() + offsets.values[codes]
+
+
+def level_nanos(level):
+    """bar的时间长度（纳秒）。只支持固定的时间长度。"""
+    freq = to_offset(level)
+    if not isinstance(freq, Tick):
+        raise ValueError(f'bar的时间长度必须固定，不支持{level}')
+    return freq.nanos
+
+
+def bar_end_labels(datetime, level):
+    """
+    每一分钟所属bar的结束时间，与resample(level, label='right', closed='right')的分组相同：
+    以第一天的0点为起点，每level划分一根bar，恰好在边界上的分钟属于以它结束的bar。
+    params:
+        - datetime: 升序的分钟时间。
+        - level: bar的时间长度，如'15min', '1H'。
+    """
+    step = level_nanos(level)
+    datetime = pd.DatetimeIndex(datetime)
+    origin = datetime[0].normalize()
+    elapsed = (datetime - origin).asi8
+    return origin + pd.to_timedelta(-(-elapsed // step) * step)
+
+
+def resample_bars(bars, level):
+    """
+    将bar合成为level级的bar。合成数据的datetime为bar结束时的时间。
+    开盘价取第一根bar的值，最高价、最低价取最大、最小值，成交量求和，收盘价及其余字段取最后一根bar的值。
+    没有数据的bar不出现在结果中。
+
+    :param bars: 包括datetime, open, high, low, close, volume的数据。
+    :param level: 合成数据时间粒度，可以是任意固定的时间长度。
+    :return: resampled 合成后数据。
+    """
+    if len(bars) == 0:
+        return bars.copy()
+    if not bars['datetime'].is_monotonic_increasing:
+        bars = bars.sort_values('datetime', kind='stable')
+
+    labels = bar_end_labels(bars['datetime'], level)
+    # 每根合成的bar在原数据中的第一行与最后一行
+    starts = np.flatnonzero(np.append(True, labels[1:] != labels[:-1]))
+    ends = np.append(starts[1:], len(labels)) - 1
+
+    columns = ['datetime'] + [col for col in bars.columns if col != 'datetime']
+    resampled = bars.iloc[ends][columns].reset_index(drop=True)
+    resampled['datetime'] = labels[ends]
+    if 'open' in resampled:
+        resampled['open'] = bars['open'].values[starts]
+    if 'high' in resampled:
+        resampled['high'] = np.fmax.reduceat(bars['high'].values, starts)
+    if 'low' in resampled:
+        resampled['low'] = np.fmin.reduceat(bars['low'].values, starts)
+    if 'volume' in resampled:
+        volume = bars['volume'].values
+        if volume.dtype.kind == 'f':
+            volume = np.where(np.isnan(volume), 0, volume)
+        resampled['volume'] = np.add.reduceat(volume, starts)
+    return resampled
 
 
 def resample_minute_data(minute_data, level):
@@ -49,82 +108,185 @@ def resample_minute_data(minute_data, level):
     将分钟级数据合成为level级数据。合成数据的datetime为bar结束时的时间。
 
     :param minute_data: 分钟级数据。
-    :param level: 合成数据时间粒度。
+    :param level: 合成数据时间粒度，可以是任意固定的时间长度。
     :return: resampled 合成后数据。
     """
+    return resample_bars(minute_data.rename(columns=KLINE_FIELDS, copy=False), level)
 
-    resampled = minute_data.set_index('datetime')\
-                           .resample(level, label='right', closed='right')\
-                           .apply(kline_resampler)\
-                           .dropna(how='all')\
-                           .reset_index()
-    resampled.rename(columns={'mopen': 'open',
-                              'mclose': 'close',
-                              'mhigh': 'high',
-                              'mlow': 'low',
-                              'mvolume': 'volume',
-                              }, inplace=True)
-    return resampled
+
+def resample_levels(minute_data, levels):
+    """
+    由分钟级数据合成多个级别的数据。由细到粗依次合成，若已合成的某个级别能整除一天，且能整除当前级别，
+    则当前级别由其中最粗的一个合成，不再遍历分钟级数据。两种方式得到的bar相同。
+
+    :param minute_data: 分钟级数据。
+    :param levels: 合成数据时间粒度的列表，如['5min', '15min', '30min', '60min', '1D']。
+    :return: bars 级别到合成后数据的字典。
+    """
+    day = pd.Timedelta('1D').value
+    bars = {}
+    built = []
+    for level in sorted(set(levels), key=level_nanos):
+        nanos = level_nanos(level)
+        sources = [finer for finer in built if day % nanos == 0 and nanos % level_nanos(finer) == 0]
+        if sources:
+            bars[level] = resample_bars(bars[sources[-1]], level)
+        else:
+            bars[level] = resample_minute_data(minute_data, level)
+        built.append(level)
+    return bars
 
 
 def extract_sub_m_data(m_data, date_range):
     return date_range.join(m_data.set_index('actionday'), how='inner')
 
 
-def correct_preclose(df):
+def minute_file_path(category):
+    return DATA_MINUTE_DIR + f'\\m1_{category.lower()}.csv'
+
+
+def read_minute_data(category, offset=0):
     """
-    考虑更换合约的情况，获得正确的preclose。
-    若是新更换的合约，则preclose为表中字段的值。否则preclose为上一行的close。
-    :param df: 已添加c_chg字段
-    :return: 非纯函数。
+    读取分钟数据文件中第offset字节之后的完整行。分钟数据文件只在末尾追加新的行。
+    return:
+        - m_data: 分钟级数据。
+        - row_offsets: m_data中每一行在文件中的起始字节。
     """
-    df['above_line_close'] = df.close.shift(1).fillna(df.preclose.iloc[0])
-    df['preclose'] = df.apply(lambda x: x['preclose'] if x['c_chg'] else x['above_line_close'], axis=1)
-    df.drop(columns=['above_line_close'], inplace=True)
-
+    with open(minute_file_path(category), 'rb') as f:
+        header = f.readline()
+        offset = max(offset, f.tell())
+        f.seek(offset)
+        content = f.read()
+    # 只读取到最后一个换行符，未写完的行留到下次读取
+    content = content[:content.rfind(b'\n') + 1]
+    line_ends = np.flatnonzero(np.frombuffer(content, dtype=np.uint8) == ord('\n'))
+    row_offsets = offset + np.append(0, line_ends + 1)[:-1]
 
-def make_cache(category, level):
-    m_data = pd.read_csv(DATA_MINUTE_DIR + f'\\m1_{category.lower()}.csv', parse_dates=['actionday'])
-    m_data = m_data[m_data.actionday > parse('2010-01-01')]
+    # 保留空行，使每一行与其起始字节对应
+    m_data = pd.read_csv(io.BytesIO(header + content), parse_dates=['actionday'], skip_blank_lines=False)
+    selected = (m_data.actionday > parse('2010-01-01')).values
+    m_data = m_data[selected]
     # m_data.rename(columns={'deliv_mon': 'delivery_month'}, inplace=True)
-    m_data['datetime'] = pd.to_datetime(m_data.apply(get_datetime_str, axis=1))
+    m_data['datetime'] = get_minute_datetime(m_data)
+    return m_data, row_offsets[selected]
+
 
-    resampled_data = resample_minute_data(m_data, level)
+def last_bar_offset(m_data, row_offsets, level):
+    """level级最后一根bar的第一分钟在分钟数据文件中的起始字节。这根bar可能尚未结束，下次从这里重新读取。"""
+    labels = bar_end_labels(m_data['datetime'], level)
+    return int(row_offsets[labels == labels.max()].min())
 
+
+def level_segments(category, resampled_data):
+    """
+    按日级缓存中的数据段切分合成后的数据。
+    return:
+        - sub_data_list: 各段数据，按日级数据段的序号排列。
+        - bounds: 对应日级数据段的起止日期。
+        - names: 对应日级数据段的名称，分钟级数据段与之同名。
+    """
+    # 索引中的名称按字符串排序，如'0', '1', '10', '2'，按序号重新排列
+    names = Tester.backtest_data.index.get(category, [])
+    order = sorted(range(len(names)), key=lambda i: int(names[i]))
+    daily_slices = [Tester.backtest_data[category][i] for i in order]
+    names = [names[i] for i in order]
     hi_liq_date_ranges = [d_data[['datetime']].set_index('datetime').rename(columns={'datetime': 'actionday'})
-                          for d_data in Tester.backtest_data[category]]
+                          for d_data in daily_slices]
     sub_data_list = [extract_sub_m_data(resampled_data, date_range) for date_range in hi_liq_date_ranges]
-    sub_data_list = [sub_data for sub_data in sub_data_list if len(sub_data) > 0]
+    return sub_data_list, segment_bounds(daily_slices), names
 
-    for i, original_sub_data in enumerate(sub_data_list):
-        sub_data = original_sub_data.copy()
-        add_chg_signal(sub_data)
-        correct_preclose(sub_data)
-        add_adjusted_price(sub_data)
 
-        cache_dir = f'../../cache/{level}/{category}'
-        mkdirs(cache_dir)
-        sub_data.to_csv(f'{cache_dir}/{i}.csv', encoding='utf-8', index=False)
+def write_level_cache(category, level, resampled_data, fmt=DEFAULT_FORMAT, watermark=None):
+    """
+    将合成后的数据按日级缓存中的数据段切分，添加换合约标记与复权价格后写入level级缓存。
+    每段数据与日级缓存中对应的数据段同名，没有分钟数据或存在preclose、close为0的数据段不写入缓存。
+    params:
+        - watermark: 上次生成缓存时的高水位标记。给出时resampled_data只包括最后一根bar及之后的数据，增量更新缓存。
+    return:
+        - 高水位标记。增量更新不适用时返回None。
+    """
+    category_path = f'../../cache/{level}/{category}'
+    sub_data_list, bounds, names = level_segments(category, resampled_data)
+    report = lambda msg: print(f'{category} {level}: {msg}')
+    if watermark is None:
+        end = resampled_data.datetime.iloc[-1]
+        return build_slices(category_path, sub_data_list, bounds, end, fmt, intraday=True, report=report,
+                            names=names)
+    end = resampled_data.datetime.iloc[-1] if len(resampled_data) > 0 else watermark['end']
+    return update_slices(category_path, sub_data_list, bounds, end, watermark, fmt, intraday=True,
+                         complete=False, report=report, names=names)
 
-    return category
+
+def make_caches(category, levels=('15min', '30min'), fmt=DEFAULT_FORMAT, watermarks=None):
+    """
+    分钟级数据只读取一次，由细到粗合成levels中的每个级别并写入缓存。
+    params:
+        - watermarks: 各级别上次生成缓存时的高水位标记。全部级别都有标记且都能整除一天时，从各级别最后一根bar中
+                      最早的起点读取分钟数据文件，重新合成这些可能未结束的bar及之后的bar，增量更新缓存；
+                      任何一个级别无法增量更新时重建全部级别。
+    return:
+        - category, 各级别新的高水位标记。
+    """
+    watermarks = watermarks or {}
+    day = pd.Timedelta('1D').value
+    offsets = [watermarks[level].get('offset') if level in watermarks else None for level in levels]
+    # 不能整除一天的级别，bar的划分取决于读取的第一天，无法从中间读取；
+    # 分钟数据文件比记录的短时说明文件被重写了，需要重建
+    if None not in offsets and all(day % level_nanos(level) == 0 for level in levels) and \
+            max(offsets) <= os.path.getsize(minute_file_path(category)):
+        m_data, row_offsets = read_minute_data(category, min(offsets))
+        new_watermarks = {}
+        for level, resampled_data in resample_levels(m_data, levels).items():
+            new_watermarks[level] = write_level_cache(category, level, resampled_data, fmt, watermarks[level])
+            if new_watermarks[level] is None:
+                break
+            new_watermarks[level]['offset'] = last_bar_offset(m_data, row_offsets, level) \
+                if len(m_data) > 0 else watermarks[level]['offset']
+        else:
+            return category, new_watermarks
+
+    m_data, row_offsets = read_minute_data(category)
+    new_watermarks = {}
+    for level, resampled_data in resample_levels(m_data, levels).items():
+        shutil.rmtree(f'../../cache/{level}/{category}', ignore_errors=True)
+        new_watermarks[level] = write_level_cache(category, level, resampled_data, fmt)
+        new_watermarks[level]['offset'] = last_bar_offset(m_data, row_offsets, level)
+    return category, new_watermarks
+
+
+def make_cache(category, level, fmt=DEFAULT_FORMAT):
+    return make_caches(category, [level], fmt)
 
 
 make_15min_cache = partial(make_cache, level='15min')
 make_30min_cache = partial(make_cache, level='30min')
 
 
+def refresh_caches(categories, levels=('15min', '30min'), fmt=DEFAULT_FORMAT, incremental=True):
+    """
+    生成或更新全部品种levels中每个级别的缓存，并写入索引与高水位标记。日级缓存需先更新。
+    params:
+        - incremental: 是否增量更新。否则重建全部缓存。
+    """
+    level_watermarks = {level: read_watermarks(f'../../cache/{level}') if incremental else {}
+                        for level in levels}
+    watermarks = [{level: level_watermarks[level][category] for level in levels
+                   if category in level_watermarks[level]} for category in categories]
+    with futures.ProcessPoolExecutor(20) as executor:
+        res = dict(executor.map(partial(make_caches, levels=levels, fmt=fmt), categories, watermarks))
+    print(f'{sorted(res)} completed!')
+    for level in levels:
+        level_watermarks[level].update({category: marks[level] for category, marks in res.items()})
+        write_watermarks(f'../../cache/{level}', level_watermarks[level])
+        write_index(f'../../cache/{level}')
+
+
 if __name__ == '__main__':
     file_names = os.listdir(DATA_MINUTE_DIR)
     categories = [extract_category_from_file_name(file_name) for file_name in file_names]
+    levels = ['15min', '30min']
 
-    print("making 15min cache...")
-    with futures.ProcessPoolExecutor(20) as executor:
-        res = executor.map(make_15min_cache, categories)
-    print(f'{sorted(list(res))} completed!')
-
-    print("making 30min cache...")
-    with futures.ProcessPoolExecutor(20) as executor:
-        res = executor.map(make_30min_cache, categories)
-    print(f'{sorted(list(res))} completed!')
-    # make_15min_cache('SR')
-    # make_30min_cache('SR')
+    # 默认增量更新，加--full参数时重建全部缓存
+    print(f"making {', '.join(levels)} cache...")
+    refresh_caches(categories, levels, incremental='--full' not in sys.argv)
+    # make_caches('SR')
@@ -4,7 +4,7 @@ _current_path = os.path.dirname(os.path.realpath(__file__))
 CACHE_ROOT_DIR = _current_path + '\\cache\\'
 DATA_DAILY_DIR = _current_path + '\\data\\daily\\'
 DATA_MINUTE_DIR = _current_path + '\\data\\minute\\'
-C_DAILY = os.listdir(CACHE_ROOT_DIR + 'daily')
-C_15MIN = os.listdir(CACHE_ROOT_DIR + '15min')
-C_30MIN = os.listdir(CACHE_ROOT_DIR + '30min')
+C_DAILY = [c for c in os.listdir(CACHE_ROOT_DIR + 'daily') if os.path.isdir(CACHE_ROOT_DIR + 'daily\\' + c)]
+C_15MIN = [c for c in os.listdir(CACHE_ROOT_DIR + '15min') if os.path.isdir(CACHE_ROOT_DIR + '15min\\' + c)]
+C_30MIN = [c for c in os.listdir(CACHE_ROOT_DIR + '30min') if os.path.isdir(CACHE_ROOT_DIR + '30min\\' + c)]
 
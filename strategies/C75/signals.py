@@ -4,12 +4,14 @@ import pandas as pd
 from backtest.signals import add_chandelier_exit_signal, add_position_direction, add_avg_daily_last_adjusted_close
 from backtest.indicators import HHV, LLV, SMA, BARSLAST
 
-from backtest.tester import Tester
+from backtest.tester import Tester, ADJUSTED_PRICE_COLUMNS
 
 
-def add_enter_signal(df, date_length=10, n1=75, n2=30):
+def add_enter_signal(df, date_length=10, n1=75, n2=30, details=True):
     """
     混沌操作法。
+    params:
+        - details: 是否在df中保存中间指标。
     """
 
     add_avg_daily_last_adjusted_close(df, date_length)
@@ -36,14 +38,15 @@ def add_enter_signal(df, date_length=10, n1=75, n2=30):
     dk_cond = high >= p_max
     kk_cond = low <= p_min
 
-    df['s1'] = s1
-    df['s2'] = s2
-    df['s3'] = s3
-    df['p_max'] = p_max
-    df['p_min'] = p_min
-    df['dk_cond'] = dk_cond
-    df['kk_cond'] = kk_cond
-    df['p_diff_pcnt'] = p_diff_pcnt
+    if details:
+        df['s1'] = s1
+        df['s2'] = s2
+        df['s3'] = s3
+        df['p_max'] = p_max
+        df['p_min'] = p_min
+        df['dk_cond'] = dk_cond
+        df['kk_cond'] = kk_cond
+        df['p_diff_pcnt'] = p_diff_pcnt
 
     df['longgo'] = (
         (close > df.avg_adjusted_close)
@@ -74,11 +77,15 @@ def add_enter_signal(df, date_length=10, n1=75, n2=30):
 
 class C75Tester(Tester):
 
+    input_columns = ADJUSTED_PRICE_COLUMNS + ['tradingday', 'avg_adjusted_close']
+
     def add_signals(self):
         params = self.params
-        add_enter_signal(self.df, date_length=params['date_length'], n1=params['n1'], n2=params['n2'])
+        add_enter_signal(self.df, date_length=params['date_length'], n1=params['n1'], n2=params['n2'],
+                         details=not self.lean)
         add_chandelier_exit_signal(self.df,
                                    trs=params['trs'],
                                    lqk_width=params['lqk_width'],
-                                   lqk_floor=params['lqk_floor'])
+                                   lqk_floor=params['lqk_floor'],
+                                   details=not self.lean)
         add_position_direction(self.df)
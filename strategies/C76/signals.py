@@ -4,7 +4,7 @@ import pandas as pd
 
 from backtest.indicators import MA, EMA, TR
 from backtest.signals import add_chandelier_exit_signal, add_position_direction
-from backtest.tester import Tester
+from backtest.tester import Tester, ADJUSTED_PRICE_COLUMNS
 
 
 def add_enter_signal(df, fast_length=25, slow_length=115, macd_length=9):
@@ -42,11 +42,13 @@ add_exit_signal = partial(add_chandelier_exit_signal, lqk_width=0, lqk_floor=1)
 
 class C76Tester(Tester):
 
+    input_columns = ADJUSTED_PRICE_COLUMNS
+
     def add_signals(self):
         add_enter_signal(self.df,
                          fast_length=self.params['fast_length'],
                          slow_length=self.params['slow_length'],
                          macd_length=self.params['macd_length'])
-        add_exit_signal(self.df, trs=self.params['trs'])
+        add_exit_signal(self.df, trs=self.params['trs'], details=not self.lean)
         add_position_direction(self.df)
 
@@ -1,6 +1,7 @@
 from backtest.indicators import HHV, LLV, MA
-from backtest.signals import add_atr_exit_signal, add_position_direction
-from backtest.tester import Tester
+from backtest.rolling import RollingMax, RollingMin, RollingMean
+from backtest.signals import add_atr_exit_signal, add_position_direction, AtrExitState, PositionDirectionState
+from backtest.tester import Tester, PRICE_COLUMNS, ADJUSTED_PRICE_COLUMNS
 
 
 def add_enter_signal(df, recent, short_length, long_length):
@@ -11,16 +12,19 @@ def add_enter_signal(df, recent, short_length, long_length):
     df['shortgo'] = ((close < LLV(close, recent).shift(1)) & (stma < ltma)).shift(1)
 
 
-def add_exit_signal(df, atr_length, trs):
-    add_atr_exit_signal(df, atr_length, trs)
+def add_exit_signal(df, atr_length, trs, details=True):
+    add_atr_exit_signal(df, atr_length, trs, details=details)
     df['long_exit'] = df['long_exit'] | df['next_c_chg']
     df['short_exit'] = df['short_exit'] | df['next_c_chg']
 
 
 class CHANNELTester(Tester):
 
-    def __init__(self, params, df=None):
-        super().__init__(params, df)
+    supports_incremental = True
+    input_columns = PRICE_COLUMNS + ADJUSTED_PRICE_COLUMNS
+
+    def __init__(self, params, df=None, lean=False):
+        super().__init__(params, df, lean)
 
         if "use_real_price" not in self.params:
             raise ValueError("Please specify whether real price or adjusted price should be used!")
@@ -36,5 +40,41 @@ class CHANNELTester(Tester):
                          long_length=self.params['long_length'])
         add_exit_signal(self.df,
                         atr_length=self.params['atr_length'],
-                        trs=self.params['trs'])
+                        trs=self.params['trs'],
+                        details=not self.lean)
         add_position_direction(self.df)
+
+    def init_state(self):
+        params = self.params
+        self._recent_high = RollingMax(params['recent'])
+        self._recent_low = RollingMin(params['recent'])
+        self._short_ma = RollingMean(params['short_length'])
+        self._long_ma = RollingMean(params['long_length'])
+        self._atr_exit = AtrExitState(params['atr_length'], params['trs'])
+        self._position = PositionDirectionState()
+        # 开仓信号由上一根bar计算，第一根bar的信号为shift产生的NaN，视为True
+        self._longgo = self._shortgo = True
+
+    def update_bar(self, bar):
+        prefix = '' if self.params['use_real_price'] else 'adjusted_'
+        high, low, close = bar[prefix + 'high'], bar[prefix + 'low'], bar[prefix + 'close']
+        longgo, shortgo = self._longgo, self._shortgo
+
+        # 入场信号，在下一根bar生效。通道为截至上一根bar的最高、最低收盘价
+        recent_high, recent_low = self._recent_high.value, self._recent_low.value
+        self._recent_high.update(close)
+        self._recent_low.update(close)
+        stma = self._short_ma.update(close)
+        ltma = self._long_ma.update(close)
+        self._longgo = close > recent_high and stma > ltma
+        self._shortgo = close < recent_low and stma < ltma
+
+        # 出场信号：ATR止损，换合约前平仓
+        long_exit, short_exit = self._atr_exit.update(high, low, close, longgo, shortgo,
+                                                      bar.get('long_exit', False), bar.get('short_exit', False))
+        long_exit = long_exit or bool(bar['next_c_chg'])
+        short_exit = short_exit or bool(bar['next_c_chg'])
+
+        position_direction = self._position.update(longgo, shortgo, long_exit, short_exit)
+        return {'longgo': longgo, 'shortgo': shortgo, 'long_exit': long_exit, 'short_exit': short_exit,
+                'position_direction': position_direction}
@@ -1,6 +1,12 @@
-from backtest.indicators import MA
-from backtest.signals import add_atr_exit_signal, add_position_direction
-from backtest.tester import Tester
+import numpy as np
+
+from backtest.indicators import MA, ATR
+from backtest.kernels import as_bool_array
+from backtest.rolling import RollingMean
+from backtest.signals import add_atr_exit_signal, add_position_direction, indicator_matrix, shift_signals, \
+    atr_exit_matrix, position_direction_matrix, AtrExitState, PositionDirectionState
+from backtest.tester import Tester, PRICE_COLUMNS, ADJUSTED_PRICE_COLUMNS
+from utils import has_column
 
 
 def add_enter_signal(df, short_length, long_length, break_in):
@@ -13,16 +19,21 @@ def add_enter_signal(df, short_length, long_length, break_in):
     df['shortgo'] = (short_ma < (1 - break_in)*long_ma).shift(1)
 
 
-def add_exit_signal(df, atr_length, trs):
-    add_atr_exit_signal(df, atr_length, trs)
+def add_exit_signal(df, atr_length, trs, details=True):
+    add_atr_exit_signal(df, atr_length, trs, details=details)
     df['long_exit'] = df['long_exit'] | df['next_c_chg']
     df['short_exit'] = df['short_exit'] | df['next_c_chg']
 
 
 class DMACTester(Tester):
 
-    def __init__(self, params, df=None):
-        super().__init__(params, df)
+    input_columns = PRICE_COLUMNS + ADJUSTED_PRICE_COLUMNS
+
+    supports_batch = True
+    supports_incremental = True
+
+    def __init__(self, params, df=None, lean=False):
+        super().__init__(params, df, lean)
 
         if "use_real_price" not in self.params:
             raise ValueError("Please specify whether real price or adjusted price should be used!")
@@ -38,5 +49,92 @@ class DMACTester(Tester):
                          break_in=self.params['break_in'])
         add_exit_signal(self.df,
                         atr_length=self.params['atr_length'],
-                        trs=self.params['trs'])
+                        trs=self.params['trs'],
+                        details=not self.lean)
         add_position_direction(self.df)
+
+    def init_state(self):
+        params = self.params
+        self._short_ma = RollingMean(params['short_length'])
+        self._long_ma = RollingMean(params['long_length'])
+        self._atr_exit = AtrExitState(params['atr_length'], params['trs'])
+        self._position = PositionDirectionState()
+        # 开仓信号由上一根bar计算，第一根bar的信号为shift产生的NaN，视为True
+        self._longgo = self._shortgo = True
+
+    def update_bar(self, bar):
+        prefix = '' if self.params['use_real_price'] else 'adjusted_'
+        high, low, close = bar[prefix + 'high'], bar[prefix + 'low'], bar[prefix + 'close']
+        longgo, shortgo = self._longgo, self._shortgo
+
+        # 入场信号，在下一根bar生效
+        short_ma = self._short_ma.update(close)
+        long_ma = self._long_ma.update(close)
+        break_in = self.params['break_in']
+        self._longgo = short_ma > (1 + break_in) * long_ma
+        self._shortgo = short_ma < (1 - break_in) * long_ma
+
+        # 出场信号：ATR止损，换合约前平仓
+        long_exit, short_exit = self._atr_exit.update(high, low, close, longgo, shortgo,
+                                                      bar.get('long_exit', False), bar.get('short_exit', False))
+        long_exit = long_exit or bool(bar['next_c_chg'])
+        short_exit = short_exit or bool(bar['next_c_chg'])
+
+        position_direction = self._position.update(longgo, shortgo, long_exit, short_exit)
+        return {'longgo': longgo, 'shortgo': shortgo, 'long_exit': long_exit, 'short_exit': short_exit,
+                'position_direction': position_direction}
+
+    @classmethod
+    def position_direction_batch(cls, df, params_list):
+        """批量计算开仓方向，结果与逐组回测相同。"""
+        for params in params_list:
+            if "use_real_price" not in params:
+                raise ValueError("Please specify whether real price or adjusted price should be used!")
+
+        bars = len(df)
+        prices = {True: (df.high, df.low, df.close),
+                  False: (df.adjusted_high, df.adjusted_low, df.adjusted_close)}
+        use_real_price = [bool(params['use_real_price']) for params in params_list]
+
+        def close_ma(key):
+            real, length = key
+            return MA(prices[real][2], length)
+
+        def price_atr(key):
+            (high, low, close), atr_length = prices[key[0]], key[1]
+            return ATR(high=high, low=low, close=close, timeperiod=atr_length)
+
+        short_ma, short_errors = indicator_matrix(
+            close_ma, [(r, p['short_length']) for r, p in zip(use_real_price, params_list)], bars)
+        long_ma, long_errors = indicator_matrix(
+            close_ma, [(r, p['long_length']) for r, p in zip(use_real_price, params_list)], bars)
+        atr, atr_errors = indicator_matrix(
+            price_atr, [(r, p['atr_length']) for r, p in zip(use_real_price, params_list)], bars)
+
+        # 入场信号
+        break_in = np.array([params['break_in'] for params in params_list], dtype=np.float64)
+        longgo = shift_signals(short_ma > (1 + break_in) * long_ma)
+        shortgo = shift_signals(short_ma < (1 - break_in) * long_ma)
+
+        # 出场信号：ATR止损，换合约前平仓
+        trs = np.array([params['trs'] for params in params_list], dtype=np.float64)
+        long_exit = np.zeros(longgo.shape, dtype=bool, order='F')
+        short_exit = np.zeros(longgo.shape, dtype=bool, order='F')
+        if has_column(df, 'long_exit'):
+            long_exit[:] = as_bool_array(df.long_exit)[:, None]
+        if has_column(df, 'short_exit'):
+            short_exit[:] = as_bool_array(df.short_exit)[:, None]
+        for real in set(use_real_price):
+            cols = [j for j, r in enumerate(use_real_price) if r == real]
+            long_exit[:, cols], short_exit[:, cols] = atr_exit_matrix(*prices[real], atr[:, cols],
+                                                                      longgo[:, cols], shortgo[:, cols],
+                                                                      long_exit[:, cols], short_exit[:, cols],
+                                                                      trs[cols])
+        next_c_chg = as_bool_array(df.next_c_chg)[:, None]
+        long_exit |= next_c_chg
+        short_exit |= next_c_chg
+
+        # 与逐组回测一致，报告最先出错的指标
+        errors = {**atr_errors, **long_errors, **short_errors}
+        return position_direction_matrix(longgo, shortgo, long_exit, short_exit), errors
+
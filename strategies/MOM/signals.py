@@ -1,6 +1,10 @@
+import numpy as np
+
 from backtest.indicators import momentum
-from backtest.signals import add_position_direction
-from backtest.tester import Tester
+from backtest.rolling import RollingMomentum
+from backtest.signals import add_position_direction, indicator_matrix, shift_signals, position_direction_matrix, \
+    PositionDirectionState
+from backtest.tester import Tester, PRICE_COLUMNS, ADJUSTED_PRICE_COLUMNS
 
 
 def add_enter_signal(df, period):
@@ -22,8 +26,13 @@ def add_exit_signal(df):
 
 class MOMTester(Tester):
 
-    def __init__(self, params, df=None):
-        super().__init__(params, df)
+    input_columns = PRICE_COLUMNS + ADJUSTED_PRICE_COLUMNS
+
+    supports_batch = True
+    supports_incremental = True
+
+    def __init__(self, params, df=None, lean=False):
+        super().__init__(params, df, lean)
 
         if "use_real_price" not in self.params:
             raise ValueError("Please specify whether real price or adjusted price should be used!")
@@ -36,3 +45,38 @@ class MOMTester(Tester):
         add_enter_signal(self.df, period=self.params['period'])
         add_exit_signal(self.df)
         add_position_direction(self.df)
+
+    def init_state(self):
+        self._mom = RollingMomentum(self.params['period'])
+        self._position = PositionDirectionState()
+        # 开仓信号由上一根bar计算，第一根bar的信号为shift产生的NaN，视为True
+        self._longgo = self._shortgo = True
+
+    def update_bar(self, bar):
+        longgo, shortgo = self._longgo, self._shortgo
+        # momentum向后移动了一期，当期的动量为截至上一根bar的计算结果
+        mom = self._mom.value
+        self._mom.update(bar['close'] if self.params['use_real_price'] else bar['adjusted_close'])
+        self._longgo = mom > 0
+        self._shortgo = mom < 0
+
+        position_direction = self._position.update(longgo, shortgo, False, False)
+        return {'longgo': longgo, 'shortgo': shortgo, 'long_exit': False, 'short_exit': False,
+                'position_direction': position_direction}
+
+    @classmethod
+    def position_direction_batch(cls, df, params_list):
+        """批量计算开仓方向，结果与逐组回测相同。"""
+        for params in params_list:
+            if "use_real_price" not in params:
+                raise ValueError("Please specify whether real price or adjusted price should be used!")
+
+        closes = {True: df.close, False: df.adjusted_close}
+        mom, errors = indicator_matrix(lambda key: momentum(closes[key[0]], key[1]),
+                                       [(bool(p['use_real_price']), p['period']) for p in params_list], len(df))
+
+        longgo = shift_signals(mom > 0)
+        shortgo = shift_signals(mom < 0)
+        no_exit = np.zeros(longgo.shape, dtype=bool, order='F')
+        return position_direction_matrix(longgo, shortgo, no_exit, no_exit), errors
+
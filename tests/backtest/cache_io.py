@@ -0,0 +1,99 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from backtest.cache_io import write_slice, read_slice, list_slices, write_index, LazyCache, CSV, NPY
+
+
+class CacheIOTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.category_path = os.path.join(self.dir.name, 'A')
+        df = pd.read_csv('../test_data/pd_backtest/c_chg_on_longgo.csv', parse_dates=['datetime'])
+        df[['next_c_chg', 'c_chg']] = df[['next_c_chg', 'c_chg']].astype('bool')
+        df['tradingday'] = df.datetime.dt.strftime('%Y-%m-%d')
+        self.df = df
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_npy_keeps_values_and_types(self):
+        write_slice(self.df, self.category_path, 0, NPY)
+        res = read_slice(os.path.join(self.category_path, '0'))
+        pd.testing.assert_frame_equal(self.df, res)
+
+    def test_npy_can_be_memory_mapped(self):
+        write_slice(self.df, self.category_path, 0, NPY)
+        res = read_slice(os.path.join(self.category_path, '0'), mmap_mode='r')
+        pd.testing.assert_frame_equal(self.df, res)
+        # 数值字段未被复制，仍映射到.npy文件
+        for column in ('close', 'datetime', 'c_chg'):
+            values = res[column].values
+            self.assertIsInstance(values, np.memmap)
+            self.assertTrue(os.path.samefile(os.path.join(self.category_path, '0', f'{column}.npy'),
+                                             values.filename))
+
+    def test_npy_is_preferred_over_csv(self):
+        write_slice(self.df, self.category_path, 0, CSV)
+        write_slice(self.df, self.category_path, 0, NPY)
+        write_slice(self.df, self.category_path, 1, CSV)
+        slices = list_slices(self.category_path)
+        self.assertListEqual([os.path.join(self.category_path, '0'),
+                              os.path.join(self.category_path, '1.csv')], slices)
+
+    def test_csv_can_still_be_read(self):
+        write_slice(self.df, self.category_path, 0, CSV)
+        res = read_slice(os.path.join(self.category_path, '0.csv'))
+        self.assertListEqual(self.df.datetime.tolist(), res.datetime.tolist())
+        self.assertListEqual(self.df.close.tolist(), res.close.tolist())
+
+    def test_lazy_cache_reads_on_access(self):
+        write_slice(self.df, self.category_path, 0, NPY)
+        write_slice(self.df.iloc[:5], self.category_path, 1, CSV)
+        cache = LazyCache(self.dir.name)
+        self.assertListEqual(['A'], list(cache))
+        self.assertEqual(2, len(cache['A']))
+        self.assertEqual(0, len(cache._loaded))
+        pd.testing.assert_frame_equal(self.df, cache['A'][0])
+        self.assertEqual(5, len(cache['A'][-1]))
+        # 已读取的数据段不再重复解析
+        self.assertIs(cache['A'][1], cache['A'][1])
+
+    def test_slice_length_without_loading(self):
+        write_slice(self.df, self.category_path, 0, NPY)
+        write_slice(self.df.iloc[:5], self.category_path, 1, CSV)
+        cache = LazyCache(self.dir.name)
+        self.assertEqual(len(self.df), cache.slice_length('A', 0))
+        self.assertEqual(0, len(cache._loaded))
+        self.assertEqual(5, cache.slice_length('A', 1))
+
+    def test_lazy_cache_keeps_bounded_lru(self):
+        for i in range(3):
+            write_slice(self.df.iloc[:i + 1], self.category_path, i, NPY)
+        cache = LazyCache(self.dir.name, maxsize=2)
+        first = cache['A'][0]
+        cache['A'][1]
+        cache['A'][0]
+        cache['A'][2]
+        self.assertListEqual([('A', 0), ('A', 2)], list(cache._loaded))
+        self.assertIs(first, cache['A'][0])
+
+    def test_lazy_cache_uses_index_file(self):
+        write_slice(self.df, self.category_path, 0, NPY)
+        write_index(self.dir.name)
+        write_slice(self.df, self.category_path, 1, NPY)
+        cache = LazyCache(self.dir.name)
+        # 数据段数量来自索引文件，不再列出目录
+        self.assertEqual(1, len(cache['A']))
+        with self.assertRaises(IndexError):
+            cache['A'][1]
+
+    def test_lazy_cache_missing_category_is_empty(self):
+        write_slice(self.df, self.category_path, 0, NPY)
+        cache = LazyCache(self.dir.name)
+        self.assertNotIn('B', cache)
+        self.assertListEqual([], list(cache['B']))
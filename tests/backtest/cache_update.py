@@ -0,0 +1,185 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from backtest.cache_io import list_slices, read_slice, CSV, NPY
+from backtest.cache_update import build_slices, update_slices, segment_bounds, read_watermarks, write_watermarks
+from backtest.signals import add_cache_signals, extend_cache_signals
+
+
+def make_data(n, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 3000 + np.cumsum(rng.normal(0, 20, n))
+    return pd.DataFrame({'datetime': pd.bdate_range('2015-01-05', periods=n),
+                         'open': close + rng.normal(0, 5, n), 'high': close + 10, 'low': close - 10,
+                         'close': close, 'preclose': close + rng.normal(0, 5, n),
+                         'deliv_mon': np.repeat(np.arange(n // 20 + 1), 20)[:n]})
+
+
+def make_minute_data(n, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 3000 + np.cumsum(rng.normal(0, 2, n))
+    return pd.DataFrame({'datetime': pd.date_range('2015-01-05 09:01', periods=n, freq='1min'),
+                         'open': close + rng.normal(0, 1, n), 'high': close + rng.random(n) * 3,
+                         'low': close - rng.random(n) * 3, 'close': close, 'preclose': close,
+                         'volume': rng.integers(1, 10, n),
+                         'deliv_mon': np.repeat(np.arange(n // 50 + 1), 50)[:n]})
+
+
+def resample_minutes(minutes, level='10min'):
+    """与分钟级缓存相同，以bar结束时间为datetime合成bar。"""
+    agg = {'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'preclose': 'last',
+           'volume': 'sum', 'deliv_mon': 'last'}
+    bars = minutes.resample(level, on='datetime', label='right', closed='right').agg(agg)
+    return bars.dropna(subset=['close']).reset_index()
+
+
+class ExtendCacheSignalsTest(unittest.TestCase):
+
+    def assert_same_as_whole(self, df, split, intraday):
+        expected = df.copy()
+        add_cache_signals(expected, intraday)
+        cached = df.iloc[:split].copy()
+        _, anchor = add_cache_signals(cached, intraday)
+        zero_rows, extended, _ = extend_cache_signals(cached, df.iloc[split:], anchor, intraday)
+        self.assertEqual(0, zero_rows)
+        pd.testing.assert_frame_equal(expected, extended, check_exact=True)
+
+    def test_same_as_whole_slice(self):
+        df = make_data(100)
+        for split in (1, 19, 20, 21, 99):
+            for intraday in (False, True):
+                self.assert_same_as_whole(df, split, intraday)
+
+    def test_zero_prices_are_not_appended(self):
+        df = make_data(50)
+        df.loc[45, 'close'] = 0
+        cached = df.iloc[:40].copy()
+        _, anchor = add_cache_signals(cached)
+        zero_rows, extended, new_anchor = extend_cache_signals(cached, df.iloc[40:], anchor)
+        self.assertEqual(1, zero_rows)
+        self.assertIsNone(extended)
+        self.assertIsNone(new_anchor)
+        # 日内数据的下一行preclose被修正为0
+        self.assertEqual(2, extend_cache_signals(cached, df.iloc[40:], anchor, intraday=True)[0])
+
+
+class UpdateSlicesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.category_path = os.path.join(self.tmp.name, 'A')
+        self.df = make_data(120)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def segments(self, ranges, end):
+        data = self.df.iloc[:end]
+        return [data.iloc[start:stop] for start, stop in ranges]
+
+    def build(self, ranges, end, fmt=NPY):
+        segments = self.segments(ranges, end)
+        return build_slices(self.category_path, segments, segment_bounds(segments),
+                            self.df.datetime.iloc[end - 1], fmt)
+
+    def update(self, ranges, end, watermark, fmt=NPY):
+        segments = self.segments(ranges, end)
+        return update_slices(self.category_path, segments, segment_bounds(segments),
+                             self.df.datetime.iloc[end - 1], watermark, fmt)
+
+    def read_all(self):
+        return [read_slice(path) for path in list_slices(self.category_path)]
+
+    def assert_same_as_rebuild(self, old_ranges, old_end, ranges, end, fmt=NPY):
+        watermark = self.build(old_ranges, old_end, fmt)
+        new_watermark = self.update(ranges, end, watermark, fmt)
+        self.assertIsNotNone(new_watermark)
+        updated = self.read_all()
+
+        self.tmp.cleanup()
+        self.assertEqual(self.build(ranges, end, fmt), new_watermark)
+        rebuilt = self.read_all()
+        self.assertEqual(len(rebuilt), len(updated))
+        for expected, res in zip(rebuilt, updated):
+            pd.testing.assert_frame_equal(expected, res, check_exact=fmt == NPY)
+
+    def test_append_to_last_slice(self):
+        self.assert_same_as_rebuild([(0, 30), (50, 80)], 80, [(0, 30), (50, 100)], 100)
+
+    def test_append_csv_cache(self):
+        self.assert_same_as_rebuild([(0, 30), (50, 80)], 80, [(0, 30), (50, 100)], 100, fmt=CSV)
+
+    def test_new_slice(self):
+        self.assert_same_as_rebuild([(0, 30)], 80, [(0, 30), (90, 120)], 120)
+
+    def test_append_and_new_slice(self):
+        self.assert_same_as_rebuild([(0, 30), (50, 80)], 80, [(0, 30), (50, 90), (100, 120)], 120)
+
+    def test_boundary_moved(self):
+        watermark = self.build([(0, 30), (50, 80)], 80)
+        self.assertIsNone(self.update([(0, 31), (50, 100)], 100, watermark))
+        self.assertIsNone(self.update([(0, 30), (49, 100)], 100, watermark))
+        self.assertIsNone(self.update([(0, 30), (50, 70)], 100, watermark))
+        self.assertIsNone(self.update([(0, 30)], 100, watermark))
+
+    def test_incomplete_new_segment(self):
+        watermark = self.build([(0, 30)], 80)
+        segments = [self.df.iloc[80:100]] * 2
+        bounds = [segment_bounds([self.df.iloc[0:30]])[0], segment_bounds([self.df.iloc[70:100]])[0]]
+        self.assertIsNone(update_slices(self.category_path, segments, bounds, self.df.datetime.iloc[99],
+                                        watermark, complete=False))
+
+    def test_append_partway_through_bar(self):
+        # 上次生成缓存时最后一根bar只有部分分钟数据，从这根bar的第一分钟重新读取并合成，替换缓存中的这根bar
+        minutes = make_minute_data(300)
+        bounds = [(minutes.datetime.iloc[0], minutes.datetime.iloc[-1])]
+        for split in (22, 25, 121, 130, 299):
+            old_bars = resample_minutes(minutes.iloc[:split])
+            watermark = build_slices(self.category_path, [old_bars], bounds, old_bars.datetime.iloc[-1],
+                                     intraday=True)
+            bar_start = minutes.index[minutes.datetime > old_bars.datetime.iloc[-1] - pd.Timedelta('10min')][0]
+            new_bars = resample_minutes(minutes.iloc[bar_start:])
+            new_watermark = update_slices(self.category_path, [new_bars], bounds, new_bars.datetime.iloc[-1],
+                                          watermark, intraday=True, complete=False)
+            self.assertIsNotNone(new_watermark)
+            updated = self.read_all()
+
+            self.tmp.cleanup()
+            bars = resample_minutes(minutes)
+            self.assertEqual(build_slices(self.category_path, [bars], bounds, bars.datetime.iloc[-1],
+                                          intraday=True), new_watermark)
+            rebuilt = self.read_all()
+            self.assertEqual(1, len(updated))
+            pd.testing.assert_frame_equal(rebuilt[0], updated[0], check_exact=True)
+            self.tmp.cleanup()
+
+    def test_slice_names(self):
+        self.df = make_data(300)
+        ranges = [(i * 20, i * 20 + 10) for i in range(11)] + [(220, 240)]
+        names = [str(i) for i in range(0, 24, 2)]
+        segments = self.segments(ranges, 230)
+        watermark = build_slices(self.category_path, segments, segment_bounds(segments),
+                                 self.df.datetime.iloc[229], names=names)
+        self.assertListEqual(sorted(names), [os.path.basename(path) for path in list_slices(self.category_path)])
+        segments = self.segments(ranges, 240)
+        new_watermark = update_slices(self.category_path, segments, segment_bounds(segments),
+                                      self.df.datetime.iloc[239], watermark, names=names)
+        self.assertListEqual(names, new_watermark['names'])
+        self.assertEqual(20, len(read_slice(os.path.join(self.category_path, '22'))))
+        # 名称改变时无法增量更新
+        self.assertIsNone(update_slices(self.category_path, segments, segment_bounds(segments),
+                                        self.df.datetime.iloc[239], watermark))
+
+    def test_watermarks_file(self):
+        self.assertDictEqual({}, read_watermarks(self.tmp.name))
+        watermarks = {'A': self.build([(0, 30)], 80)}
+        write_watermarks(self.tmp.name, watermarks)
+        self.assertDictEqual(watermarks, read_watermarks(self.tmp.name))
+
+
+if __name__ == '__main__':
+    unittest.main()
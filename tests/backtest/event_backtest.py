@@ -0,0 +1,66 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from backtest import run_event_backtest
+from backtest.event_backtest import event_backtest_kernel
+from backtest.kernels import as_bool_array, as_float_array
+
+SIGNALS = ['longgo', 'shortgo', 'long_exit', 'short_exit', 'c_chg', 'next_c_chg']
+
+
+def read_csv(file_name):
+    """读取行情、信号，以及run_bt_backtest得到的累计收益率bt_cum_ret。"""
+    df = pd.read_csv(f'./event_backtest_data/{file_name}', parse_dates=['datetime'],
+                     float_precision='round_trip')
+    df[SIGNALS] = df[SIGNALS].astype('bool')
+    return df
+
+
+class RunEventBacktestTest(unittest.TestCase):
+
+    def assert_same_as_bt(self, file_name, cash=2000000):
+        df = read_csv(file_name)
+        res = run_event_backtest(df, cash=cash)
+        self.assertListEqual(df.datetime.tolist(), res.index.tolist())
+        self.assertTrue(np.array_equal(df.bt_cum_ret.values, res.cum_ret.values))
+
+    def test_same_as_bt_on_strategy_details(self):
+        self.assert_same_as_bt('C73_details.csv')
+
+    def test_same_as_bt_with_contract_changes(self):
+        self.assert_same_as_bt('roll.csv')
+
+    def test_same_as_bt_with_insufficient_cash(self):
+        # 资金仅够交易1单位，部分订单因资金不足被拒绝
+        self.assert_same_as_bt('small_cash.csv', cash=3100)
+
+    def test_compiled_and_python_kernels_agree(self):
+        df = read_csv('roll.csv')
+        args = [as_float_array(df[col]) for col in ['open', 'high', 'low', 'close']] + \
+               [as_bool_array(df[col]) for col in SIGNALS] + [2000000.0, 0.0001, 1]
+        for expected, res in zip(event_backtest_kernel.py_func(*args), event_backtest_kernel(*args)):
+            self.assertTrue(np.array_equal(expected, res))
+
+    def test_minute_bars(self):
+        # 同一天内的每根bar都参与回测，结果只取决于bar的顺序
+        df = read_csv('roll.csv')
+        daily = run_event_backtest(df)
+        df['datetime'] = pd.date_range('2015-01-05 09:00', periods=len(df), freq='30min')
+        minute = run_event_backtest(df)
+        self.assertEqual(len(df), len(minute))
+        self.assertListEqual(df.datetime.tolist(), minute.index.tolist())
+        self.assertTrue(np.array_equal(daily.cum_ret.values, minute.cum_ret.values))
+
+    def test_hand(self):
+        df = read_csv('roll.csv')
+        res = event_backtest_kernel(*[as_float_array(df[col]) for col in ['open', 'high', 'low', 'close']],
+                                    *[as_bool_array(df[col]) for col in SIGNALS], 2000000.0, 0.0001, 10)
+        positions = res[2]
+        self.assertTrue((positions != 0).any())
+        self.assertTrue((positions % 10 == 0).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,15 @@
 import unittest
+
+import numpy as np
 import pandas as pd
 from backtest.indicators import AllNaError, HHV, LLV, BARSLAST, CCI, momentum
 
 
+def momentum_by_rolling_apply(close, timeperiod):
+    """原来逐窗口调用lambda的实现，作为对照。"""
+    return close.rolling(timeperiod + 1).apply(lambda x: x.iloc[-1] / x.iloc[0] - 1).shift(1)
+
+
 class RecentHighTest(unittest.TestCase):
 
     def test_a_normal_case(self):
@@ -47,6 +54,15 @@ class BarsLastTest(unittest.TestCase):
         res = BARSLAST(self.df.open > 2000)
         self.assertTrue((res == self.df.res_open_gt_2000).all())
 
+    def test_same_as_groupby(self):
+        rng = np.random.default_rng(0)
+        for p in (0.001, 0.1, 0.9):
+            cond = pd.Series(rng.random(1000) < p)
+            cond_group = cond.cumsum()
+            expected = cond_group.groupby(cond_group).cumcount()
+            expected.loc[cond_group == 0] = -1
+            self.assertListEqual(expected.tolist(), BARSLAST(cond).tolist())
+
 
 class MomentumTest(unittest.TestCase):
     df = pd.read_csv('./indicators_data/test_momentum.csv')
@@ -58,3 +74,31 @@ class MomentumTest(unittest.TestCase):
 
     def test_a_too_short_series(self):
         self.assertRaises(AllNaError, momentum, self.df.close.iloc[0:5], 5)
+
+
+class VectorizedMomentumTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        rng = np.random.default_rng(0)
+        cls.close = pd.Series(3000 + rng.standard_normal(5000).cumsum())
+
+    def assert_same_as_rolling_apply(self, close, timeperiod):
+        expected = momentum_by_rolling_apply(close, timeperiod)
+        res = momentum(close, timeperiod)
+        self.assertTrue(np.array_equal(expected.values, res.values, equal_nan=True))
+
+    def test_same_as_rolling_apply(self):
+        for timeperiod in (0, 1, 5, 240):
+            with self.subTest(timeperiod=timeperiod):
+                self.assert_same_as_rolling_apply(self.close, timeperiod)
+
+    def test_na_inside_window(self):
+        close = self.close.copy()
+        close.iloc[[0, 100, 101, 3000]] = np.nan
+        for timeperiod in (1, 5, 240):
+            with self.subTest(timeperiod=timeperiod):
+                self.assert_same_as_rolling_apply(close, timeperiod)
+
+    def test_integer_prices(self):
+        self.assert_same_as_rolling_apply(self.close.round().astype('int64'), 20)
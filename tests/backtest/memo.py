@@ -0,0 +1,78 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from backtest.memo import Memo, memo, memoize
+from backtest.indicators import ATR, MA, TR
+
+
+class MemoizeTest(unittest.TestCase):
+
+    def setUp(self):
+        memo.clear()
+        rng = np.random.default_rng(0)
+        self.close = pd.Series(100 + rng.standard_normal(500).cumsum(), name='close')
+        self.high = (self.close + 1).rename('high')
+        self.low = (self.close - 1).rename('low')
+
+    def test_same_data_computed_once(self):
+        res = ATR(self.high, self.low, self.close, 20)
+        pd.testing.assert_series_equal(MA(TR(self.high, self.low, self.close), 20), res)
+        # 另一个DataFrame中引用同一数组的字段视为同一数据
+        frame = pd.DataFrame({'high': self.high, 'low': self.low, 'close': self.close}, copy=False)
+        pd.testing.assert_series_equal(res, ATR(frame.high, frame.low, frame.close, 20))
+        # ATR在第一次计算时调用了TR，之后TR命中一次，ATR命中一次
+        self.assertDictEqual({'hits': 2, 'misses': 2}, {k: memo.stats()[k] for k in ('hits', 'misses')})
+
+    def test_different_args_or_data(self):
+        ATR(self.high, self.low, self.close, 20)
+        ATR(self.high, self.low, self.close, 30)
+        ATR(self.high, self.low, self.close * 2, 20)
+        # 复制得到的数据视为不同的数据
+        ATR(self.high, self.low, self.close.copy(), 20)
+        # 值相同而索引不同的数据视为不同的数据
+        ATR(self.high, self.low, pd.Series(self.close.values, index=self.close.index + 1), 20)
+        # 只有ATR(..., 30)中的TR命中
+        self.assertEqual(1, memo.hits)
+
+    def test_views_at_different_positions(self):
+        @memoize
+        def f(a):
+            return a.sum()
+        values = np.arange(10.)
+        self.assertEqual(values[:5].sum(), f(values[:5]))
+        self.assertEqual(values[5:].sum(), f(values[5:]))
+        self.assertEqual(values[::2].sum(), f(values[::2]))
+        self.assertEqual(0, memo.hits)
+
+    def test_caller_name_is_kept(self):
+        @memoize
+        def f(s):
+            return s + 1
+        f(pd.Series(self.close.values, name='close'))
+        res = f(pd.Series(self.close.values, name='adjusted_close'))
+        self.assertEqual(1, memo.hits)
+        self.assertEqual('adjusted_close', res.name)
+        self.assertIsNone(TR(self.high.rename('high'), self.low, self.close).name)
+
+    def test_result_is_a_copy(self):
+        res = TR(self.high, self.low, self.close)
+        res.iloc[:] = 0
+        self.assertTrue((TR(self.high, self.low, self.close) > 0).all())
+
+    def test_bounded_by_memory(self):
+        m = Memo(maxbytes=3 * self.close.memory_usage(index=True))
+        for i in range(5):
+            m.put(i, self.close)
+        self.assertListEqual([2, 3, 4], list(m._results))
+        self.assertIsNone(m.get(0))
+        self.assertIs(self.close, m.get(4))
+        self.assertDictEqual({'hits': 1, 'misses': 1, 'size': 3, 'nbytes': m.maxbytes}, m.stats())
+
+    def test_decorated_function_keeps_name(self):
+        @memoize
+        def f(s, n):
+            return s + n
+        self.assertEqual('f', f.__name__)
+        pd.testing.assert_series_equal(self.close + 1, f(self.close, n=1))
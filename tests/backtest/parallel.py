@@ -0,0 +1,93 @@
+import threading
+import time
+import unittest
+
+import pandas as pd
+
+from backtest.parallel import ResultWriter, slice_major_chunks
+
+
+class ResultWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.batches = []
+
+    def save(self, results):
+        self.batches.append(list(results))
+
+    def test_flush_by_count(self):
+        with ResultWriter(self.save, flush_size=3, flush_interval=60) as writer:
+            for i in range(7):
+                writer.put(i)
+        self.assertListEqual([[0, 1, 2], [3, 4, 5], [6]], self.batches)
+        self.assertEqual(7, writer.saved)
+
+    def test_flush_by_time(self):
+        with ResultWriter(self.save, flush_size=100, flush_interval=0.05) as writer:
+            writer.put(0)
+            time.sleep(0.3)
+            self.assertListEqual([[0]], self.batches)
+            writer.put(1)
+        self.assertListEqual([[0], [1]], self.batches)
+
+    def test_nothing_to_write(self):
+        with ResultWriter(self.save) as writer:
+            pass
+        self.assertListEqual([], self.batches)
+        self.assertEqual(0, writer.saved)
+
+    def test_save_error_is_raised(self):
+        def save(results):
+            raise IOError('database is down')
+
+        writer = ResultWriter(save, flush_size=1)
+        writer.put(0)
+        with self.assertRaises(IOError):
+            writer.close()
+
+    def test_put_blocks_when_queue_is_full(self):
+        release = threading.Event()
+
+        def save(results):
+            release.wait()
+            self.save(results)
+
+        writer = ResultWriter(save, flush_size=1, max_queued=2)
+        # 第一条结果被后台线程取出后写入阻塞，之后的两条填满队列
+        for i in range(3):
+            writer.put(i)
+        putter = threading.Thread(target=writer.put, args=(3,))
+        putter.start()
+        putter.join(0.3)
+        self.assertTrue(putter.is_alive())
+        release.set()
+        putter.join()
+        writer.close()
+        self.assertListEqual([[0], [1], [2], [3]], self.batches)
+
+    def test_save_error_when_queue_is_full(self):
+        def save(results):
+            time.sleep(0.1)
+            raise IOError('database is down')
+
+        writer = ResultWriter(save, flush_size=1, max_queued=1)
+        with self.assertRaises(IOError):
+            for i in range(10):
+                writer.put(i)
+
+
+class SliceMajorChunksTest(unittest.TestCase):
+
+    class FakeTester:
+        backtest_data = {'A': [pd.DataFrame({'close': range(10)}), pd.DataFrame({'close': range(100)})],
+                         'B': [pd.DataFrame({'close': range(30)})]}
+
+    def test_grouped_by_slice_and_sorted_by_cost(self):
+        params_list = [{'category': c, 'idx': i, 'trs': trs}
+                       for c, i in (('A', 0), ('A', 1), ('B', 0)) for trs in range(5)]
+        chunks = slice_major_chunks(self.FakeTester, params_list, chunk_size=3)
+        labels = [[(p['category'], p['idx']) for p in chunk] for chunk in chunks]
+        self.assertListEqual([[('A', 1)] * 3, [('A', 1)] * 2, [('B', 0)] * 3, [('B', 0)] * 2,
+                              [('A', 0)] * 3, [('A', 0)] * 2], labels)
+        # 每个参数恰好出现一次
+        self.assertCountEqual(params_list, [p for chunk in chunks for p in chunk])
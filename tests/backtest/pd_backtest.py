@@ -1,12 +1,17 @@
+import os
 import unittest
+
+import numpy as np
 import pandas as pd
-from backtest import run_pd_backtest
+from backtest import run_pd_backtest, run_np_backtest, run_pd_backtest_matrix
+from backtest.pd_backtest import trade_stats
 
 
 class RunPdBacktestTest(unittest.TestCase):
     COMMISSION = 0.01
 
-    def read_csv(self, file_name):
+    @staticmethod
+    def read_csv(file_name):
         df = pd.read_csv(f'./run_pd_backtest_data/{file_name}', parse_dates=['datetime'])
         df[['longgo', 'long_exit', 'shortgo', 'short_exit', 'next_c_chg', 'c_chg']] =\
             df[['longgo', 'long_exit', 'shortgo', 'short_exit', 'next_c_chg', 'c_chg']].astype('bool')
@@ -117,4 +122,102 @@ class RunPdBacktestTest(unittest.TestCase):
         res = run_pd_backtest(df, commission=self.COMMISSION, debug=True)
         df = df.set_index('datetime')
         deviate = abs(df['trade_num'] - res['trade_num']).sum()
-        self.assertAlmostEqual(deviate, 0)
\ No newline at end of file
+        self.assertAlmostEqual(deviate, 0)
+
+
+class RunNpBacktestTest(unittest.TestCase):
+    COMMISSION = 0.01
+
+    def test_same_as_fixtures(self):
+        for file_name in sorted(os.listdir('./run_pd_backtest_data')):
+            with self.subTest(file_name=file_name):
+                df = RunPdBacktestTest.read_csv(file_name)
+                res = run_np_backtest(df, commission=self.COMMISSION)
+                self.assertListEqual(df.trade_num.tolist(), res['trade_num'].tolist())
+                for column in ('ret', 'cum_ret'):
+                    if column in df.columns:
+                        self.assertTrue(np.allclose(df[column].values, res[column]), column)
+                self.assertNotIn('long_open', res)
+
+    def test_trades(self):
+        df = RunPdBacktestTest.read_csv('chg_between_longgo_long_exit.csv')
+        res = run_np_backtest(df, commission=self.COMMISSION, trades=True)
+        position_direction = df.position_direction.tolist()
+        prev = [0] + position_direction[:-1]
+        following = position_direction[1:] + position_direction[-1:]
+        expected = {
+            'long_open': [d for d, p, q in zip(df.datetime, position_direction, prev) if p == 1 and q <= 0],
+            'short_open': [d for d, p, q in zip(df.datetime, position_direction, prev) if p == -1 and q >= 0],
+            'long_close': [d for d, p, q in zip(df.datetime, position_direction, following) if p == 1 and q <= 0],
+            'short_close': [d for d, p, q in zip(df.datetime, position_direction, following) if p == -1 and q >= 0],
+        }
+        for trade, datetimes in expected.items():
+            self.assertListEqual(datetimes, pd.to_datetime(res[trade]).tolist(), trade)
+
+    def test_nan_in_prices_is_skipped(self):
+        df = RunPdBacktestTest.read_csv('chg_between_longgo_long_exit.csv')
+        df.loc[3, 'preclose'] = np.nan
+        res = run_np_backtest(df, commission=self.COMMISSION)
+        expected = (1 + pd.Series(res['ret'])).cumprod()
+        self.assertTrue(np.isnan(res['cum_ret'][3]))
+        self.assertTrue(np.array_equal(expected.values, res['cum_ret'], equal_nan=True))
+
+
+class TradeLedgerTest(unittest.TestCase):
+    COMMISSION = 0.01
+
+    def test_trades_cover_positions_on_fixtures(self):
+        for file_name in sorted(os.listdir('./run_pd_backtest_data')):
+            with self.subTest(file_name=file_name):
+                df = RunPdBacktestTest.read_csv(file_name)
+                res = run_np_backtest(df, commission=self.COMMISSION, ledger=True)
+                ledger = res['ledger']
+                # 每笔交易开仓、平仓各计一次交易
+                self.assertEqual(res['trade_num'].sum(), len(ledger['entry_idx']) + ledger['closed'].sum())
+                held = np.zeros(len(df), dtype=bool)
+                for entry, exit_, direction, net_ret, gross_ret in zip(ledger['entry_idx'], ledger['exit_idx'],
+                                                                       ledger['direction'], ledger['net_ret'],
+                                                                       ledger['gross_ret']):
+                    self.assertTrue((df.position_direction.values[entry:exit_ + 1] == direction).all())
+                    self.assertAlmostEqual(np.prod(1 + res['ret'][entry:exit_ + 1]) - 1, net_ret)
+                    self.assertGreater(gross_ret, net_ret)
+                    held[entry:exit_ + 1] = True
+                self.assertListEqual((df.position_direction != 0).tolist(), held.tolist())
+
+    def test_stats(self):
+        df = pd.DataFrame({'datetime': pd.date_range('2010-01-04', periods=8),
+                           'close': [100, 110, 121, 121, 110, 99, 99, 108.9],
+                           'preclose': [100, 100, 110, 121, 121, 110, 99, 99],
+                           'c_chg': False, 'next_c_chg': False,
+                           'position_direction': [0, 1, 1, 0, -1, -1, 0, 1]})
+        res = run_np_backtest(df, commission=0, ledger=True)
+        ledger = res['ledger']
+        self.assertListEqual([1, 4, 7], ledger['entry_idx'].tolist())
+        self.assertListEqual([2, 5, 7], ledger['exit_idx'].tolist())
+        self.assertListEqual([True, True, False], ledger['closed'].tolist())
+        self.assertTrue(np.allclose([0.21, 0.2, 0.1], ledger['net_ret']))
+        stats = trade_stats(ledger, len(df))
+        self.assertEqual(3, stats['trades'])
+        self.assertEqual(2, stats['long_trades'])
+        self.assertEqual(1, stats['short_trades'])
+        self.assertEqual(1, stats['win_rate'])
+        self.assertAlmostEqual(5 / 3, stats['avg_bars_held'])
+        self.assertAlmostEqual(5 / 8, stats['turnover'])
+
+
+class RunPdBacktestMatrixTest(unittest.TestCase):
+    COMMISSION = 0.01
+
+    def test_same_as_run_pd_backtest_column_by_column(self):
+        rng = np.random.default_rng(0)
+        for file_name in sorted(os.listdir('./run_pd_backtest_data')):
+            df = RunPdBacktestTest.read_csv(file_name)
+            position_direction = np.column_stack([df.position_direction.values] +
+                                                 [rng.integers(-1, 2, len(df)) for _ in range(5)])
+            res = run_pd_backtest_matrix(df, position_direction, commission=self.COMMISSION)
+            for j in range(position_direction.shape[1]):
+                with self.subTest(file_name=file_name, column=j):
+                    df['position_direction'] = position_direction[:, j]
+                    expected = run_pd_backtest(df, commission=self.COMMISSION)
+                    self.assertListEqual(expected.cum_ret.tolist(), res[:, j].tolist())
+
@@ -0,0 +1,78 @@
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from backtest.parallel import remaining_params
+from backtest.result_store import LocalStore, params_key
+from backtest.return_rate_calculations import avg_cum_ret_from_cursor, cum_ret_from_doc, cal_avg_cum_ret
+from backtest.check_for_momentum import get_cum_ret_dict
+
+
+def make_result(category, idx, trs, start, periods):
+    cum_ret = pd.DataFrame({'datetime': pd.date_range(start, periods=periods, freq='D'),
+                            'cum_ret': [1 + 0.01 * (i % 7) * (1 if trs > 0.1 else -1) for i in range(periods)]})
+    params = {'category': category, 'idx': idx, 'trs': trs}
+    return {'params': params, 'key': params_key(params), 'cum_ret': cum_ret.to_dict('list')}
+
+
+class LocalStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.store = LocalStore(self.dir.name, 'C73', 'daily')
+        self.results = [make_result('A', 0, 0.12, '2010-01-04', 10),
+                        make_result('A', 1, 0.12, '2011-03-01', 5),
+                        make_result('B', 0, 0.12, '2010-01-06', 8),
+                        make_result('B', 0, 0.05, '2010-01-06', 8)]
+        error_params = {'category': 'C', 'idx': 0, 'trs': 0.12}
+        self.store.save(self.results[:2])
+        self.store.save(self.results[2:] + [{'params': error_params, 'key': params_key(error_params), 'error': 'all na'}])
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_curves_are_restored(self):
+        docs = list(self.store.find())
+        self.assertEqual(5, len(docs))
+        for result, doc in zip(self.results, docs):
+            self.assertDictEqual(result['params'], doc['params'])
+            expected = pd.DataFrame(result['cum_ret']).set_index('datetime')
+            pd.testing.assert_frame_equal(expected, cum_ret_from_doc(doc))
+        self.assertEqual('all na', docs[-1]['error'])
+        self.assertEqual(0, len(cum_ret_from_doc(docs[-1])))
+
+    def test_find_by_params(self):
+        docs = list(self.store.find(category='B', trs=0.12))
+        self.assertEqual(1, len(docs))
+        self.assertDictEqual(self.results[2]['params'], docs[0]['params'])
+
+    def test_avg_cum_ret_from_store(self):
+        expected = cal_avg_cum_ret([pd.DataFrame(r['cum_ret']).set_index('datetime')
+                                    for r in self.results if r['params']['trs'] == 0.12])
+        res = avg_cum_ret_from_cursor(self.store.find(trs=0.12))
+        pd.testing.assert_frame_equal(expected, res)
+
+    def test_get_cum_ret_dict_from_store(self):
+        cum_ret_dict = get_cum_ret_dict('C73', 'daily', store=self.store, trs=0.12)
+        self.assertListEqual(['A-0', 'A-1', 'B-0'], sorted(cum_ret_dict))
+
+    def test_completed_keys(self):
+        keys = self.store.completed_keys()
+        expected = [r['params'] for r in self.results] + [{'category': 'C', 'idx': 0, 'trs': 0.12}]
+        self.assertSetEqual({params_key(params) for params in expected}, keys)
+
+
+class ParamsKeyTest(unittest.TestCase):
+
+    def test_key_is_stable(self):
+        self.assertEqual(params_key({'category': 'A', 'idx': 0, 'trs': 0.1}),
+                         params_key({'trs': 0.1, 'idx': np.int64(0), 'category': 'A'}))
+        self.assertNotEqual(params_key({'category': 'A', 'idx': 0, 'trs': 0.1}),
+                            params_key({'category': 'A', 'idx': 1, 'trs': 0.1}))
+
+    def test_remaining_params(self):
+        params_list = [{'category': 'A', 'idx': i} for i in range(4)]
+        completed = {params_key(params_list[1]), params_key(params_list[3])}
+        self.assertListEqual([params_list[0], params_list[2]], remaining_params(params_list, completed))
@@ -0,0 +1,72 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from backtest.indicators import AllNaError, MA, HHV, LLV, momentum
+from backtest.rolling import rolling_mean_kernel, rolling_max_kernel, rolling_min_kernel, \
+    RollingMean, RollingMax, RollingMin, RollingMomentum
+
+KERNELS = [('mean', rolling_mean_kernel, RollingMean),
+           ('max', rolling_max_kernel, RollingMax),
+           ('min', rolling_min_kernel, RollingMin)]
+
+
+def random_values(n, seed):
+    """各种容易产生浮点误差或并列值的序列。"""
+    rng = np.random.default_rng(seed)
+    yield rng.normal(size=n) * 1000
+    yield np.round(rng.random(n) * 10)
+    yield 5000 + rng.random(n)
+    yield -rng.random(n) * 1e-3
+    yield np.full(n, 3.3)
+    with_na = rng.normal(size=n)
+    with_na[rng.random(n) < 0.05] = np.nan
+    yield with_na
+
+
+class RollingKernelTest(unittest.TestCase):
+
+    def assert_same(self, expected, res, msg=None):
+        self.assertTrue(np.array_equal(expected, res, equal_nan=True), msg)
+        # 0.0与-0.0也需一致
+        self.assertTrue(np.array_equal(np.signbit(expected), np.signbit(res)), msg)
+
+    def test_same_as_pandas(self):
+        for values in random_values(500, 0):
+            for window in (1, 2, 5, 20, 600):
+                for how, kernel, _ in KERNELS:
+                    expected = getattr(pd.Series(values).rolling(window), how)().values
+                    self.assert_same(expected, kernel(values, window), f'{how} {window}')
+
+    def test_compiled_and_python_kernels_agree(self):
+        for values in random_values(300, 1):
+            for how, kernel, _ in KERNELS:
+                self.assert_same(kernel.py_func(values, 10), kernel(values, 10), how)
+
+    def test_incremental_same_as_bulk(self):
+        for values in random_values(300, 2):
+            for window in (1, 3, 20):
+                for how, kernel, cls in KERNELS:
+                    rolling = cls(window)
+                    res = np.array([rolling.update(value) for value in values])
+                    self.assert_same(kernel(values, window), res, f'{how} {window}')
+                    self.assertTrue(np.array_equal(res[-1:], [rolling.value], equal_nan=True))
+
+    def test_indicators_same_as_pandas(self):
+        s = pd.Series(np.random.default_rng(3).normal(size=1000).cumsum(), name='close')
+        pd.testing.assert_series_equal(s.rolling(20).mean(), MA(s, 20))
+        pd.testing.assert_series_equal(s.rolling(20).max(), HHV(s, 20))
+        pd.testing.assert_series_equal(s.rolling(20).min(), LLV(s, 20))
+
+    def test_momentum_same_as_indicator(self):
+        for values in random_values(300, 4):
+            for timeperiod in (1, 5, 20):
+                rolling = RollingMomentum(timeperiod)
+                res = pd.Series([rolling.update(value) for value in values]).shift(1)
+                try:
+                    expected = momentum(pd.Series(values), timeperiod)
+                except AllNaError:
+                    self.assertTrue(res.isna().all())
+                else:
+                    self.assertTrue(np.array_equal(expected.values, res.values, equal_nan=True))
@@ -0,0 +1,393 @@
+import os
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from backtest.kernels import position_direction_kernel
+from backtest.indicators import ATR
+from backtest.memo import memo
+from backtest.signals import add_position_direction, add_chandelier_exit_signal, add_atr_exit_signal, \
+    shift_signals, position_direction_matrix, atr_exit_matrix, avg_daily_last_adjusted_close, \
+    PositionDirectionState, AtrExitState, ChandelierExitState, correct_preclose, add_adjusted_price, \
+    add_cache_signals, AddSignalError
+
+TEST_DATA_DIR = '../test_data/'
+STRATEGIES_DIR = '../strategies/'
+SIGNALS = ['longgo', 'shortgo', 'long_exit', 'short_exit']
+
+
+def position_direction_by_loop(df):
+    """逐行计算开仓方向的原始实现，作为数组内核的对照。"""
+    position_direction = [0] * len(df)
+    for i in range(1, len(df)):
+        prev = position_direction[i - 1]
+        if df.longgo.iloc[i] and prev <= 0:
+            position_direction[i] = 1
+        elif df.shortgo.iloc[i] and prev >= 0:
+            position_direction[i] = -1
+        elif df.long_exit.iloc[i] and prev > 0:
+            position_direction[i] = 0
+        elif df.short_exit.iloc[i] and prev < 0:
+            position_direction[i] = 0
+        else:
+            position_direction[i] = prev
+    return position_direction
+
+
+def chandelier_exit_by_loop(df, trs, lqk_width, lqk_floor):
+    """逐行计算吊灯线止损信号的原始实现，作为数组内核的对照。"""
+    open_, high = df.adjusted_open.tolist(), df.adjusted_high.tolist()
+    low, close = df.adjusted_low.tolist(), df.adjusted_close.tolist()
+    longgo, shortgo = df.longgo.tolist(), df.shortgo.tolist()
+    n = len(df)
+    long_exit = df.long_exit.tolist() if 'long_exit' in df else [False] * n
+    short_exit = df.short_exit.tolist() if 'short_exit' in df else [False] * n
+    res = {c: [0] * n for c in ['higher_after_entry', 'lower_after_entry', 'dliqpoint', 'kliqpoint']}
+    res['liqka'] = [1] * n
+    higher, lower, liqka = res['higher_after_entry'], res['lower_after_entry'], res['liqka']
+
+    position_direction = 0
+    for i in range(n - 1):
+        if longgo[i] and position_direction <= 0:
+            position_direction = 1
+            lower[i] = max(close[i - 1], low[i])
+            continue
+        if shortgo[i] and position_direction >= 0:
+            position_direction = -1
+            higher[i] = min(close[i - 1], high[i])
+            continue
+        if long_exit[i] and position_direction > 0:
+            position_direction = 0
+            continue
+        if short_exit[i] and position_direction < 0:
+            position_direction = 0
+            continue
+        if position_direction != 0:
+            liqka[i] = max(liqka[i - 1] - lqk_width, lqk_floor)
+            delta = open_[i] * trs * liqka[i]
+            if position_direction > 0:
+                lower[i] = max(low[i], lower[i - 1])
+                res['dliqpoint'][i] = lower[i] - delta
+                if close[i] < res['dliqpoint'][i]:
+                    long_exit[i + 1] = True
+            else:
+                higher[i] = min(high[i], higher[i - 1])
+                res['kliqpoint'][i] = higher[i] + delta
+                if close[i] > res['kliqpoint'][i]:
+                    short_exit[i + 1] = True
+    res['long_exit'] = long_exit
+    res['short_exit'] = short_exit
+    return res
+
+
+def atr_exit_by_loop(df, atr, trs):
+    """逐行计算ATR止损信号的原始实现，作为数组内核的对照。"""
+    high, low, close = df.adjusted_high.tolist(), df.adjusted_low.tolist(), df.adjusted_close.tolist()
+    longgo, shortgo = df.longgo.tolist(), df.shortgo.tolist()
+    n = len(df)
+    long_exit = df.long_exit.tolist() if 'long_exit' in df else [False] * n
+    short_exit = df.short_exit.tolist() if 'short_exit' in df else [False] * n
+    highest, lowest = [0] * n, [0] * n
+
+    position_direction = 0
+    for i in range(n - 1):
+        if longgo[i] and position_direction <= 0:
+            position_direction = 1
+            lowest[i] = low[i]
+            continue
+        if shortgo[i] and position_direction >= 0:
+            position_direction = -1
+            highest[i] = high[i]
+            continue
+        if long_exit[i] and position_direction > 0:
+            position_direction = 0
+            continue
+        if short_exit[i] and position_direction < 0:
+            position_direction = 0
+            continue
+        if position_direction > 0:
+            highest[i] = max(high[i], highest[i - 1])
+            if close[i] < highest[i] - trs * atr[i]:
+                long_exit[i + 1] = True
+        elif position_direction < 0:
+            lowest[i] = min(low[i], lowest[i - 1])
+            if close[i] > lowest[i] + trs * atr[i]:
+                short_exit[i + 1] = True
+    return {'highest_after_entry': highest, 'lowest_after_entry': lowest,
+            'long_exit': long_exit, 'short_exit': short_exit}
+
+
+def avg_daily_last_adjusted_close_by_groupby(tradingday, adjusted_close, date_length):
+    """avg_daily_last_adjusted_close原先基于groupby(...).apply的实现，作为对照。"""
+    df = pd.DataFrame({'tradingday': tradingday, 'adjusted_close': adjusted_close})
+    df['tradingday_last_bar'] = (tradingday != tradingday.shift(-1).fillna(tradingday.iloc[-1]))
+    tradingday_first_bar = (tradingday != tradingday.shift(1).fillna(tradingday.iloc[0]))
+    window_first_bar = ((tradingday_first_bar.cumsum() % date_length) == 0) & tradingday_first_bar
+    df['window_idx'] = window_first_bar.cumsum()
+    avg_adjusted_close = df.groupby('window_idx').apply(lambda x: x[x.tradingday_last_bar].adjusted_close.mean())
+    avg_adjusted_close = pd.DataFrame({'avg_adjusted_close': avg_adjusted_close})
+    df['prev_window_idx'] = df.window_idx - 1
+    df['avg_adjusted_close'] = df.set_index('prev_window_idx')\
+                                 .join(avg_adjusted_close)\
+                                 .reset_index()['avg_adjusted_close']
+    df['avg_adjusted_close'] = df['avg_adjusted_close'].shift(-1)
+    return df[['tradingday_last_bar', 'window_idx', 'prev_window_idx', 'avg_adjusted_close']]
+
+
+def random_signals(n, seed):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({signal: rng.random(n) < 0.1 for signal in SIGNALS})
+
+
+def fixture_signals():
+    """tests/test_data中所有带开平仓信号的数据。"""
+    files = [TEST_DATA_DIR + 'test_add_position_direction.csv']
+    files += [TEST_DATA_DIR + 'pd_backtest/' + f for f in sorted(os.listdir(TEST_DATA_DIR + 'pd_backtest'))]
+    for file in files:
+        df = pd.read_csv(file, parse_dates=['datetime'])
+        yield file, df[SIGNALS].astype('bool')
+
+
+class AddPositionDirectionTest(unittest.TestCase):
+
+    def test_same_as_loop_on_fixtures(self):
+        for file, df in fixture_signals():
+            with self.subTest(file=file):
+                expected = position_direction_by_loop(df)
+                add_position_direction(df)
+                self.assertListEqual(expected, df['position_direction'].tolist())
+
+    def test_same_as_loop_on_random_signals(self):
+        for seed in range(5):
+            df = random_signals(500, seed)
+            expected = position_direction_by_loop(df)
+            add_position_direction(df)
+            self.assertListEqual(expected, df['position_direction'].tolist())
+
+    def test_compiled_and_python_kernels_agree(self):
+        df = random_signals(500, 0)
+        arrays = [df[signal].values for signal in SIGNALS]
+        compiled = position_direction_kernel(*arrays)
+        python = position_direction_kernel.py_func(*arrays)
+        self.assertTrue((compiled == python).all())
+
+    def test_na_signals_are_treated_as_true(self):
+        df = pd.DataFrame({'longgo': [np.nan, np.nan, False], 'shortgo': [False, False, np.nan],
+                           'long_exit': False, 'short_exit': False})
+        add_position_direction(df)
+        self.assertListEqual(df['position_direction'].tolist(), position_direction_by_loop(df))
+
+
+class AvgDailyLastAdjustedCloseTest(unittest.TestCase):
+
+    def assert_same_as_groupby(self, tradingday, adjusted_close, date_length):
+        expected = avg_daily_last_adjusted_close_by_groupby(tradingday, adjusted_close, date_length)
+        res = avg_daily_last_adjusted_close(tradingday, adjusted_close, date_length)
+        pd.testing.assert_frame_equal(expected, res, check_exact=True)
+
+    def test_same_as_groupby_on_fixture(self):
+        df = pd.read_csv(STRATEGIES_DIR + 'C74/details.csv', parse_dates=['datetime'])
+        for date_length in (1, 3, 10):
+            self.assert_same_as_groupby(df.tradingday, df.adjusted_close, date_length)
+
+    def test_same_as_groupby_on_random_data(self):
+        rng = np.random.default_rng(0)
+        for _ in range(20):
+            n = int(rng.integers(1, 2000))
+            days = np.sort(rng.integers(0, n // int(rng.integers(1, 30)) + 1, n))
+            tradingday = pd.Series(pd.Timestamp('2010-01-04') + pd.to_timedelta(days, 'D'))
+            adjusted_close = pd.Series(3000 + rng.standard_normal(n).cumsum())
+            adjusted_close[rng.random(n) < 0.05] = np.nan
+            self.assert_same_as_groupby(tradingday, adjusted_close, int(rng.integers(1, 150)))
+
+
+class CacheSignalsTest(unittest.TestCase):
+
+    @staticmethod
+    def correct_preclose_by_apply(df):
+        """逐行修正preclose的原始实现，作为对照。"""
+        df['above_line_close'] = df.close.shift(1).fillna(df.preclose.iloc[0])
+        df['preclose'] = df.apply(lambda x: x['preclose'] if x['c_chg'] else x['above_line_close'], axis=1)
+        df.drop(columns=['above_line_close'], inplace=True)
+
+    def test_correct_preclose(self):
+        m_data = pd.read_csv(TEST_DATA_DIR + 'correct_preclose/minute_data.csv')
+        correct_preclose(m_data)
+        ans = pd.read_csv(TEST_DATA_DIR + 'correct_preclose/ans.csv')
+        self.assertFalse(abs(ans - m_data).sum().any())
+
+    def test_correct_preclose_same_as_apply(self):
+        rng = np.random.default_rng(0)
+        df = pd.DataFrame({'close': rng.random(200) * 100, 'preclose': rng.random(200) * 100,
+                           'c_chg': rng.random(200) < 0.1})
+        expected = df.copy()
+        self.correct_preclose_by_apply(expected)
+        correct_preclose(df)
+        pd.testing.assert_frame_equal(expected, df)
+
+    def test_add_cache_signals(self):
+        df = pd.read_csv(TEST_DATA_DIR + 'test_add_chg_signal.csv', parse_dates=['datetime'])
+        df['preclose'] = df.close.shift(1).fillna(100)
+        expected = df.copy()
+        zero_rows, anchor = add_cache_signals(df)
+        self.assertEqual(0, zero_rows)
+        self.assertListEqual(expected['ans_next_c_chg'].astype(bool).tolist(), df['next_c_chg'].tolist())
+        self.assertListEqual(expected['ans_c_chg'].astype(bool).tolist(), df['c_chg'].tolist())
+        self.assertEqual(add_adjusted_price(expected), anchor)
+        for column in ['adjusted_open', 'adjusted_high', 'adjusted_low', 'adjusted_close']:
+            pd.testing.assert_series_equal(expected[column], df[column])
+
+    def test_zero_prices_are_counted(self):
+        df = pd.read_csv(TEST_DATA_DIR + 'test_add_chg_signal.csv', parse_dates=['datetime'])
+        df['preclose'] = df.close.shift(1).fillna(100)
+        df.loc[[1, 3], 'close'] = 0
+        df.loc[[3, 4], 'preclose'] = 0
+        self.assertEqual((3, None), add_cache_signals(df.copy()))
+        # 日内数据修正preclose后，close为0的下一行preclose也为0
+        self.assertEqual((4, None), add_cache_signals(df.copy(), intraday=True))
+        self.assertNotIn('adjusted_close', df)
+        with self.assertRaises(AddSignalError):
+            add_adjusted_price(df)
+
+
+class SignalMatrixTest(unittest.TestCase):
+
+    def test_shift_signals_treats_first_row_as_na(self):
+        signals = pd.DataFrame({'a': [True, False, True], 'b': [False, True, False]})
+        expected = signals.shift(1).astype(bool).values
+        self.assertTrue((shift_signals(signals.values) == expected).all())
+
+    def test_position_direction_matrix_same_as_columns(self):
+        dfs = [random_signals(300, seed) for seed in range(4)]
+        matrices = [np.column_stack([df[signal].values for df in dfs]) for signal in SIGNALS]
+        res = position_direction_matrix(*matrices)
+        for j, df in enumerate(dfs):
+            add_position_direction(df)
+            self.assertListEqual(df.position_direction.tolist(), res[:, j].tolist())
+
+    def test_atr_exit_matrix_same_as_columns(self):
+        df = pd.read_csv(STRATEGIES_DIR + 'C73/details.csv', parse_dates=['datetime'])
+        prices = df[['adjusted_high', 'adjusted_low', 'adjusted_close']]
+        dfs = [pd.concat([prices, random_signals(len(df), seed)], axis=1) for seed in range(3)]
+        trs = np.array([0.5, 1, 2])
+        atr = np.column_stack([ATR(prices.adjusted_high, prices.adjusted_low, prices.adjusted_close, 20).values] * 3)
+        long_exit, short_exit = atr_exit_matrix(prices.adjusted_high, prices.adjusted_low, prices.adjusted_close, atr,
+                                                *[np.column_stack([d[signal].values for d in dfs]) for signal in SIGNALS],
+                                                trs)
+        for j, d in enumerate(dfs):
+            add_atr_exit_signal(d, atr_length=20, trs=trs[j])
+            self.assertListEqual(d.long_exit.tolist(), long_exit[:, j].tolist())
+            self.assertListEqual(d.short_exit.tolist(), short_exit[:, j].tolist())
+
+
+class AddChandelierExitSignalTest(unittest.TestCase):
+    COLUMNS = ['higher_after_entry', 'lower_after_entry', 'dliqpoint', 'kliqpoint', 'liqka',
+               'long_exit', 'short_exit']
+    CASES = {
+        'C73': dict(trs=0.12, lqk_width=0.1, lqk_floor=0.5),
+        'C74': dict(trs=0.14, lqk_width=0.1, lqk_floor=0.5),
+        'C75': dict(trs=0.12, lqk_width=0.1, lqk_floor=0.5),
+        'C76': dict(trs=0.045, lqk_width=0, lqk_floor=1),
+    }
+
+    def assert_same_as_loop(self, df, **params):
+        expected = chandelier_exit_by_loop(df, **params)
+        add_chandelier_exit_signal(df, **params)
+        for column in self.COLUMNS:
+            self.assertListEqual(expected[column], df[column].tolist(), column)
+
+    def test_same_as_loop_on_strategy_fixtures(self):
+        for strategy, params in self.CASES.items():
+            df = pd.read_csv(STRATEGIES_DIR + f'{strategy}/details.csv', parse_dates=['datetime'])
+            inputs = df[['adjusted_open', 'adjusted_high', 'adjusted_low', 'adjusted_close', 'longgo', 'shortgo']]
+            with self.subTest(strategy=strategy, exit_signals='absent'):
+                self.assert_same_as_loop(inputs.copy(), **params)
+            with self.subTest(strategy=strategy, exit_signals='given'):
+                self.assert_same_as_loop(df[[*inputs.columns, 'long_exit', 'short_exit']].copy(), **params)
+
+    def test_same_as_loop_on_random_signals(self):
+        df = pd.read_csv(STRATEGIES_DIR + 'C73/details.csv', parse_dates=['datetime'])
+        prices = df[['adjusted_open', 'adjusted_high', 'adjusted_low', 'adjusted_close']] * 1.001
+        for seed in range(3):
+            signals = random_signals(len(df), seed)
+            self.assert_same_as_loop(pd.concat([prices, signals], axis=1), trs=0.03, lqk_width=0.1, lqk_floor=0.5)
+
+
+class AddAtrExitSignalTest(unittest.TestCase):
+    COLUMNS = ['highest_after_entry', 'lowest_after_entry', 'long_exit', 'short_exit']
+
+    @classmethod
+    def setUpClass(cls):
+        df = pd.read_csv(STRATEGIES_DIR + 'C73/details.csv', parse_dates=['datetime'])
+        cls.prices = df[['adjusted_high', 'adjusted_low', 'adjusted_close']] * 1.001
+
+    def assert_same_as_loop(self, df, atr_length, trs):
+        atr = ATR(df.adjusted_high, df.adjusted_low, df.adjusted_close, atr_length).tolist()
+        expected = atr_exit_by_loop(df, atr, trs)
+        add_atr_exit_signal(df, atr_length, trs)
+        for column in self.COLUMNS:
+            self.assertListEqual(expected[column], df[column].tolist(), column)
+        self.assertTrue(np.array_equal(atr, df.atr.values, equal_nan=True))
+
+    def test_same_as_loop_on_random_signals(self):
+        for seed in range(3):
+            for trs in (0.5, 2):
+                df = pd.concat([self.prices, random_signals(len(self.prices), seed)], axis=1)
+                self.assert_same_as_loop(df, atr_length=20, trs=trs)
+
+    def test_same_as_loop_with_shifted_signals(self):
+        # 策略中.shift(1)得到的开仓信号首行为NaN
+        df = self.prices.copy()
+        df['longgo'] = (df.adjusted_close > df.adjusted_close.rolling(20).mean()).shift(1)
+        df['shortgo'] = (df.adjusted_close < df.adjusted_close.rolling(20).mean()).shift(1)
+        self.assert_same_as_loop(df, atr_length=20, trs=2)
+
+    def test_atr_is_reused_across_trs(self):
+        df = pd.concat([self.prices, random_signals(len(self.prices), 0)], axis=1)
+        # 与精简模式的Tester一样，各次回测的字段引用同一段数据
+        add_atr_exit_signal(pd.DataFrame({col: df[col] for col in df.columns}, copy=False), atr_length=20, trs=0.5)
+        hits = memo.hits
+        add_atr_exit_signal(pd.DataFrame({col: df[col] for col in df.columns}, copy=False), atr_length=20, trs=2)
+        self.assertEqual(hits + 1, memo.hits)
+
+
+class IncrementalStateTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        df = pd.read_csv(STRATEGIES_DIR + 'C73/details.csv', parse_dates=['datetime'])
+        cls.prices = df[['adjusted_open', 'adjusted_high', 'adjusted_low', 'adjusted_close']]
+
+    def test_position_direction_same_as_batch(self):
+        for seed in range(3):
+            df = random_signals(1000, seed)
+            state = PositionDirectionState()
+            res = [state.update(*signals) for signals in df[SIGNALS].itertuples(index=False)]
+            add_position_direction(df)
+            self.assertListEqual(df.position_direction.tolist(), res)
+
+    def test_atr_exit_same_as_batch(self):
+        for seed in range(3):
+            for trs in (0.5, 2):
+                df = pd.concat([self.prices, random_signals(len(self.prices), seed)], axis=1)
+                state = AtrExitState(atr_length=20, trs=trs)
+                res = [state.update(bar.adjusted_high, bar.adjusted_low, bar.adjusted_close, bar.longgo, bar.shortgo,
+                                    bar.long_exit, bar.short_exit) for bar in df.itertuples(index=False)]
+                add_atr_exit_signal(df, atr_length=20, trs=trs)
+                self.assertListEqual(df.long_exit.tolist(), [long_exit for long_exit, _ in res])
+                self.assertListEqual(df.short_exit.tolist(), [short_exit for _, short_exit in res])
+
+    def test_chandelier_exit_same_as_batch(self):
+        for seed in range(3):
+            for trs, lqk_width, lqk_floor in ((0.12, 0.1, 0.5), (0.05, 0, 1), (0.3, 0.2, 0.1)):
+                df = pd.concat([self.prices, random_signals(len(self.prices), seed)], axis=1)
+                # 与策略一致，第一根bar不开仓
+                df.loc[0, ['longgo', 'shortgo']] = False
+                state = ChandelierExitState(trs, lqk_width, lqk_floor)
+                res = [state.update(bar.adjusted_open, bar.adjusted_high, bar.adjusted_low, bar.adjusted_close,
+                                    bar.longgo, bar.shortgo, bar.long_exit, bar.short_exit)
+                       for bar in df.itertuples(index=False)]
+                add_chandelier_exit_signal(df, trs=trs, lqk_width=lqk_width, lqk_floor=lqk_floor)
+                self.assertListEqual(df.long_exit.tolist(), [long_exit for long_exit, _ in res])
+                self.assertListEqual(df.short_exit.tolist(), [short_exit for _, short_exit in res])
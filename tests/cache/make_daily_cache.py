@@ -0,0 +1,106 @@
+import multiprocessing
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+import talib
+
+from backtest.cache_io import read_index, read_slice
+from backtest.cache_update import read_watermarks
+from cache.make_daily_cache import select_high_liquidity_data, select_all_data, range_views, refresh_cache
+
+
+def select_by_sma(df, threshold=50000, period=1 / 20):
+    """原先以talib.SMA与groupby实现的选取规则。"""
+    df = df.copy()
+    df['volume_gt_threshold'] = df.volume.apply(lambda x: 1 if x >= threshold else -1)
+    df['volume_gt_threshold_ma'] = talib.SMA(df.volume_gt_threshold, len(df) * period)
+    df['qualified'] = df.volume_gt_threshold_ma >= 0
+    df['qualified_chg'] = (df.qualified != df.qualified.shift(1).fillna(df.qualified.iloc[0]))
+    df['group_num'] = df['qualified_chg'].astype('int').cumsum()
+    return [sub_df for group_num, sub_df in df[df.qualified != 0].groupby('group_num')]
+
+
+class SelectHighLiquidityDataTest(unittest.TestCase):
+
+    def test_a_normal_case(self):
+        data = pd.read_csv('../test_data/high_liquidity.csv')
+        columns = data.columns.tolist()
+        res = range_views(data, select_high_liquidity_data(data))
+        self.assertListEqual(['2010/1/2', '2010/1/3', '2010/1/4', '2010/1/5',
+                              '2010/1/6', '2010/1/7', '2010/1/8', '2010/1/9'],
+                             res[0].datetime.values.tolist())
+        self.assertListEqual(['2010/1/25', '2010/1/26', '2010/1/27', '2010/1/28',
+                              '2010/1/29', '2010/1/30', '2010/1/31', '2010/2/1', '2010/2/2'],
+                             res[1].datetime.values.tolist())
+        self.assertEqual(2, len(res))
+        # 不在df中添加辅助列
+        self.assertListEqual(columns, data.columns.tolist())
+
+    def test_same_as_sma(self):
+        rng = np.random.default_rng(0)
+        for n, threshold in ((40, 50000), (100, 50000), (1000, 30000), (2333, 60000)):
+            # 成交量在阈值附近缓慢变化，形成多段入选的数据
+            volume = threshold + np.cumsum(rng.normal(0, 3000, n)).astype(int)
+            df = pd.DataFrame({'volume': volume}, index=np.arange(n) + 100)
+            expected = select_by_sma(df, threshold)
+            res = range_views(df, select_high_liquidity_data(df, threshold))
+            self.assertEqual(len(expected), len(res))
+            for sub_expected, sub_res in zip(expected, res):
+                pd.testing.assert_frame_equal(df.loc[sub_expected.index], sub_res)
+
+    def test_views(self):
+        df = pd.DataFrame({'volume': [60000] * 40, 'close': np.arange(40.)})
+        sub_df = range_views(df, select_high_liquidity_data(df))[0]
+        self.assertTrue(np.shares_memory(df.close.values, sub_df.close.values))
+
+    def test_short_data(self):
+        # 数据长度不足20时窗宽取1
+        df = pd.DataFrame({'volume': [60000, 100, 60000, 60000, 100]})
+        self.assertListEqual([(0, 1), (2, 4)], select_high_liquidity_data(df))
+        self.assertListEqual([], select_high_liquidity_data(df.iloc[:0]))
+
+    def test_select_all_data(self):
+        df = pd.DataFrame({'volume': [1, 2, 3]})
+        self.assertListEqual([(0, 3)], select_all_data(df))
+
+
+class RefreshCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        self.start_method = multiprocessing.get_start_method()
+        # Windows上子进程以spawn方式启动，不继承父进程中读取的数据
+        multiprocessing.set_start_method('spawn', force=True)
+
+    def tearDown(self):
+        multiprocessing.set_start_method(self.start_method, force=True)
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def write_daily_data(self, n):
+        rng = np.random.default_rng(0)
+        frames = []
+        for code in ('a1501', 'rb1505'):
+            close = 3000 + np.cumsum(rng.normal(0, 20, n))
+            frames.append(pd.DataFrame({'datetime': pd.bdate_range('2015-01-05', periods=n), 'code': code,
+                                        'open': close, 'high': close + 10, 'low': close - 10, 'close': close,
+                                        'preclose': close, 'volume': 60000, 'deliv_mon': 1505}))
+        pd.concat(frames).to_csv('commodity.csv', index=False)
+
+    def test_spawn(self):
+        self.write_daily_data(30)
+        refresh_cache(select_all_data, 'daily', path='commodity.csv')
+        self.write_daily_data(40)
+        refresh_cache(select_all_data, 'daily', path='commodity.csv')
+        self.assertDictEqual({'A': ['0'], 'RB': ['0']}, read_index('daily'))
+        self.assertSetEqual({'A', 'RB'}, set(read_watermarks('daily')))
+        self.assertEqual(40, len(read_slice(os.path.join('daily', 'RB', '0'))))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from cache.make_minute_cache import resample_minute_data, resample_levels, get_minute_datetime
+
+
+class ResampleMinuteDataTest(unittest.TestCase):
+
+    @staticmethod
+    def read_minute_data():
+        return pd.read_csv('../test_data/resample_minute_data/minute_data.csv', parse_dates=['datetime'])
+
+    def test_a_normal_case(self):
+        resampled = resample_minute_data(self.read_minute_data(), '10min')
+        ans = pd.read_csv('../test_data/resample_minute_data/ans.csv', parse_dates=['datetime'])
+        pd.testing.assert_frame_equal(ans, resampled)
+
+    def test_same_as_resample(self):
+        m_data = self.read_minute_data()
+        m_data['deliv_mon'] = np.arange(len(m_data))
+        for level in ('3min', '7min', '15min', '1H', '1D'):
+            expected = m_data.set_index('datetime') \
+                             .resample(level, label='right', closed='right') \
+                             .agg({'mopen': 'first', 'mclose': 'last', 'mhigh': 'max', 'mlow': 'min',
+                                   'mvolume': 'sum', 'deliv_mon': 'last'}) \
+                             .dropna() \
+                             .reset_index()
+            res = resample_minute_data(m_data, level)
+            self.assertListEqual(['datetime', 'open', 'close', 'high', 'low', 'volume', 'deliv_mon'],
+                                 res.columns.tolist())
+            self.assertTrue(np.array_equal(expected.values, res.values), level)
+
+    def test_unsorted_input(self):
+        m_data = self.read_minute_data()
+        res = resample_minute_data(m_data.iloc[::-1], '10min')
+        pd.testing.assert_frame_equal(resample_minute_data(m_data, '10min'), res)
+
+    def test_irregular_level(self):
+        with self.assertRaises(ValueError):
+            resample_minute_data(self.read_minute_data(), '1M')
+
+
+class ResampleLevelsTest(unittest.TestCase):
+
+    def test_same_as_resampling_minute_data(self):
+        m_data = pd.read_csv('../test_data/resample_minute_data/minute_data.csv', parse_dates=['datetime'])
+        levels = ['30min', '5min', '1D', '10min', '1H', '7min']
+        bars = resample_levels(m_data, levels)
+        self.assertCountEqual(levels, bars.keys())
+        for level in levels:
+            pd.testing.assert_frame_equal(resample_minute_data(m_data, level), bars[level])
+
+
+class GetMinuteDatetimeTest(unittest.TestCase):
+
+    def test_a_normal_case(self):
+        m_data = pd.DataFrame({'actionday': pd.to_datetime(['2010-01-04', '2010-01-04', '2010-01-05']),
+                               'minute': ['9:01', '21:30', '09:01:00']})
+        res = get_minute_datetime(m_data)
+        self.assertListEqual(pd.to_datetime(['2010-01-04 09:01', '2010-01-04 21:30', '2010-01-05 09:01']).tolist(),
+                             res.tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,11 @@
 import unittest
 
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
-from strategies.C74.signals import C74Tester
+from backtest.tester import BACKTEST_COLUMNS
+from strategies.C74.signals import C74Tester, add_enter_signal, add_atr_exit_signal
 # C74Tester.read_cache('daily')
 
 
@@ -22,6 +24,15 @@ class C74TesterTest(unittest.TestCase):
         cls.tester = tester
         cls.df = tester.df
         cls.res = res
+        cls.lean_tester = C74Tester(params=params, df=df)
+        cls.lean_res = cls.lean_tester.test(lean=True)
+        cls.columns = df.columns.tolist()
+        cls.source = df
+        cls.narrow_tester = C74Tester(params=params, df=df, lean=True)
+        cls.narrow_columns = cls.narrow_tester.df.columns.tolist()
+        cls.narrow_shares_memory = np.shares_memory(cls.narrow_tester.df.adjusted_close.values,
+                                                    df.adjusted_close.values)
+        cls.narrow_res = cls.narrow_tester.test(lean=True)
         # cls.df.to_csv('details.csv', index=False)
 
     @staticmethod
@@ -60,6 +71,32 @@ class C74TesterTest(unittest.TestCase):
         print(short_exit_dates)
         self.assertListEqual(short_exit_dates, ['2020-12-15 22:08', '2020-12-17 21:48', '2020-12-21 09:02'])
 
+    def test_lean_mode_gives_the_same_cum_ret(self):
+        self.assertEqual(self.res['cum_ret'], self.lean_res['cum_ret'])
+
+    def test_lean_mode_only_keeps_backtest_columns(self):
+        self.assertListEqual(list(self.lean_tester.df.columns), BACKTEST_COLUMNS)
+        self.assertGreater(self.lean_res['memory']['df_bytes'], 0)
+
+    def test_lean_construction_only_references_input_columns(self):
+        self.assertListEqual(['datetime', 'close', 'adjusted_open', 'adjusted_high', 'adjusted_low',
+                              'adjusted_close', 'preclose', 'next_c_chg', 'c_chg', 'tradingday'],
+                             self.narrow_columns)
+        self.assertTrue(self.narrow_shares_memory)
+        self.assertEqual(self.res['cum_ret'], self.narrow_res['cum_ret'])
+        # 计算信号新增的字段不写入原数据
+        self.assertListEqual(self.columns, self.source.columns.tolist())
+
+    def test_atr_exit_signal_reads_indicators_from_df(self):
+        df = self.source.copy()
+        indicators = add_enter_signal(df, date_length=10, details=False)
+        add_atr_exit_signal(df, 3, *indicators)
+        old_style = self.source.copy()
+        add_enter_signal(old_style, date_length=10)
+        add_atr_exit_signal(old_style)
+        self.assertListEqual(df.long_exit.tolist(), old_style.long_exit.tolist())
+        self.assertListEqual(df.short_exit.tolist(), old_style.short_exit.tolist())
+
     def test_cum_ret(self):
         cum_ret = pd.DataFrame(self.res['cum_ret']).set_index('datetime').plot()
         plt.show()
\ No newline at end of file
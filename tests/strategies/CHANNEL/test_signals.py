@@ -0,0 +1,43 @@
+import unittest
+from itertools import product
+
+import numpy as np
+import pandas as pd
+
+from backtest.tester import SIGNAL_COLUMNS
+from strategies.CHANNEL.signals import CHANNELTester
+from tests.strategies.fixtures import read_test_data
+
+
+class CHANNELTesterIncrementalTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.df = read_test_data()
+
+    def assert_same_as_batch(self, params, signals):
+        tester = CHANNELTester(params, self.df)
+        tester.add_signals()
+        for column in SIGNAL_COLUMNS:
+            dtype = np.int64 if column == 'position_direction' else bool
+            self.assertTrue(np.array_equal(np.asarray(tester.df[column], dtype=dtype), signals[column].values), column)
+
+    def test_replay_same_as_batch(self):
+        params_list = [dict(recent=rc, short_length=s, long_length=l, atr_length=20, trs=2, use_real_price=r)
+                       for rc, s, l, r in product((5, 60), (5, 20), (60, 240), (True, False))]
+        for params in params_list:
+            with self.subTest(params=params):
+                self.assert_same_as_batch(params, CHANNELTester(params, self.df).start_incremental())
+
+    def test_append_bars(self):
+        params_list = [dict(recent=20, short_length=5, long_length=60, atr_length=20, trs=2, use_real_price=r)
+                       for r in (True, False)]
+        for params in params_list:
+            with self.subTest(params=params):
+                tester = CHANNELTester(params, self.df.iloc[:1000])
+                head = tester.start_incremental()
+                tail = tester.append_bars(self.df.iloc[1000:1500])
+                bars = [tester.update_bar(bar) for _, bar in self.df.iloc[1500:].iterrows()]
+                signals = pd.concat([head, tail, pd.DataFrame(bars, index=self.df.index[1500:])])
+                self.assert_same_as_batch(params, signals)
+
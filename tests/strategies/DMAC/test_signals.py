@@ -0,0 +1,76 @@
+import unittest
+from itertools import product
+
+import numpy as np
+import pandas as pd
+
+from backtest.memo import memo
+from backtest.tester import SIGNAL_COLUMNS
+from strategies.DMAC.signals import DMACTester
+from tests.strategies.fixtures import read_test_data
+
+
+class DMACTesterBatchTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.df = read_test_data()
+
+    def test_batch_same_as_one_by_one(self):
+        params_list = [dict(short_length=s, long_length=l, break_in=b, atr_length=20, trs=t, use_real_price=r)
+                       for s, l, b, t, r in product((5, 20), (60, 240, 100000), (0, 0.1), (1, 2), (True, False))]
+        batch = DMACTester.test_batch(params_list, df=self.df)
+        for params, res in zip(params_list, batch):
+            with self.subTest(params=params):
+                self.assertDictEqual(DMACTester(params, self.df).test(), res)
+
+
+class DMACTesterMemoTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.df = read_test_data()
+
+    def test_testers_share_indicators(self):
+        # 各Tester引用同一段数据，只有trs不同的参数组共享ATR：第一次计算时TR与ATR未命中，之后每次ATR命中
+        for lean in (False, True):
+            with self.subTest(lean=lean):
+                memo.clear()
+                for trs in (1, 2, 3, 4):
+                    params = dict(short_length=5, long_length=60, break_in=0, atr_length=20, trs=trs,
+                                  use_real_price=False)
+                    DMACTester(params, self.df, lean=lean).test(lean=lean)
+                self.assertDictEqual({'hits': 3, 'misses': 2}, {k: memo.stats()[k] for k in ('hits', 'misses')})
+
+
+class DMACTesterIncrementalTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.df = read_test_data()
+
+    def assert_same_as_batch(self, params, signals):
+        tester = DMACTester(params, self.df)
+        tester.add_signals()
+        for column in SIGNAL_COLUMNS:
+            dtype = np.int64 if column == 'position_direction' else bool
+            self.assertTrue(np.array_equal(np.asarray(tester.df[column], dtype=dtype), signals[column].values), column)
+
+    def test_replay_same_as_batch(self):
+        params_list = [dict(short_length=s, long_length=l, break_in=b, atr_length=20, trs=t, use_real_price=r)
+                       for s, l, b, t, r in product((5, 20), (60, 240), (0, 0.1), (1, 2), (True, False))]
+        for params in params_list:
+            with self.subTest(params=params):
+                self.assert_same_as_batch(params, DMACTester(params, self.df).start_incremental())
+
+    def test_append_bars(self):
+        params_list = [dict(short_length=5, long_length=60, break_in=b, atr_length=20, trs=2, use_real_price=r)
+                       for b, r in product((0, 0.1), (True, False))]
+        for params in params_list:
+            with self.subTest(params=params):
+                tester = DMACTester(params, self.df.iloc[:1000])
+                head = tester.start_incremental()
+                tail = tester.append_bars(self.df.iloc[1000:1500])
+                bars = [tester.update_bar(bar) for _, bar in self.df.iloc[1500:].iterrows()]
+                signals = pd.concat([head, tail, pd.DataFrame(bars, index=self.df.index[1500:])])
+                self.assert_same_as_batch(params, signals)
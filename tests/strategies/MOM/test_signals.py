@@ -0,0 +1,54 @@
+import unittest
+from itertools import product
+
+import numpy as np
+import pandas as pd
+
+from backtest.tester import SIGNAL_COLUMNS
+from strategies.MOM.signals import MOMTester
+from tests.strategies.fixtures import read_test_data
+
+
+class MOMTesterBatchTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.df = read_test_data()
+
+    def test_batch_same_as_one_by_one(self):
+        params_list = [dict(period=p, use_real_price=r) for p, r in product((5, 20, 60, 100000), (True, False))]
+        batch = MOMTester.test_batch(params_list, df=self.df)
+        for params, res in zip(params_list, batch):
+            with self.subTest(params=params):
+                self.assertDictEqual(MOMTester(params, self.df).test(), res)
+
+
+class MOMTesterIncrementalTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.df = read_test_data()
+
+    def assert_same_as_batch(self, params, signals):
+        tester = MOMTester(params, self.df)
+        tester.add_signals()
+        for column in SIGNAL_COLUMNS:
+            dtype = np.int64 if column == 'position_direction' else bool
+            self.assertTrue(np.array_equal(np.asarray(tester.df[column], dtype=dtype), signals[column].values), column)
+
+    def test_replay_same_as_batch(self):
+        params_list = [dict(period=p, use_real_price=r) for p, r in product((5, 20, 60), (True, False))]
+        for params in params_list:
+            with self.subTest(params=params):
+                self.assert_same_as_batch(params, MOMTester(params, self.df).start_incremental())
+
+    def test_append_bars(self):
+        params_list = [dict(period=p, use_real_price=r) for p, r in product((5, 20), (True, False))]
+        for params in params_list:
+            with self.subTest(params=params):
+                tester = MOMTester(params, self.df.iloc[:1000])
+                head = tester.start_incremental()
+                tail = tester.append_bars(self.df.iloc[1000:1500])
+                bars = [tester.update_bar(bar) for _, bar in self.df.iloc[1500:].iterrows()]
+                signals = pd.concat([head, tail, pd.DataFrame(bars, index=self.df.index[1500:])])
+                self.assert_same_as_batch(params, signals)
@@ -0,0 +1,18 @@
+import os
+
+import pandas as pd
+
+STRATEGIES_TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def read_test_data():
+    """
+    以C74的分钟行情构造的回测数据：前复权价格为行情价格的1.01倍，每500根bar更换一次合约。
+    DMAC、MOM等策略的批量回测与逐bar模式的测试共用这份数据。
+    """
+    df = pd.read_csv(os.path.join(STRATEGIES_TEST_DIR, 'C74', 'DQA0001.csv'), parse_dates=['datetime'])
+    df[['adjusted_open', 'adjusted_high', 'adjusted_low', 'adjusted_close']] = df[['open', 'high', 'low', 'close']] * 1.01
+    df['preclose'] = df['close'].shift(1).fillna(df.close.iloc[0])
+    df['c_chg'] = df.index % 500 == 0
+    df['next_c_chg'] = df.c_chg.shift(-1).fillna(False)
+    return df
@@ -1,5 +1,7 @@
 import os
+import sys
 from datetime import datetime
+from functools import lru_cache
 
 import pymongo
 import pandas as pd
@@ -15,6 +17,52 @@ def mkdirs(path):
         os.makedirs(path)
 
 
+def peak_rss():
+    """
+    当前进程的峰值常驻内存（字节）。Windows下为峰值工作集PeakWorkingSetSize。无法获取时返回None。
+    """
+    try:
+        import resource
+    except ImportError:
+        return _windows_peak_working_set()
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux下单位为KB，macOS下单位为字节
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def _windows_peak_working_set():
+    """通过Win32 API GetProcessMemoryInfo读取当前进程的峰值工作集。"""
+    import ctypes
+    from ctypes import wintypes
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [('cb', wintypes.DWORD),
+                    ('PageFaultCount', wintypes.DWORD),
+                    ('PeakWorkingSetSize', ctypes.c_size_t),
+                    ('WorkingSetSize', ctypes.c_size_t),
+                    ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                    ('PagefileUsage', ctypes.c_size_t),
+                    ('PeakPagefileUsage', ctypes.c_size_t)]
+
+    try:
+        kernel32 = ctypes.WinDLL('kernel32')
+        psapi = ctypes.WinDLL('psapi')
+    except (AttributeError, OSError):
+        return None
+    kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+    psapi.GetProcessMemoryInfo.argtypes = [wintypes.HANDLE, ctypes.POINTER(ProcessMemoryCounters), wintypes.DWORD]
+    psapi.GetProcessMemoryInfo.restype = wintypes.BOOL
+
+    counters = ProcessMemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    if not psapi.GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+        return None
+    return counters.PeakWorkingSetSize
+
+
 def get_trading_days(data: pd.DataFrame):
     """
     获得全部交易日期。
@@ -35,15 +83,23 @@ def expand(ts: pd.DataFrame, expand_range: pd.DataFrame):
     return expand_range.join(ts)
 
 
+@lru_cache(maxsize=None)
+def get_client(client_name="mongodb://localhost:27017/"):
+    """
+    每个地址只创建一个MongoClient。MongoClient自带连接池且线程安全，可在整个进程中共用。
+    """
+    return pymongo.MongoClient(client_name)
+
+
 def query(db_name, col, client_name="mongodb://localhost:27017/", **kwargs):
     params_dict = {f'params.{k}': v for k, v in kwargs.items()}
-    client = pymongo.MongoClient(client_name)
+    client = get_client(client_name)
     db = client[db_name]
     return db[col].find(params_dict)
 
 
 def save_results(results, db_name, col_name, client_name="mongodb://localhost:27017/"):
-    client = pymongo.MongoClient(client_name)
+    client = get_client(client_name)
     db = client[db_name]
     col = db[col_name]
     col.insert_many(results)